@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Atualização incremental do banco CNPJ entre duas releases mensais
+Compara hashes de conteúdo por linha e aplica somente inserções, alterações e remoções
+"""
+
+import hashlib
+import logging
+import re
+import sqlite3
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from tabelas_derivadas import descartar_tabelas_derivadas
+
+logger = logging.getLogger(__name__)
+
+
+def hash_linha(*valores) -> str:
+    """
+    Hash do conteúdo de uma linha (registrado como função SQL)
+    
+    Args:
+        valores: Colunas da linha
+    
+    Returns:
+        Hash em hexadecimal (NULL e texto vazio geram hashes diferentes)
+    """
+    texto = '\x1f'.join('\x00' if v is None else str(v) for v in valores)
+    return hashlib.blake2b(texto.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class HashGrupo:
+    """
+    Agregado SQL: hash de um grupo de linhas que não depende da ordem
+    
+    Usado nos sócios, que não têm chave própria e são comparados por
+    cnpj_basico. Soma os hashes das linhas (em vez de XOR, para que linhas
+    repetidas não se anulem) e inclui a quantidade de linhas.
+    """
+    
+    def __init__(self):
+        self.soma = 0
+        self.quantidade = 0
+    
+    def step(self, valor):
+        self.soma = (self.soma + int(valor[:16], 16)) % (1 << 64)
+        self.quantidade += 1
+    
+    def finalize(self):
+        return f"{self.quantidade}:{self.soma:016x}"
+
+
+def registrar_geracao(conn: sqlite3.Connection, consulta_ufs: Optional[str] = None) -> int:
+    """
+    Incrementa a geração do banco e a atribui às UFs cujos dados mudaram
+    
+    A geração é um contador de importações guardado em metadados, junto com
+    um identificador do banco criado na primeira vez. A exportação por estado
+    compara a geração de cada UF com a da última exportação para saber quais
+    arquivos precisam ser refeitos.
+    
+    Args:
+        conn: Conexão com o banco (o commit fica com o chamador)
+        consulta_ufs: SELECT que retorna as UFs alteradas (None = todas as UFs
+            de estabelecimentos, usado na importação completa)
+    
+    Returns:
+        Nova geração
+    """
+    conn.execute("INSERT OR IGNORE INTO metadados (chave, valor) VALUES ('banco_id', ?)",
+                 (uuid.uuid4().hex,))
+    registro = conn.execute("SELECT valor FROM metadados WHERE chave = 'geracao'").fetchone()
+    geracao = int(registro[0]) + 1 if registro else 1
+    conn.executemany("INSERT OR REPLACE INTO metadados (chave, valor) VALUES (?, ?)", [
+        ('geracao', str(geracao)),
+        ('geracao_em', datetime.now().isoformat(timespec='seconds')),
+    ])
+    
+    if consulta_ufs is None:
+        conn.execute("DELETE FROM geracao_uf")
+        consulta_ufs = "SELECT uf FROM estabelecimentos"
+    
+    conn.execute(f'''
+        INSERT OR REPLACE INTO geracao_uf (uf, geracao)
+        SELECT DISTINCT uf, ? FROM ({consulta_ufs}) WHERE uf IS NOT NULL AND uf != ''
+    ''', (geracao,))
+    return geracao
+
+
+class AtualizadorIncremental:
+    """Aplica ao banco o delta entre a release carregada e a nova (tabelas stg_*)"""
+    
+    # Tabelas atualizadas por delta e as colunas que identificam cada registro
+    TABELAS = {
+        'empresas': ['cnpj_basico'],
+        'estabelecimentos': ['cnpj_basico', 'cnpj_ordem', 'cnpj_dv'],
+        'socios': ['cnpj_basico'],
+        'simples': ['cnpj_basico'],
+    }
+    
+    # Tabelas sem chave própria: o grupo inteiro de cada chave é substituído
+    AGRUPADAS = {'socios'}
+    
+    def __init__(self, conn: sqlite3.Connection, release: str):
+        """
+        Inicializa o atualizador
+        
+        Args:
+            conn: Conexão com o banco da release anterior
+            release: Release sendo aplicada (AAAA-MM)
+        """
+        self.conn = conn
+        self.release = release
+        
+        conn.create_function('hash_linha', -1, hash_linha, deterministic=True)
+        conn.create_aggregate('hash_grupo', 1, HashGrupo)
+    
+    @staticmethod
+    def tabela_staging(tabela: str) -> str:
+        """Nome da tabela que recebe a nova release de uma tabela"""
+        return f"stg_{tabela}"
+    
+    def preparar_staging(self):
+        """Recria vazias as tabelas stg_*, com a mesma estrutura das definitivas"""
+        for tabela in self.TABELAS:
+            staging = self.tabela_staging(tabela)
+            ddl = self.conn.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,)
+            ).fetchone()[0]
+            
+            self.conn.execute(f"DROP TABLE IF EXISTS {staging}")
+            self.conn.execute(re.sub(rf'\b{tabela}\b', staging, ddl, count=1))
+    
+    def aplicar(self) -> Dict[str, Dict[str, int]]:
+        """
+        Compara a nova release com a carregada e aplica as diferenças
+        
+        Tudo acontece em uma única transação: se algo falhar, o banco continua
+        na release anterior e as tabelas stg_* permanecem para nova tentativa.
+        
+        Returns:
+            Dicionário tabela -> {'inserido': n, 'atualizado': n, 'removido': n}
+        """
+        resumo = {}
+        nivel_anterior = self.conn.isolation_level
+        self.conn.isolation_level = None
+        
+        try:
+            self.conn.execute("BEGIN")
+            
+            # Tabelas derivadas deixam de valer (refeitas ao final da importação)
+            descartar_tabelas_derivadas(self.conn)
+            
+            # UFs com algum registro alterado (antes e depois do delta)
+            self.conn.execute("DROP TABLE IF EXISTS temp.ufs_alteradas")
+            self.conn.execute("CREATE TEMP TABLE ufs_alteradas (uf TEXT)")
+            
+            for tabela in self.TABELAS:
+                staging = self.tabela_staging(tabela)
+                if self.conn.execute(f"SELECT 1 FROM {staging} LIMIT 1").fetchone() is None:
+                    # Sem arquivos dessa tabela na nova release: não remover tudo
+                    logger.warning(f"  {tabela}: nenhum dado na release {self.release}, tabela mantida")
+                    self.conn.execute(f"DROP TABLE {staging}")
+                    continue
+                
+                resumo[tabela] = self._aplicar_tabela(tabela)
+                logger.info(f"  {tabela}: {resumo[tabela]['inserido']:,} inseridos, "
+                            f"{resumo[tabela]['atualizado']:,} alterados, "
+                            f"{resumo[tabela]['removido']:,} removidos")
+            
+            geracao = registrar_geracao(self.conn, "SELECT uf FROM temp.ufs_alteradas")
+            self.conn.execute("DROP TABLE temp.ufs_alteradas")
+            alteradas = self.conn.execute(
+                "SELECT COUNT(*) FROM geracao_uf WHERE geracao = ?", (geracao,)
+            ).fetchone()[0]
+            logger.info(f"  Geração {geracao}: {alteradas} UF(s) com dados alterados")
+            
+            self.conn.execute(
+                "INSERT OR REPLACE INTO metadados (chave, valor) VALUES ('release', ?)", (self.release,)
+            )
+            self.conn.execute("DELETE FROM metadados WHERE chave = 'release_em_carga'")
+            self.conn.execute("COMMIT")
+        
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        finally:
+            self.conn.isolation_level = nivel_anterior
+        
+        return resumo
+    
+    def _aplicar_tabela(self, tabela: str) -> Dict[str, int]:
+        """
+        Calcula e aplica o delta de uma tabela (dentro da transação de aplicar)
+        
+        Args:
+            tabela: Nome da tabela definitiva
+        
+        Returns:
+            Quantidade de chaves por operação
+        """
+        chaves = self.TABELAS[tabela]
+        staging = self.tabela_staging(tabela)
+        colunas = [linha[1] for linha in self.conn.execute(f"PRAGMA table_info({tabela})")]
+        lista_chaves = ', '.join(chaves)
+        lista_colunas = ', '.join(colunas)
+        
+        hashes = f"hash_{tabela}"
+        novos = f"hash_novo_{tabela}"
+        delta = f"delta_{tabela}"
+        
+        def juncao(a, b):
+            return ' AND '.join(f"{a}.{c} = {b}.{c}" for c in chaves)
+        
+        # Hashes da release carregada (calculados uma vez, depois mantidos a cada delta)
+        self._criar_tabela_hash(hashes, chaves)
+        if (self.conn.execute(f"SELECT 1 FROM {hashes} LIMIT 1").fetchone() is None
+                and self.conn.execute(f"SELECT 1 FROM {tabela} LIMIT 1").fetchone() is not None):
+            logger.info(f"  {tabela}: calculando hashes da release carregada (apenas na primeira vez)")
+            self.conn.execute(f"INSERT INTO {hashes} {self._consulta_hash(tabela, chaves, colunas)}")
+        
+        # Hashes da nova release
+        self.conn.execute(f"DROP TABLE IF EXISTS {novos}")
+        self._criar_tabela_hash(novos, chaves)
+        self.conn.execute(f"INSERT INTO {novos} {self._consulta_hash(staging, chaves, colunas)}")
+        
+        # Chaves que mudaram
+        self.conn.execute(f"DROP TABLE IF EXISTS temp.{delta}")
+        self.conn.execute(f"CREATE TEMP TABLE {delta} AS SELECT {lista_chaves}, '' AS operacao "
+                          f"FROM {novos} WHERE 0")
+        self.conn.execute(f'''
+            INSERT INTO {delta}
+            SELECT {', '.join(f'n.{c}' for c in chaves)},
+                   CASE WHEN a.hash IS NULL THEN 'inserido' ELSE 'atualizado' END
+            FROM {novos} n LEFT JOIN {hashes} a ON {juncao('a', 'n')}
+            WHERE a.hash IS NULL OR a.hash <> n.hash
+        ''')
+        self.conn.execute(f'''
+            INSERT INTO {delta}
+            SELECT {', '.join(f'a.{c}' for c in chaves)}, 'removido'
+            FROM {hashes} a LEFT JOIN {novos} n ON {juncao('a', 'n')}
+            WHERE n.hash IS NULL
+        ''')
+        
+        # Aplicar: remover registros alterados/removidos e inserir os novos/alterados
+        self._registrar_ufs(delta, chaves)
+        self.conn.execute(f'''
+            DELETE FROM {tabela} WHERE ({lista_chaves}) IN
+                (SELECT {lista_chaves} FROM {delta} WHERE operacao <> 'inserido')
+        ''')
+        self.conn.execute(f'''
+            INSERT INTO {tabela} ({lista_colunas})
+            SELECT {lista_colunas} FROM {staging} WHERE ({lista_chaves}) IN
+                (SELECT {lista_chaves} FROM {delta} WHERE operacao <> 'removido')
+        ''')
+        self._registrar_ufs(delta, chaves)
+        
+        # Registrar o que mudou
+        self.conn.execute(f'''
+            INSERT INTO changelog (release, tabela, chave, operacao, registrado_em)
+            SELECT ?, ?, {' || '.join(chaves)}, operacao, ? FROM {delta}
+        ''', (self.release, tabela, datetime.now().isoformat(timespec='seconds')))
+        
+        contagem = dict(self.conn.execute(f"SELECT operacao, COUNT(*) FROM {delta} GROUP BY operacao"))
+        
+        # Os hashes da nova release passam a ser os da release carregada
+        self.conn.execute(f"DROP TABLE {hashes}")
+        self.conn.execute(f"ALTER TABLE {novos} RENAME TO {hashes}")
+        self.conn.execute(f"DROP TABLE {delta}")
+        self.conn.execute(f"DROP TABLE {staging}")
+        
+        return {operacao: contagem.get(operacao, 0) for operacao in ('inserido', 'atualizado', 'removido')}
+    
+    def _registrar_ufs(self, delta: str, chaves: List[str]):
+        """
+        Anota em ufs_alteradas as UFs dos estabelecimentos ligados às chaves do delta
+        
+        Chamado antes da remoção (UF antiga) e depois da inserção (UF nova), para
+        que uma mudança de UF marque os dois estados. Nas tabelas com chave
+        cnpj_basico (empresas, sócios, Simples) entram as UFs de todas as filiais.
+        
+        Args:
+            delta: Tabela temporária com as chaves alteradas
+            chaves: Colunas de chave da tabela
+        """
+        self.conn.execute(f'''
+            INSERT INTO ufs_alteradas (uf)
+            SELECT DISTINCT uf FROM estabelecimentos WHERE ({', '.join(chaves)}) IN
+                (SELECT {', '.join(chaves)} FROM {delta})
+        ''')
+    
+    def _criar_tabela_hash(self, nome: str, chaves: List[str]):
+        """Cria (se não existir) uma tabela chave -> hash"""
+        self.conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {nome} (
+                {', '.join(f'{c} TEXT' for c in chaves)},
+                hash TEXT,
+                PRIMARY KEY ({', '.join(chaves)})
+            ) WITHOUT ROWID
+        ''')
+    
+    def _consulta_hash(self, origem: str, chaves: List[str], colunas: List[str]) -> str:
+        """SELECT que produz (chaves, hash) a partir de uma tabela"""
+        tabela = origem[len('stg_'):] if origem.startswith('stg_') else origem
+        hash_sql = f"hash_linha({', '.join(colunas)})"
+        
+        if tabela in self.AGRUPADAS:
+            return (f"SELECT {', '.join(chaves)}, hash_grupo({hash_sql}) FROM {origem} "
+                    f"GROUP BY {', '.join(chaves)}")
+        return f"SELECT {', '.join(chaves)}, {hash_sql} FROM {origem}"
@@ -5,30 +5,366 @@ Autor: Bruno Qualhato
 Data: 23 de junho de 2025
 """
 
+import csv
+import json
+import queue
+import re
 import sqlite3
 import sys
-from typing import List, Tuple, Optional
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List, Tuple, Optional
 import argparse
 
+from tabelas_derivadas import ler_estatisticas, tabela_existe
+
+
+# Marca de item ausente no cache (None também é um resultado válido)
+_AUSENTE = object()
+
+
+class CacheLRU:
+    """Cache LRU com validade opcional (TTL), seguro entre threads"""
+    
+    def __init__(self, capacidade: int = 10000, ttl: Optional[float] = None):
+        """
+        Inicializa o cache
+        
+        Args:
+            capacidade: Máximo de itens guardados (0 = sem cache)
+            ttl: Segundos de validade de cada item (None = até ser descartado)
+        """
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self.acertos = 0
+        self.faltas = 0
+        self._itens: 'OrderedDict[Any, Tuple[float, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def obter(self, chave: Any, padrao: Any = None) -> Any:
+        """Retorna o valor guardado e ainda válido, ou padrao"""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None:
+                expira, valor = item
+                if expira > time.monotonic():
+                    self._itens.move_to_end(chave)
+                    self.acertos += 1
+                    return valor
+                del self._itens[chave]
+            
+            self.faltas += 1
+            return padrao
+    
+    def guardar(self, chave: Any, valor: Any):
+        """Guarda um valor, descartando o menos usado se o cache estiver cheio"""
+        if self.capacidade <= 0:
+            return
+        expira = time.monotonic() + self.ttl if self.ttl is not None else float('inf')
+        with self._lock:
+            self._itens[chave] = (expira, valor)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.capacidade:
+                self._itens.popitem(last=False)
+    
+    def limpar(self):
+        """Descarta todos os itens (os contadores são mantidos)"""
+        with self._lock:
+            self._itens.clear()
+    
+    def resumo(self) -> dict:
+        """Tamanho, capacidade e taxa de acerto"""
+        consultas = self.acertos + self.faltas
+        return {
+            'itens': len(self._itens),
+            'capacidade': self.capacidade,
+            'ttl_segundos': self.ttl,
+            'acertos': self.acertos,
+            'faltas': self.faltas,
+            'taxa_acerto': self.acertos / consultas if consultas else 0.0
+        }
+
+
+class PoolConexoes:
+    """Conexões somente leitura reaproveitadas entre consultas e threads"""
+    
+    def __init__(self, db_path: str, tamanho: int = 4, mmap_mb: int = 1024,
+                 cache_mb: int = 64, instrucoes_em_cache: int = 256):
+        """
+        Inicializa o pool (as conexões são abertas sob demanda)
+        
+        Args:
+            db_path: Caminho do banco SQLite
+            tamanho: Máximo de conexões abertas ao mesmo tempo
+            mmap_mb: Tamanho do mapeamento em memória por conexão (MB); as páginas
+                     mapeadas ficam no cache do sistema e são compartilhadas
+            cache_mb: Cache de páginas de cada conexão (MB)
+            instrucoes_em_cache: Instruções preparadas mantidas por conexão
+        
+        Raises:
+            FileNotFoundError: Se o banco não existe
+        """
+        caminho = Path(db_path).resolve()
+        if not caminho.exists():
+            raise FileNotFoundError(f"Banco de dados não encontrado: {db_path}")
+        
+        self.uri = caminho.as_uri() + '?mode=ro'
+        self.tamanho = max(1, tamanho)
+        self.mmap_mb = mmap_mb
+        self.cache_mb = cache_mb
+        self.instrucoes_em_cache = instrucoes_em_cache
+        
+        self._livres: queue.LifoQueue = queue.LifoQueue()
+        self._todas: List[sqlite3.Connection] = []
+        self._vagas = threading.Semaphore(self.tamanho)
+        self._lock = threading.Lock()
+        self._fechado = False
+    
+    def _abrir(self) -> sqlite3.Connection:
+        """Abre e configura uma nova conexão"""
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False,
+                               cached_statements=self.instrucoes_em_cache)
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_mb * 1024 * 1024}")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_mb * 1024}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
+    @contextmanager
+    def conexao(self):
+        """
+        Empresta uma conexão do pool, aguardando se todas estiverem em uso
+        
+        Yields:
+            Conexão somente leitura, devolvida ao pool ao final do bloco
+        """
+        self._vagas.acquire()
+        try:
+            try:
+                conn = self._livres.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._fechado:
+                        raise RuntimeError("Pool de conexões fechado")
+                    conn = self._abrir()
+                    self._todas.append(conn)
+            
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                self._livres.put(conn)
+        finally:
+            self._vagas.release()
+    
+    def fechar(self):
+        """Fecha todas as conexões abertas"""
+        with self._lock:
+            self._fechado = True
+            for conn in self._todas:
+                conn.close()
+            self._todas.clear()
+        while not self._livres.empty():
+            self._livres.get_nowait()
+
+
+class _GruposPorPosicao:
+    """Agrupa as linhas de um cursor ordenado pela primeira coluna (posição no lote)"""
+    
+    def __init__(self, cursor):
+        self._cursor = iter(cursor)
+        self._proxima = next(self._cursor, None)
+    
+    def linhas(self, posicao: int) -> List[tuple]:
+        """Linhas da posição informada, sem a coluna de posição (posições crescentes)"""
+        encontradas = []
+        while self._proxima is not None and self._proxima[0] <= posicao:
+            if self._proxima[0] == posicao:
+                encontradas.append(self._proxima[1:])
+            self._proxima = next(self._cursor, None)
+        return encontradas
+
+
 class CNPJQuery:
     """Classe para consultas no banco de dados CNPJ"""
     
-    def __init__(self, db_path: str = "./cnpj_dados.db"):
+    def __init__(self, db_path: str = "./cnpj_dados.db", tamanho_pool: int = 4,
+                 cache_tamanho: int = 10000, verificar_geracao_a_cada: float = 1.0):
         """
         Inicializa a classe de consultas
         
+        As consultas usam um pool de conexões somente leitura mantidas abertas
+        (cache de páginas e instruções preparadas aquecidos entre chamadas).
+        Use como gerenciador de contexto ou chame fechar() ao terminar.
+        
+        Empresa, estabelecimentos e sócios por CNPJ básico ficam em um cache
+        LRU, descartado quando uma importação muda a geração dos dados
+        (metadados 'banco_id' e 'geracao'); sem banco_id nada é guardado.
+        
         Args:
             db_path: Caminho do banco SQLite
+            tamanho_pool: Máximo de conexões simultâneas (consultas em threads)
+            cache_tamanho: Consultas por CNPJ mantidas no cache (0 = sem cache)
+            verificar_geracao_a_cada: Intervalo mínimo, em segundos, entre as
+                                      leituras da geração dos dados
+        
+        Raises:
+            FileNotFoundError: Se o banco não existe
         """
         self.db_path = db_path
+        self.pool = PoolConexoes(db_path, tamanho=tamanho_pool)
+        self.cache = CacheLRU(cache_tamanho)
+        self.verificar_geracao_a_cada = verificar_geracao_a_cada
+        self._geracao = None
+        self._proxima_verificacao = 0.0
+    
+    def __enter__(self) -> 'CNPJQuery':
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.fechar()
+    
+    def fechar(self):
+        """Fecha as conexões do pool"""
+        self.pool.fechar()
+    
+    def conexao(self):
+        """Empresta uma conexão do pool (usar com 'with')"""
+        return self.pool.conexao()
+    
+    def geracao_dados(self) -> Optional[Tuple[str, str]]:
+        """
+        Identificação dos dados atuais: (banco_id, geracao) de metadados
+        
+        Returns:
+            Tupla que muda a cada importação, ou None em bancos sem controle de gerações
+        """
+        with self.conexao() as conn:
+            try:
+                valores = dict(conn.execute(
+                    "SELECT chave, valor FROM metadados WHERE chave IN ('banco_id', 'geracao')"
+                ))
+            except sqlite3.OperationalError:
+                return None
+        if not valores:
+            return None
+        return valores.get('banco_id'), valores.get('geracao')
+    
+    def geracao_atual(self):
+        """Geração dos dados, relida no máximo a cada verificar_geracao_a_cada segundos"""
+        agora = time.monotonic()
+        if agora >= self._proxima_verificacao:
+            self._proxima_verificacao = agora + self.verificar_geracao_a_cada
+            geracao = self.geracao_dados()
+            if geracao != self._geracao:
+                if self._geracao is not None:
+                    self.cache.limpar()
+                self._geracao = geracao
+        return self._geracao
+    
+    def _em_cache(self, tipo: str, cnpj_basico: str, consultar):
+        """
+        Resultado de uma consulta por CNPJ básico, do cache ou do banco
+        
+        A chave inclui a geração dos dados: um resultado lido durante uma
+        importação nunca é servido depois que a geração muda. Sem banco_id
+        (banco sem controle de gerações ou com a geração sendo refeita) nada
+        invalidaria o resultado, e a consulta vai sempre ao banco.
+        
+        Args:
+            tipo: 'empresa', 'estabelecimentos' ou 'socios'
+            cnpj_basico: CNPJ básico
+            consultar: Função que consulta o banco
+        """
+        geracao = self.geracao_atual() if self.cache.capacidade > 0 else None
+        if geracao is None or geracao[0] is None:
+            return consultar(cnpj_basico)
+        
+        chave = (geracao, tipo, cnpj_basico)
+        resultado = self.cache.obter(chave, _AUSENTE)
+        if resultado is _AUSENTE:
+            resultado = consultar(cnpj_basico)
+            self.cache.guardar(chave, resultado)
+        return resultado
+    
+    def limpar_cache(self):
+        """Descarta as consultas em cache (ex: banco alterado sem mudar a geração)"""
+        self.cache.limpar()
+    
+    def estatisticas_cache(self) -> dict:
+        """Itens, acertos e faltas do cache de consultas por CNPJ"""
+        return {**self.cache.resumo(), 'geracao': self._geracao}
     
     def get_connection(self) -> sqlite3.Connection:
-        """Retorna uma conexão com o banco"""
+        """Retorna uma nova conexão com o banco, fora do pool (o chamador a fecha)"""
         return sqlite3.connect(self.db_path)
     
+    # Colunas das consultas por CNPJ (na ordem lida por _empresa, _estabelecimento e _socio)
+    COLUNAS_EMPRESA = """cnpj_basico, razao_social, natureza_juridica,
+               qualificacao_responsavel, capital_social, porte_empresa, ente_federativo"""
+    COLUNAS_ESTABELECIMENTO = """cnpj_basico, cnpj_ordem, cnpj_dv, identificador_matriz_filial,
+               nome_fantasia, situacao_cadastral, data_situacao_cadastral,
+               nome_cidade_exterior, data_inicio_atividade, cnae_fiscal_principal,
+               tipo_logradouro, logradouro, numero, complemento, bairro,
+               cep, uf, codigo_municipio, ddd_1, telefone_1, correio_eletronico"""
+    COLUNAS_SOCIO = """nome_socio, cpf_cnpj_socio, codigo_qualificacao_socio,
+               data_entrada_sociedade, representante_legal, nome_representante"""
+    
+    @staticmethod
+    def _empresa(result: tuple) -> dict:
+        """Converte uma linha de COLUNAS_EMPRESA em dicionário"""
+        return {
+            'cnpj_basico': result[0],
+            'razao_social': result[1],
+            'natureza_juridica': result[2],
+            'qualificacao_responsavel': result[3],
+            'capital_social': result[4],
+            'porte_empresa': result[5],
+            'ente_federativo': result[6]
+        }
+    
+    @staticmethod
+    def _estabelecimento(result: tuple) -> dict:
+        """Converte uma linha de COLUNAS_ESTABELECIMENTO em dicionário"""
+        return {
+            'cnpj_completo': f"{result[0]}{result[1]}{result[2]}",
+            'cnpj_basico': result[0],
+            'cnpj_ordem': result[1],
+            'cnpj_dv': result[2],
+            'tipo': 'Matriz' if result[3] == '1' else 'Filial',
+            'nome_fantasia': result[4],
+            'situacao': result[5],
+            'data_situacao': result[6],
+            'cidade_exterior': result[7],
+            'data_inicio': result[8],
+            'cnae_principal': result[9],
+            'endereco': f"{result[10]} {result[11]}, {result[12]} - {result[14]}",
+            'cep': result[15],
+            'uf': result[16],
+            'municipio': result[17],
+            'telefone': f"({result[18]}) {result[19]}" if result[18] and result[19] else None,
+            'email': result[20]
+        }
+    
+    @staticmethod
+    def _socio(result: tuple) -> dict:
+        """Converte uma linha de COLUNAS_SOCIO em dicionário"""
+        return {
+            'nome': result[0],
+            'cpf_cnpj': result[1],
+            'qualificacao': result[2],
+            'data_entrada': result[3],
+            'representante_legal': result[4],
+            'nome_representante': result[5]
+        }
+    
     def buscar_empresa_por_cnpj(self, cnpj_basico: str) -> Optional[dict]:
         """
-        Busca empresa pelo CNPJ básico
+        Busca empresa pelo CNPJ básico (com cache)
         
         Args:
             cnpj_basico: CNPJ básico (8 primeiros dígitos)
@@ -36,127 +372,204 @@ class CNPJQuery:
         Returns:
             Dados da empresa ou None
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT cnpj_basico, razao_social, natureza_juridica, 
-               qualificacao_responsavel, capital_social, porte_empresa, ente_federativo
-        FROM empresas 
-        WHERE cnpj_basico = ?
-        """
-        
-        cursor.execute(query, (cnpj_basico,))
-        result = cursor.fetchone()
-        
-        conn.close()
-        
-        if result:
-            return {
-                'cnpj_basico': result[0],
-                'razao_social': result[1],
-                'natureza_juridica': result[2],
-                'qualificacao_responsavel': result[3],
-                'capital_social': result[4],
-                'porte_empresa': result[5],
-                'ente_federativo': result[6]
-            }
-        return None
+        empresa = self._em_cache('empresa', cnpj_basico, self._consultar_empresa)
+        return dict(empresa) if empresa else None
     
     def buscar_estabelecimentos_por_cnpj(self, cnpj_basico: str) -> List[dict]:
         """
-        Busca estabelecimentos pelo CNPJ básico
+        Busca estabelecimentos pelo CNPJ básico (com cache)
         
         Args:
             cnpj_basico: CNPJ básico (8 primeiros dígitos)
-            
+        
         Returns:
             Lista de estabelecimentos
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT cnpj_basico, cnpj_ordem, cnpj_dv, identificador_matriz_filial,
-               nome_fantasia, situacao_cadastral, data_situacao_cadastral,
-               nome_cidade_exterior, data_inicio_atividade, cnae_fiscal_principal,
-               tipo_logradouro, logradouro, numero, complemento, bairro,
-               cep, uf, codigo_municipio, ddd_1, telefone_1, correio_eletronico
-        FROM estabelecimentos 
-        WHERE cnpj_basico = ?
-        """
-        
-        cursor.execute(query, (cnpj_basico,))
-        results = cursor.fetchall()
-        
-        conn.close()
-        
-        estabelecimentos = []
-        for result in results:
-            estabelecimentos.append({
-                'cnpj_completo': f"{result[0]}{result[1]}{result[2]}",
-                'cnpj_basico': result[0],
-                'cnpj_ordem': result[1],
-                'cnpj_dv': result[2],
-                'tipo': 'Matriz' if result[3] == '1' else 'Filial',
-                'nome_fantasia': result[4],
-                'situacao': result[5],
-                'data_situacao': result[6],
-                'cidade_exterior': result[7],
-                'data_inicio': result[8],
-                'cnae_principal': result[9],
-                'endereco': f"{result[10]} {result[11]}, {result[12]} - {result[14]}",
-                'cep': result[15],
-                'uf': result[16],
-                'municipio': result[17],
-                'telefone': f"({result[18]}) {result[19]}" if result[18] and result[19] else None,
-                'email': result[20]
-            })
-        
-        return estabelecimentos
+        return [dict(e) for e in self._em_cache('estabelecimentos', cnpj_basico,
+                                                self._consultar_estabelecimentos)]
     
     def buscar_socios_por_cnpj(self, cnpj_basico: str) -> List[dict]:
         """
-        Busca sócios pelo CNPJ básico
+        Busca sócios pelo CNPJ básico (com cache)
         
         Args:
             cnpj_basico: CNPJ básico (8 primeiros dígitos)
-            
+        
         Returns:
             Lista de sócios
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        return [dict(s) for s in self._em_cache('socios', cnpj_basico, self._consultar_socios)]
+    
+    def _consultar_empresa(self, cnpj_basico: str) -> Optional[dict]:
+        """Lê a empresa no banco (sem cache)"""
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            
+            query = f"""
+            SELECT {self.COLUNAS_EMPRESA}
+            FROM empresas 
+            WHERE cnpj_basico = ?
+            """
+            
+            cursor.execute(query, (cnpj_basico,))
+            result = cursor.fetchone()
+        
+        if result:
+            return self._empresa(result)
+        return None
+    
+    def _consultar_estabelecimentos(self, cnpj_basico: str) -> Tuple[dict, ...]:
+        """Lê os estabelecimentos no banco (sem cache)"""
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            
+            query = f"""
+            SELECT {self.COLUNAS_ESTABELECIMENTO}
+            FROM estabelecimentos 
+            WHERE cnpj_basico = ?
+            """
+            
+            cursor.execute(query, (cnpj_basico,))
+            results = cursor.fetchall()
+        
+        return tuple(self._estabelecimento(result) for result in results)
+    
+    def _consultar_socios(self, cnpj_basico: str) -> Tuple[dict, ...]:
+        """Lê os sócios no banco (sem cache)"""
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            
+            query = f"""
+            SELECT {self.COLUNAS_SOCIO}
+            FROM socios 
+            WHERE cnpj_basico = ?
+            """
+            
+            cursor.execute(query, (cnpj_basico,))
+            results = cursor.fetchall()
         
-        query = """
-        SELECT nome_socio, cpf_cnpj_socio, codigo_qualificacao_socio,
-               data_entrada_sociedade, representante_legal, nome_representante
-        FROM socios 
-        WHERE cnpj_basico = ?
+        return tuple(self._socio(result) for result in results)
+    
+    @staticmethod
+    def normalizar_cnpj(cnpj: str) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
         """
+        Separa um CNPJ digitado em (básico, ordem, dígitos verificadores)
         
-        cursor.execute(query, (cnpj_basico,))
-        results = cursor.fetchall()
+        Aceita 8 dígitos (empresa) ou 14 dígitos (estabelecimento), com ou sem
+        pontuação; zeros à esquerda perdidos (ex: planilhas) são recompostos.
         
-        conn.close()
+        Args:
+            cnpj: CNPJ como veio na entrada (ex: "33.000.167/0001-01" ou "33000167")
         
-        socios = []
-        for result in results:
-            socios.append({
-                'nome': result[0],
-                'cpf_cnpj': result[1],
-                'qualificacao': result[2],
-                'data_entrada': result[3],
-                'representante_legal': result[4],
-                'nome_representante': result[5]
-            })
+        Returns:
+            (cnpj_basico, cnpj_ordem, cnpj_dv), com ordem e dv None para CNPJ
+            básico, ou None se a entrada não é um CNPJ
+        """
+        digitos = re.sub(r'\D', '', cnpj or '')
+        if not digitos or len(digitos) > 14:
+            return None
+        if len(digitos) <= 8:
+            return digitos.zfill(8), None, None
+        digitos = digitos.zfill(14)
+        return digitos[:8], digitos[8:12], digitos[12:]
+    
+    def buscar_lote(self, cnpjs: Iterable[str], incluir_socios: bool = True) -> Iterator[dict]:
+        """
+        Consulta uma lista de CNPJs de uma vez
+        
+        As chaves vão para uma tabela temporária e cada tabela (empresas,
+        estabelecimentos, sócios) é lida com uma única junção na ordem da
+        entrada; os resultados são combinados e devolvidos um a um, sem
+        manter o lote inteiro em memória. CNPJ com 14 dígitos traz apenas
+        aquele estabelecimento; com 8 dígitos, todos os da empresa.
+        
+        Args:
+            cnpjs: CNPJs com 8 ou 14 dígitos, com ou sem pontuação
+            incluir_socios: Se deve trazer os sócios de cada empresa
         
-        return socios
+        Yields:
+            Um dicionário por CNPJ da entrada, na mesma ordem: entrada,
+            cnpj_basico, encontrado, empresa, estabelecimentos e socios
+            (None/listas vazias quando não encontrado; erro se inválido)
+        """
+        with self.conexao() as conn:
+            # Conexão aberta com mode=ro: liberar query_only só permite gravar no banco temporário
+            conn.execute("PRAGMA query_only=OFF")
+            cursores = []
+            try:
+                conn.execute("DROP TABLE IF EXISTS temp.lote_cnpjs")
+                conn.execute("""
+                    CREATE TEMP TABLE lote_cnpjs (
+                        posicao INTEGER PRIMARY KEY,
+                        entrada TEXT,
+                        chave_basico TEXT,
+                        chave_ordem TEXT,
+                        chave_dv TEXT
+                    )
+                """)
+                conn.executemany(
+                    "INSERT INTO lote_cnpjs VALUES (?, ?, ?, ?, ?)",
+                    ((posicao, entrada, *(self.normalizar_cnpj(entrada) or (None, None, None)))
+                     for posicao, entrada in enumerate(cnpjs))
+                )
+                conn.commit()
+                
+                lote = conn.execute("SELECT posicao, entrada, chave_basico FROM lote_cnpjs ORDER BY posicao")
+                empresas = conn.execute(f"""
+                    SELECT l.posicao, {self.COLUNAS_EMPRESA}
+                    FROM lote_cnpjs l
+                    JOIN empresas ON cnpj_basico = l.chave_basico
+                    ORDER BY l.posicao
+                """)
+                estabelecimentos = conn.execute(f"""
+                    SELECT l.posicao, {self.COLUNAS_ESTABELECIMENTO}
+                    FROM lote_cnpjs l
+                    JOIN estabelecimentos ON cnpj_basico = l.chave_basico
+                                         AND (l.chave_ordem IS NULL
+                                              OR (cnpj_ordem = l.chave_ordem AND cnpj_dv = l.chave_dv))
+                    ORDER BY l.posicao
+                """)
+                socios = conn.execute(f"""
+                    SELECT l.posicao, {self.COLUNAS_SOCIO}
+                    FROM lote_cnpjs l
+                    JOIN socios ON cnpj_basico = l.chave_basico
+                    ORDER BY l.posicao
+                """) if incluir_socios else iter(())
+                
+                cursores.extend([lote, empresas, estabelecimentos] + ([socios] if incluir_socios else []))
+                
+                por_empresa = _GruposPorPosicao(empresas)
+                por_estabelecimento = _GruposPorPosicao(estabelecimentos)
+                por_socio = _GruposPorPosicao(socios)
+                
+                for posicao, entrada, cnpj_basico in lote:
+                    empresa = por_empresa.linhas(posicao)
+                    resultado = {
+                        'entrada': entrada,
+                        'cnpj_basico': cnpj_basico,
+                        'encontrado': bool(empresa),
+                        'empresa': self._empresa(empresa[0]) if empresa else None,
+                        'estabelecimentos': [self._estabelecimento(r) for r in por_estabelecimento.linhas(posicao)],
+                        'socios': [self._socio(r) for r in por_socio.linhas(posicao)]
+                    }
+                    if cnpj_basico is None:
+                        resultado['erro'] = 'CNPJ inválido'
+                    yield resultado
+            finally:
+                # Cursores pendentes (lote abandonado no meio) impediriam o DROP
+                for cursor in cursores:
+                    cursor.close()
+                conn.execute("DROP TABLE IF EXISTS temp.lote_cnpjs")
+                conn.commit()
+                conn.execute("PRAGMA query_only=ON")
     
     def buscar_por_razao_social(self, termo: str, limit: int = 10) -> List[dict]:
         """
         Busca empresas por razão social
         
+        Usa o índice de texto completo (busca_empresas) quando existe, com os
+        resultados mais relevantes primeiro; sem o índice, recorre a LIKE.
+        
         Args:
             termo: Termo para busca
             limit: Limite de resultados
@@ -164,28 +577,99 @@ class CNPJQuery:
         Returns:
             Lista de empresas encontradas
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        resultado = self.buscar_texto(termo, limit, colunas=['razao_social'])
+        if resultado is not None:
+            return [{k: emp[k] for k in ('cnpj_basico', 'razao_social', 'porte')} for emp in resultado]
+        
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            
+            query = """
+            SELECT cnpj_basico, razao_social, porte_empresa
+            FROM empresas 
+            WHERE razao_social LIKE ?
+            ORDER BY razao_social
+            LIMIT ?
+            """
+            
+            cursor.execute(query, (f"%{termo}%", limit))
+            results = cursor.fetchall()
+        
+        empresas = []
+        for result in results:
+            empresas.append({
+                'cnpj_basico': result[0],
+                'razao_social': result[1],
+                'porte': result[2]
+            })
         
-        query = """
-        SELECT cnpj_basico, razao_social, porte_empresa
-        FROM empresas 
-        WHERE razao_social LIKE ?
-        ORDER BY razao_social
-        LIMIT ?
+        return empresas
+    
+    @staticmethod
+    def expressao_busca(termo: str) -> Optional[str]:
         """
+        Converte o termo digitado em uma consulta FTS5 por prefixo
         
-        cursor.execute(query, (f"%{termo}%", limit))
-        results = cursor.fetchall()
+        Cada palavra vira um prefixo entre aspas ("PETRO" "BRAS" -> "petro"* "bras"*),
+        exigindo todas as palavras; operadores e pontuação do termo são ignorados.
         
-        conn.close()
+        Args:
+            termo: Texto digitado
+        
+        Returns:
+            Expressão para MATCH, ou None se o termo não tem palavras
+        """
+        palavras = re.findall(r'\w+', termo.lower())
+        if not palavras:
+            return None
+        return ' '.join(f'"{palavra}"*' for palavra in palavras)
+    
+    def buscar_texto(self, termo: str, limit: int = 10,
+                     colunas: Optional[List[str]] = None) -> Optional[List[dict]]:
+        """
+        Busca ordenada por relevância na razão social e nos nomes fantasia
+        
+        Usa o índice FTS5 busca_empresas (criado ao final da importação):
+        palavras por prefixo, sem diferenciar acentos e maiúsculas, ordenadas
+        pela relevância (bm25) configurada no índice, com peso maior para a
+        razão social.
+        
+        Args:
+            termo: Palavras ou inícios de palavras (ex: "petro bras")
+            limit: Limite de resultados
+            colunas: Colunas pesquisadas (padrão: razao_social e nome_fantasia)
+        
+        Returns:
+            Lista de empresas encontradas, ou None se o índice não existe
+        """
+        with self.conexao() as conn:
+            if not tabela_existe(conn, 'busca_empresas'):
+                return None
+            
+            expressao = self.expressao_busca(termo)
+            if expressao is None:
+                return []
+            if colunas:
+                expressao = f"{{{' '.join(colunas)}}} : ({expressao})"
+            
+            query = """
+            SELECT b.cnpj_basico, b.razao_social, b.nome_fantasia, emp.porte_empresa
+            FROM busca_empresas b
+            LEFT JOIN empresas emp ON emp.cnpj_basico = b.cnpj_basico
+            WHERE busca_empresas MATCH ?
+            ORDER BY rank
+            LIMIT ?
+            """
+            
+            results = conn.execute(query, (expressao, limit)).fetchall()
         
         empresas = []
         for result in results:
             empresas.append({
                 'cnpj_basico': result[0],
                 'razao_social': result[1],
-                'porte': result[2]
+                'nome_fantasia': result[2],
+                'porte': result[3]
             })
         
         return empresas
@@ -201,23 +685,21 @@ class CNPJQuery:
         Returns:
             Lista de estabelecimentos
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        query = """
-        SELECT e.cnpj_basico, emp.razao_social, e.nome_fantasia, 
-               e.uf, e.codigo_municipio, e.situacao_cadastral
-        FROM estabelecimentos e
-        LEFT JOIN empresas emp ON e.cnpj_basico = emp.cnpj_basico
-        WHERE e.uf = ?
-        ORDER BY emp.razao_social
-        LIMIT ?
-        """
-        
-        cursor.execute(query, (uf.upper(), limit))
-        results = cursor.fetchall()
-        
-        conn.close()
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            
+            query = """
+            SELECT e.cnpj_basico, emp.razao_social, e.nome_fantasia, 
+                   e.uf, e.codigo_municipio, e.situacao_cadastral
+            FROM estabelecimentos e
+            LEFT JOIN empresas emp ON e.cnpj_basico = emp.cnpj_basico
+            WHERE e.uf = ?
+            ORDER BY emp.razao_social
+            LIMIT ?
+            """
+            
+            cursor.execute(query, (uf.upper(), limit))
+            results = cursor.fetchall()
         
         estabelecimentos = []
         for result in results:
@@ -232,53 +714,199 @@ class CNPJQuery:
         
         return estabelecimentos
     
+    def buscar_por_cnae_secundario(self, cnae: str, uf: Optional[str] = None,
+                                   limit: int = 100) -> Optional[List[dict]]:
+        """
+        Busca estabelecimentos que têm um CNAE entre as atividades secundárias
+        
+        Usa a tabela estabelecimento_cnae_secundario (criada ao final da
+        importação), pelo índice de CNAE, em vez de procurar o código no texto
+        de cnae_fiscal_secundaria de cada estabelecimento.
+        
+        Args:
+            cnae: Código CNAE (7 dígitos)
+            uf: Se informada, só estabelecimentos desta UF
+            limit: Limite de resultados
+        
+        Returns:
+            Lista de estabelecimentos em ordem de CNPJ, ou None se a tabela não existe
+        """
+        with self.conexao() as conn:
+            if not tabela_existe(conn, 'estabelecimento_cnae_secundario'):
+                return None
+            
+            query = """
+            SELECT e.cnpj_basico, e.cnpj_ordem, e.cnpj_dv, emp.razao_social, e.nome_fantasia,
+                   e.uf, e.cnae_fiscal_principal
+            FROM estabelecimento_cnae_secundario ecs
+            JOIN estabelecimentos e ON e.cnpj_basico = ecs.cnpj_basico
+                                   AND e.cnpj_ordem = ecs.cnpj_ordem
+                                   AND e.cnpj_dv = ecs.cnpj_dv
+            LEFT JOIN empresas emp ON e.cnpj_basico = emp.cnpj_basico
+            WHERE ecs.cnae = ? AND (? IS NULL OR e.uf = ?)
+            ORDER BY ecs.cnpj_basico, ecs.cnpj_ordem, ecs.cnpj_dv
+            LIMIT ?
+            """
+            
+            uf = uf.upper() if uf else None
+            results = conn.execute(query, (cnae, uf, uf, limit)).fetchall()
+        
+        estabelecimentos = []
+        for result in results:
+            estabelecimentos.append({
+                'cnpj': result[0] + result[1] + result[2],
+                'cnpj_basico': result[0],
+                'razao_social': result[3],
+                'nome_fantasia': result[4],
+                'uf': result[5],
+                'cnae_principal': result[6]
+            })
+        
+        return estabelecimentos
+    
     def estatisticas_gerais(self) -> dict:
         """
         Retorna estatísticas gerais do banco
         
+        Usa a tabela estatisticas (calculada ao final da importação) e só
+        percorre as tabelas se ela não existir.
+        
         Returns:
             Dicionário com estatísticas
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        stats = {}
+        with self.conexao() as conn:
+            cursor = conn.cursor()
+            
+            stats = {}
+            
+            totais = ler_estatisticas(conn, 'tabela')
+            if totais is not None:
+                situacoes = ler_estatisticas(conn, 'situacao_cadastral')
+                por_uf = ler_estatisticas(conn, 'uf')
+                portes = ler_estatisticas(conn, 'porte_empresa')
+                
+                stats['total_empresas'] = totais.get('empresas', 0)
+                stats['total_estabelecimentos'] = totais.get('estabelecimentos', 0)
+                stats['estabelecimentos_ativos'] = situacoes.get('02', 0)
+                stats['top_ufs'] = sorted(por_uf.items(), key=lambda item: item[1], reverse=True)[:10]
+                stats['portes'] = sorted(portes.items(), key=lambda item: item[1], reverse=True)
+                
+                return stats
+            
+            # Total de empresas
+            cursor.execute("SELECT COUNT(*) FROM empresas")
+            stats['total_empresas'] = cursor.fetchone()[0]
+            
+            # Total de estabelecimentos
+            cursor.execute("SELECT COUNT(*) FROM estabelecimentos")
+            stats['total_estabelecimentos'] = cursor.fetchone()[0]
+            
+            # Estabelecimentos ativos
+            cursor.execute("SELECT COUNT(*) FROM estabelecimentos WHERE situacao_cadastral = '02'")
+            stats['estabelecimentos_ativos'] = cursor.fetchone()[0]
+            
+            # Empresas por UF
+            cursor.execute("""
+                SELECT uf, COUNT(*) as total 
+                FROM estabelecimentos 
+                WHERE uf IS NOT NULL 
+                GROUP BY uf 
+                ORDER BY total DESC 
+                LIMIT 10
+            """)
+            stats['top_ufs'] = cursor.fetchall()
+            
+            # Portes de empresa
+            cursor.execute("""
+                SELECT porte_empresa, COUNT(*) as total 
+                FROM empresas 
+                WHERE porte_empresa IS NOT NULL 
+                GROUP BY porte_empresa 
+                ORDER BY total DESC
+            """)
+            stats['portes'] = cursor.fetchall()
+            
+            return stats
+
+
+# Colunas do CSV de lote: uma linha por estabelecimento encontrado (ou por CNPJ não encontrado)
+COLUNAS_LOTE = ['entrada', 'encontrado', 'cnpj_completo', 'razao_social', 'natureza_juridica',
+                'capital_social', 'porte_empresa', 'tipo', 'nome_fantasia', 'situacao',
+                'data_inicio', 'cnae_principal', 'endereco', 'cep', 'uf', 'municipio',
+                'telefone', 'email', 'total_socios', 'socios']
+
+
+def ler_cnpjs_arquivo(caminho: str) -> Iterator[str]:
+    """
+    Lê os CNPJs de um arquivo CSV (ou um CNPJ por linha)
+    
+    Usa a coluna "cnpj" se o cabeçalho tiver uma; senão, a primeira coluna.
+    Uma primeira linha sem dígitos é tratada como cabeçalho.
+    
+    Args:
+        caminho: Caminho do arquivo de entrada
+    
+    Yields:
+        CNPJs como aparecem no arquivo
+    """
+    with open(caminho, newline='', encoding='utf-8-sig') as f:
+        amostra = f.read(4096)
+        f.seek(0)
+        try:
+            dialeto = csv.Sniffer().sniff(amostra, delimiters=',;\t')
+        except csv.Error:
+            dialeto = csv.excel
         
-        # Total de empresas
-        cursor.execute("SELECT COUNT(*) FROM empresas")
-        stats['total_empresas'] = cursor.fetchone()[0]
+        coluna = 0
+        for numero, linha in enumerate(csv.reader(f, dialeto)):
+            if not linha:
+                continue
+            if numero == 0 and not re.search(r'\d', ''.join(linha)):
+                nomes = [nome.strip().lower() for nome in linha]
+                coluna = nomes.index('cnpj') if 'cnpj' in nomes else 0
+                continue
+            yield linha[coluna] if coluna < len(linha) else ''
+
+
+def escrever_lote(resultados: Iterable[dict], saida, formato: str = 'csv') -> Tuple[int, int]:
+    """
+    Grava os resultados de buscar_lote à medida que chegam
+    
+    Args:
+        resultados: Resultados de CNPJQuery.buscar_lote
+        saida: Arquivo texto aberto para escrita
+        formato: 'csv' (uma linha por estabelecimento) ou 'jsonl' (um objeto por CNPJ)
+    
+    Returns:
+        (CNPJs lidos, CNPJs encontrados)
+    """
+    if formato not in ('csv', 'jsonl'):
+        raise ValueError(f"Formato inválido: {formato} (use csv ou jsonl)")
+    
+    writer = None
+    if formato == 'csv':
+        writer = csv.DictWriter(saida, fieldnames=COLUNAS_LOTE, extrasaction='ignore')
+        writer.writeheader()
+    
+    total = encontrados = 0
+    for resultado in resultados:
+        total += 1
+        encontrados += resultado['encontrado']
         
-        # Total de estabelecimentos
-        cursor.execute("SELECT COUNT(*) FROM estabelecimentos")
-        stats['total_estabelecimentos'] = cursor.fetchone()[0]
+        if formato == 'jsonl':
+            saida.write(json.dumps(resultado, ensure_ascii=False) + '\n')
+            continue
         
-        # Estabelecimentos ativos
-        cursor.execute("SELECT COUNT(*) FROM estabelecimentos WHERE situacao_cadastral = '02'")
-        stats['estabelecimentos_ativos'] = cursor.fetchone()[0]
+        linha = {'entrada': resultado['entrada'], 'encontrado': int(resultado['encontrado'])}
+        if resultado['empresa']:
+            linha.update(resultado['empresa'])
+            linha['total_socios'] = len(resultado['socios'])
+            linha['socios'] = '; '.join(socio['nome'] or '' for socio in resultado['socios'])
         
-        # Empresas por UF
-        cursor.execute("""
-            SELECT uf, COUNT(*) as total 
-            FROM estabelecimentos 
-            WHERE uf IS NOT NULL 
-            GROUP BY uf 
-            ORDER BY total DESC 
-            LIMIT 10
-        """)
-        stats['top_ufs'] = cursor.fetchall()
-        
-        # Portes de empresa
-        cursor.execute("""
-            SELECT porte_empresa, COUNT(*) as total 
-            FROM empresas 
-            WHERE porte_empresa IS NOT NULL 
-            GROUP BY porte_empresa 
-            ORDER BY total DESC
-        """)
-        stats['portes'] = cursor.fetchall()
-        
-        conn.close()
-        return stats
+        for estabelecimento in resultado['estabelecimentos'] or [{}]:
+            writer.writerow({**linha, **estabelecimento})
+    
+    return total, encontrados
 
 
 def main():
@@ -287,15 +915,38 @@ def main():
     parser.add_argument('--db', default='./cnpj_dados.db', help='Caminho do banco SQLite')
     parser.add_argument('--cnpj', help='CNPJ básico para consulta')
     parser.add_argument('--empresa', help='Nome da empresa para busca')
+    parser.add_argument('--nome', help='Busca por relevância na razão social e no nome fantasia')
     parser.add_argument('--uf', help='UF para busca de estabelecimentos')
+    parser.add_argument('--cnae', help='Estabelecimentos com este CNAE entre as atividades secundárias '
+                                       '(combinável com --uf)')
     parser.add_argument('--stats', action='store_true', help='Mostrar estatísticas')
+    parser.add_argument('--arquivo', help='Consultar em lote os CNPJs de um arquivo CSV (8 ou 14 dígitos)')
+    parser.add_argument('--saida', default='-', help='Arquivo de saída do lote (padrão: saída padrão)')
+    parser.add_argument('--formato', choices=['csv', 'jsonl'],
+                        help='Formato da saída do lote (padrão: pela extensão de --saida, senão csv)')
+    parser.add_argument('--sem-socios', action='store_true', help='Não incluir sócios na consulta em lote')
     
     args = parser.parse_args()
     
-    query = CNPJQuery(args.db)
+    try:
+        query = CNPJQuery(args.db)
+    except FileNotFoundError:
+        print(f"Banco de dados não encontrado: {args.db}")
+        print("Execute primeiro o downloader_cnpj.py para baixar os dados")
+        return
     
     try:
-        if args.stats:
+        if args.arquivo:
+            formato = args.formato or ('jsonl' if args.saida.endswith('.jsonl') else 'csv')
+            resultados = query.buscar_lote(ler_cnpjs_arquivo(args.arquivo), incluir_socios=not args.sem_socios)
+            if args.saida == '-':
+                total, encontrados = escrever_lote(resultados, sys.stdout, formato)
+            else:
+                with open(args.saida, 'w', newline='', encoding='utf-8') as saida:
+                    total, encontrados = escrever_lote(resultados, saida, formato)
+            print(f"Lote: {total:,} CNPJs consultados, {encontrados:,} encontrados", file=sys.stderr)
+        
+        elif args.stats:
             print("=== ESTATÍSTICAS GERAIS ===")
             stats = query.estatisticas_gerais()
             print(f"Total de empresas: {stats['total_empresas']:,}")
@@ -363,6 +1014,25 @@ def main():
             for emp in empresas:
                 print(f"CNPJ: {emp['cnpj_basico']} - {emp['razao_social']}")
         
+        elif args.nome:
+            print(f"=== BUSCA POR NOME: {args.nome} ===")
+            empresas = query.buscar_texto(args.nome)
+            if empresas is None:
+                print("Índice de busca textual ausente; usando busca por razão social")
+                empresas = query.buscar_por_razao_social(args.nome)
+            for emp in empresas:
+                fantasia = f" ({emp['nome_fantasia']})" if emp.get('nome_fantasia') else ""
+                print(f"CNPJ: {emp['cnpj_basico']} - {emp['razao_social']}{fantasia}")
+        
+        elif args.cnae:
+            print(f"=== ESTABELECIMENTOS COM CNAE SECUNDÁRIO {args.cnae} ===")
+            estabelecimentos = query.buscar_por_cnae_secundario(args.cnae, args.uf)
+            if estabelecimentos is None:
+                print("Tabela estabelecimento_cnae_secundario ausente (criada ao final da importação)")
+                estabelecimentos = []
+            for est in estabelecimentos:
+                print(f"{est['cnpj']} - {est['razao_social']} ({est['uf']})")
+        
         elif args.uf:
             print(f"=== ESTABELECIMENTOS EM {args.uf.upper()} ===")
             estabelecimentos = query.buscar_por_uf(args.uf)
@@ -375,13 +1045,15 @@ def main():
             print("  python consultar_cnpj.py --stats")
             print("  python consultar_cnpj.py --cnpj 12345678")
             print("  python consultar_cnpj.py --empresa 'PETROBRAS'")
+            print("  python consultar_cnpj.py --nome 'petro bras'")
             print("  python consultar_cnpj.py --uf SP")
+            print("  python consultar_cnpj.py --cnae 4711302 --uf SP")
+            print("  python consultar_cnpj.py --arquivo cnpjs.csv --saida resultado.jsonl")
     
-    except FileNotFoundError:
-        print(f"Banco de dados não encontrado: {args.db}")
-        print("Execute primeiro o downloader_cnpj.py para baixar os dados")
     except Exception as e:
         print(f"Erro: {e}")
+    finally:
+        query.fechar()
 
 
 if __name__ == "__main__":
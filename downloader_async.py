@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Downloader assíncrono (asyncio + aiohttp) para os dados CNPJ da Receita Federal
+Substitui o download_all_files do CNPJDownloader mantendo o restante do processo
+"""
+
+import asyncio
+import logging
+import time
+from typing import List, Dict, Any, Optional
+
+try:
+    import aiohttp
+except ImportError:  # dependência opcional
+    aiohttp = None
+
+from downloader_cnpj import CNPJDownloader
+
+logger = logging.getLogger(__name__)
+
+
+class LimitadorBanda:
+    """Limite global de bytes por segundo compartilhado por todos os downloads"""
+    
+    def __init__(self, bytes_por_segundo: Optional[int]):
+        """
+        Inicializa o limitador
+        
+        Args:
+            bytes_por_segundo: Taxa máxima somando todos os downloads (None = sem limite)
+        """
+        self.taxa = bytes_por_segundo
+        self._proximo = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def consumir(self, quantidade: int):
+        """
+        Reserva a passagem de uma quantidade de bytes, aguardando se necessário
+        
+        Args:
+            quantidade: Bytes recebidos
+        """
+        if not self.taxa:
+            return
+        
+        async with self._lock:
+            agora = time.monotonic()
+            inicio = max(agora, self._proximo)
+            self._proximo = inicio + quantidade / self.taxa
+        
+        espera = inicio - agora
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+
+class AsyncCNPJDownloader(CNPJDownloader):
+    """CNPJDownloader com download assíncrono, conexões reaproveitadas e limite de banda"""
+    
+    CHUNK_MINIMO = 64 * 1024
+    CHUNK_MAXIMO = 4 * 1024 * 1024
+    
+    def __init__(self, *args, max_concorrencia: int = 8,
+                 limite_banda: Optional[int] = None, **kwargs):
+        """
+        Inicializa o downloader assíncrono
+        
+        Aceita os mesmos argumentos do CNPJDownloader, mais:
+        
+        Args:
+            max_concorrencia: Máximo de downloads simultâneos
+            limite_banda: Limite global em bytes por segundo (None = sem limite)
+        """
+        if aiohttp is None:
+            raise ImportError("aiohttp não instalado. Execute: pip install aiohttp")
+        
+        super().__init__(*args, **kwargs)
+        self.max_concorrencia = max(1, max_concorrencia)
+        self.limite_banda = limite_banda
+        self.estatisticas_download: List[Dict[str, Any]] = []
+    
+    def download_all_files(self) -> List[str]:
+        """
+        Baixa todos os arquivos disponíveis usando asyncio
+        
+        Returns:
+            Lista de arquivos baixados com sucesso
+        """
+        files = self.get_file_list()
+        if not files:
+            logger.error("Nenhum arquivo encontrado para download")
+            return []
+        
+        logger.info(f"Iniciando download assíncrono de {len(files)} arquivos "
+                    f"(concorrência: {self.max_concorrencia})...")
+        
+        downloaded_files = asyncio.run(self._download_all(files))
+        
+        self._log_estatisticas()
+        logger.info(f"Download concluído! {len(downloaded_files)} arquivos baixados")
+        return downloaded_files
+    
+    async def _download_all(self, files: List[Dict[str, Any]]) -> List[str]:
+        """Executa os downloads com uma única sessão (pool de conexões keep-alive)"""
+        limitador = LimitadorBanda(self.limite_banda)
+        semaforo = asyncio.Semaphore(self.max_concorrencia)
+        
+        connector = aiohttp.TCPConnector(limit=self.max_concorrencia)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+        
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers=dict(self.session.headers)) as session:
+            resultados = await asyncio.gather(
+                *(self._download_file_async(session, semaforo, limitador, file_info)
+                  for file_info in files),
+                return_exceptions=True
+            )
+        
+        downloaded_files = []
+        for file_info, resultado in zip(files, resultados):
+            if isinstance(resultado, Exception):
+                logger.error(f"Erro no download de {file_info['filename']}: {resultado}")
+            elif resultado:
+                downloaded_files.append(file_info['filename'])
+        
+        return downloaded_files
+    
+    async def _download_file_async(self, session, semaforo: asyncio.Semaphore,
+                                   limitador: LimitadorBanda, file_info: Dict[str, Any]) -> bool:
+        """
+        Baixa um arquivo, retomando o '.part' existente com HTTP Range
+        
+        Args:
+            session: Sessão aiohttp compartilhada
+            semaforo: Limite de downloads simultâneos
+            limitador: Limite global de banda
+            file_info: Informações do arquivo a ser baixado
+        
+        Returns:
+            True se o download foi bem-sucedido
+        """
+        url = file_info['url']
+        filename = file_info['filename']
+        filepath = self.download_dir / filename
+        part_path = self.download_dir / f"{filename}.part"
+        
+        # Arquivo já conferido e inalterado: nem consulta o servidor
+        if self.manifesto.arquivo_verificado(filename, filepath):
+            logger.info(f"Arquivo {filename} verificado pelo manifesto, pulando download")
+            return True
+        
+        self._discard_other_release(filename, filepath, part_path)
+        
+        async with semaforo:
+            try:
+                async with session.head(url, allow_redirects=True) as response:
+                    response.raise_for_status()
+                    total_size = response.content_length
+                    accept_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+                
+                # Verificar se o arquivo já existe e está completo
+                if filepath.exists():
+                    if total_size is None or filepath.stat().st_size == total_size:
+                        logger.info(f"Arquivo {filename} já existe, pulando download")
+                        if total_size is not None:
+                            self.manifesto.registrar_download(filename, filepath, total_size)
+                        return True
+                    if part_path.exists():
+                        filepath.unlink()
+                    else:
+                        filepath.rename(part_path)
+                
+                offset = part_path.stat().st_size if part_path.exists() else 0
+                if offset and (not accept_ranges or total_size is None or offset > total_size):
+                    offset = 0
+                
+                headers = {}
+                if offset:
+                    headers['Range'] = f"bytes={offset}-"
+                    logger.info(f"  Retomando {filename} a partir do byte {offset:,}")
+                
+                logger.info(f"Baixando {filename} ({file_info['size']})...")
+                
+                inicio = time.monotonic()
+                loop = asyncio.get_running_loop()
+                
+                async with session.get(url, headers=headers) as response:
+                    response.raise_for_status()
+                    if offset and response.status != 206:
+                        offset = 0
+                    
+                    downloaded = offset
+                    chunk_size = self.CHUNK_MINIMO
+                    maior_bloco = 0
+                    proximo_log = downloaded + 10 * 1024 * 1024
+                    
+                    with open(part_path, 'ab' if offset else 'wb') as f:
+                        while True:
+                            leitura = time.monotonic()
+                            chunk = await response.content.read(chunk_size)
+                            if not chunk:
+                                break
+                            
+                            # Ajustar o tamanho do bloco à velocidade da conexão
+                            duracao = time.monotonic() - leitura
+                            if len(chunk) == chunk_size and duracao < 0.05:
+                                chunk_size = min(chunk_size * 2, self.CHUNK_MAXIMO)
+                            elif duracao > 0.5:
+                                chunk_size = max(chunk_size // 2, self.CHUNK_MINIMO)
+                            
+                            maior_bloco = max(maior_bloco, len(chunk))
+                            await limitador.consumir(len(chunk))
+                            await loop.run_in_executor(None, f.write, chunk)
+                            downloaded += len(chunk)
+                            
+                            # Mostrar progresso a cada 10MB
+                            if downloaded >= proximo_log:
+                                proximo_log += 10 * 1024 * 1024
+                                if total_size:
+                                    progress = (downloaded / total_size) * 100
+                                    logger.info(f"  Progresso {filename}: {progress:.1f}%")
+                
+                if total_size is not None and downloaded != total_size:
+                    raise IOError(f"conexão encerrada em {downloaded:,} de {total_size:,} bytes")
+                
+                part_path.replace(filepath)
+                self.manifesto.registrar_download(filename, filepath, total_size)
+                
+                segundos = time.monotonic() - inicio
+                recebidos = downloaded - offset
+                self.estatisticas_download.append({
+                    'arquivo': filename,
+                    'bytes': recebidos,
+                    'segundos': segundos,
+                    'mb_por_segundo': recebidos / (1024 * 1024) / segundos if segundos else 0.0,
+                    'maior_bloco': maior_bloco
+                })
+                
+                logger.info(f"Download concluído: {filename}")
+                return True
+            
+            except Exception as e:
+                # O arquivo parcial é mantido para retomar na próxima tentativa
+                logger.error(f"Erro ao baixar {filename}: {e}")
+                return False
+    
+    def _log_estatisticas(self):
+        """Mostra a vazão de cada arquivo baixado"""
+        if not self.estatisticas_download:
+            return
+        
+        logger.info("=" * 50)
+        logger.info("VAZÃO POR ARQUIVO:")
+        for stat in sorted(self.estatisticas_download, key=lambda s: s['arquivo']):
+            logger.info(f"  {stat['arquivo']}: {stat['bytes'] / (1024 * 1024):,.1f} MB "
+                        f"em {stat['segundos']:.1f}s ({stat['mb_por_segundo']:.2f} MB/s, "
+                        f"blocos de até {stat['maior_bloco'] // 1024:,} KB)")
+        
+        total_bytes = sum(s['bytes'] for s in self.estatisticas_download)
+        logger.info(f"  Total: {total_bytes / (1024 * 1024):,.1f} MB")
+        logger.info("=" * 50)
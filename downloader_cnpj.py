@@ -6,22 +6,33 @@ Data: 23 de junho de 2025
 """
 
 import os
+import io
+import glob
+import json
 import sys
 import sqlite3
 import zipfile
 import requests
 import re
 from typing import List, Dict, Any, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from pathlib import Path
 import time
 from datetime import datetime
 import csv
+import itertools
+import queue
+import threading
 import tempfile
 import shutil
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin
 from bs4 import BeautifulSoup
 import logging
+import multiprocessing
+
+from manifesto import ManifestoRelease
+from atualizacao_incremental import AtualizadorIncremental, registrar_geracao
+from tabelas_derivadas import construir_tabelas_derivadas, descartar_tabelas_derivadas, ler_estatisticas
 
 # Configuração de logging
 logging.basicConfig(
@@ -34,42 +45,154 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Diretório da Receita com uma subpasta AAAA-MM para cada release mensal
+URL_DADOS_ABERTOS = "https://arquivos.receitafederal.gov.br/dados/cnpj/dados_abertos_cnpj/"
+
+# Release usada quando a listagem de releases não pode ser consultada
+RELEASE_PADRAO = "2025-06"
+
+
+def parse_release_index(html: str) -> List[str]:
+    """
+    Extrai as releases mensais (AAAA-MM) da listagem do diretório de dados abertos
+    
+    Args:
+        html: Conteúdo HTML da listagem
+        
+    Returns:
+        Releases encontradas, sem repetição, da mais antiga para a mais recente
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    releases = set()
+    
+    for link in soup.find_all('a', href=True):
+        # Aceita links relativos ("2025-06/") e absolutos (".../2025-06/")
+        nome = link['href'].split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+        match = re.fullmatch(r'(\d{4})-(\d{2})', nome)
+        if match and 1 <= int(match.group(2)) <= 12:
+            releases.add(nome)
+    
+    return sorted(releases)
+
 
 class CNPJDownloader:
     """Classe principal para download e processamento dos dados CNPJ"""
     
-    def __init__(self, base_url: str = "https://arquivos.receitafederal.gov.br/dados/cnpj/dados_abertos_cnpj/2025-06/",
+    # Índices secundários (nome, DDL); no modo bulk_load são removidos na importação e recriados no final
+    INDICES = [
+        ("idx_empresas_razao", "CREATE INDEX IF NOT EXISTS idx_empresas_razao ON empresas(razao_social)"),
+        ("idx_estabelecimentos_cnpj", "CREATE INDEX IF NOT EXISTS idx_estabelecimentos_cnpj ON estabelecimentos(cnpj_basico)"),
+        ("idx_estabelecimentos_nome", "CREATE INDEX IF NOT EXISTS idx_estabelecimentos_nome ON estabelecimentos(nome_fantasia)"),
+        ("idx_estabelecimentos_uf", "CREATE INDEX IF NOT EXISTS idx_estabelecimentos_uf ON estabelecimentos(uf)"),
+        ("idx_socios_cnpj", "CREATE INDEX IF NOT EXISTS idx_socios_cnpj ON socios(cnpj_basico)"),
+        ("idx_socios_nome", "CREATE INDEX IF NOT EXISTS idx_socios_nome ON socios(nome_socio)"),
+    ]
+    
+    # Configurações do SQLite durante a carga em massa
+    PRAGMAS_BULK = [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=OFF",
+        "PRAGMA cache_size=-1048576",  # 1 GB
+    ]
+    
+    # Tabelas pequenas importadas antes das demais no modo pipeline
+    TABELAS_REFERENCIA = ['cnaes', 'municipios', 'naturezas', 'paises', 'qualificacoes', 'motivos']
+    
+    # Tamanho mínimo de cada segmento no download segmentado
+    SEGMENTO_MINIMO = 8 * 1024 * 1024
+    
+    # Linhas gravadas entre dois checkpoints do journal de importação
+    CHECKPOINT_LINHAS = 100000
+    
+    # Configurações seguras restauradas ao final da carga. Só o journal_mode fica
+    # gravado no arquivo; synchronous vale por conexão e volta ao padrão (FULL) sozinho
+    PRAGMAS_SEGUROS = [
+        "PRAGMA journal_mode=DELETE",
+    ]
+    
+    def __init__(self, base_url: Optional[str] = None,
                  download_dir: str = "./dados_cnpj",
                  db_path: str = "./cnpj_dados.db",
                  max_workers: int = 4,
-                 incluir_mei: bool = True):
+                 incluir_mei: bool = True,
+                 streaming: bool = True,
+                 import_workers: int = 1,
+                 bulk_load: bool = False,
+                 segmentos: int = 1,
+                 release: Optional[str] = None,
+                 separar_releases: bool = False,
+                 index_url: str = URL_DADOS_ABERTOS,
+                 incremental: bool = False):
         """
         Inicializa o downloader
         
         Args:
-            base_url: URL base dos dados CNPJ
+            base_url: URL base dos dados CNPJ (None = URL da release escolhida; sem release
+                e sem separar_releases, a mais recente é consultada só ao baixar)
             download_dir: Diretório para salvar os arquivos baixados
             db_path: Caminho do banco SQLite
             max_workers: Número máximo de threads para download
             incluir_mei: Se True, inclui dados de MEI (sem CPF). Se False, exclui MEI
+            streaming: Se True, lê os CSVs direto do ZIP sem extrair para disco
+            import_workers: Número de processos para ler e preparar os ZIPs na importação
+            bulk_load: Se True, remove os índices secundários durante a importação (recriados
+                ao final) e ajusta o SQLite para carga em massa
+            segmentos: Conexões paralelas (intervalos de bytes) usadas em cada download
+            release: Release mensal (AAAA-MM); None = a mais recente publicada
+            separar_releases: Se True, cada release usa seu próprio diretório de download e banco
+            index_url: Listagem com as releases disponíveis
+            incremental: Se True, parte do banco da release anterior e aplica apenas o delta
+                (implica separar_releases)
         """
-        self.base_url = base_url
-        self.download_dir = Path(download_dir)
-        self.db_path = db_path
         self.max_workers = max_workers
         self.incluir_mei = incluir_mei
+        self.streaming = streaming
+        self.import_workers = max(1, import_workers)
+        self.bulk_load = bulk_load
+        self.segmentos = max(1, segmentos)
+        self.index_url = index_url
+        self.incremental = incremental
+        self.separar_releases = separar_releases or incremental
+        self._download_dir_base = Path(download_dir)
+        self._db_path_base = Path(db_path)
+        
+        # Configurar sessão HTTP (usada também na descoberta da release)
+        self.session = self._new_session()
+        
+        # Escolher a release
+        if release is not None and not re.fullmatch(r'\d{4}-\d{2}', release):
+            raise ValueError(f"Release inválida: {release} (formato esperado: AAAA-MM)")
         
-        # Criar diretório de download se não existir
+        # Sem release informada e com diretório compartilhado, a listagem só é
+        # consultada quando for preciso baixar (_resolve_release): a importação
+        # dos ZIPs locais funciona offline. Com separar_releases, os caminhos
+        # dependem da release e ela é descoberta já aqui.
+        if base_url is None and (release is not None or self.separar_releases):
+            release = release or self.discover_latest_release()
+            base_url = urljoin(self.index_url, f"{release}/")
+        elif base_url is not None and release is None:
+            encontrada = re.search(r'\d{4}-\d{2}', base_url)
+            release = encontrada.group(0) if encontrada else None
+        
+        self.base_url = base_url
+        self.release = release
+        
+        download_dir, db_path = self.release_paths(release)
+        self.download_dir = Path(download_dir)
+        self.db_path = str(db_path)
+        
+        # Criar diretórios de download e do banco se não existirem
         self.download_dir.mkdir(parents=True, exist_ok=True)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        
+        # Manifesto de integridade dos arquivos desta release
+        self.manifesto = ManifestoRelease(self.download_dir / 'manifesto.json', release)
+        if self.base_url is None:
+            # Release ainda não consultada: vale a dos ZIPs já baixados, se houver
+            self.release = self.manifesto.release
         
         # Inicializar banco de dados
         self._init_database()
-        
-        # Configurar sessão HTTP
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
     
     def _init_database(self):
         """Inicializa o banco de dados SQLite com as tabelas necessárias"""
@@ -201,23 +324,345 @@ class CNPJDownloader:
             )
         ''')
         
-        # Índices para melhor performance
-        indices = [
-            "CREATE INDEX IF NOT EXISTS idx_empresas_razao ON empresas(razao_social)",
-            "CREATE INDEX IF NOT EXISTS idx_estabelecimentos_cnpj ON estabelecimentos(cnpj_basico)",
-            "CREATE INDEX IF NOT EXISTS idx_estabelecimentos_nome ON estabelecimentos(nome_fantasia)",
-            "CREATE INDEX IF NOT EXISTS idx_estabelecimentos_uf ON estabelecimentos(uf)",
-            "CREATE INDEX IF NOT EXISTS idx_socios_cnpj ON socios(cnpj_basico)",
-            "CREATE INDEX IF NOT EXISTS idx_socios_nome ON socios(nome_socio)",
-        ]
-        
-        for idx in indices:
-            cursor.execute(idx)
+        # Journal da importação: progresso por arquivo ZIP e por CSV interno
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS importacao_arquivos (
+                arquivo TEXT PRIMARY KEY,
+                tamanho INTEGER,
+                status TEXT,
+                iniciado_em TEXT,
+                concluido_em TEXT,
+                release TEXT
+            )
+        ''')
+        
+        # Journals criados antes da coluna release
+        colunas = [linha[1] for linha in cursor.execute("PRAGMA table_info(importacao_arquivos)")]
+        if 'release' not in colunas:
+            cursor.execute("ALTER TABLE importacao_arquivos ADD COLUMN release TEXT")
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS importacao_membros (
+                arquivo TEXT,
+                membro TEXT,
+                linhas_processadas INTEGER,
+                lotes_gravados INTEGER,
+                status TEXT,
+                atualizado_em TEXT,
+                PRIMARY KEY (arquivo, membro)
+            )
+        ''')
+        
+        # Metadados do banco (ex: release carregada)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS metadados (
+                chave TEXT PRIMARY KEY,
+                valor TEXT
+            )
+        ''')
+        
+        # Registros alterados por cada atualização incremental
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS changelog (
+                id INTEGER PRIMARY KEY,
+                release TEXT,
+                tabela TEXT,
+                chave TEXT,
+                operacao TEXT,
+                registrado_em TEXT
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_changelog_release ON changelog(release, tabela)")
+        
+        # Geração (contador de importações) em que os dados de cada UF mudaram por último
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS geracao_uf (
+                uf TEXT PRIMARY KEY,
+                geracao INTEGER
+            ) WITHOUT ROWID
+        ''')
+        
+        # Índices para melhor performance (no modo bulk_load, removidos durante a importação)
+        if self.bulk_load:
+            logger.info("Modo bulk_load: índices secundários recriados após a importação")
+        else:
+            for _, idx in self.INDICES:
+                cursor.execute(idx)
         
         conn.commit()
         conn.close()
         logger.info("Banco de dados inicializado com sucesso!")
     
+    def _connect_import(self) -> sqlite3.Connection:
+        """
+        Abre uma conexão para gravação durante a importação
+        
+        Returns:
+            Conexão SQLite, já com as configurações de carga em massa se bulk_load
+        """
+        conn = sqlite3.connect(self.db_path)
+        if self.bulk_load:
+            for pragma in self.PRAGMAS_BULK:
+                conn.execute(pragma)
+        return conn
+    
+    def build_indexes(self) -> Dict[str, float]:
+        """
+        Cria todos os índices secundários de uma vez e restaura as configurações seguras
+        
+        Returns:
+            Dicionário com o tempo (segundos) de criação de cada índice
+        """
+        logger.info("Criando índices secundários...")
+        
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA cache_size=-1048576")
+        cursor = conn.cursor()
+        
+        tempos = {}
+        inicio_total = time.time()
+        
+        for nome, idx in self.INDICES:
+            inicio = time.time()
+            cursor.execute(idx)
+            conn.commit()
+            tempos[nome] = time.time() - inicio
+            logger.info(f"  Índice {nome} criado em {tempos[nome]:.2f}s")
+        
+        for pragma in self.PRAGMAS_SEGUROS:
+            conn.execute(pragma)
+        
+        conn.close()
+        
+        logger.info(f"Índices criados em {time.time() - inicio_total:.2f}s")
+        return tempos
+    
+    def _finalize_import(self):
+        """Etapas executadas depois que todos os arquivos foram importados"""
+        if self.bulk_load:
+            self.build_indexes()
+        
+        if self.incremental:
+            self.apply_delta()
+        elif self.release:
+            self._set_metadata('release', self.release)
+        
+        conn = sqlite3.connect(self.db_path)
+        # O delta descarta as tabelas derivadas; sem ele, só uma importação nova as invalida
+        reconstruir = self.incremental
+        if not self.incremental and self._has_new_imports(conn):
+            # Importação completa: tabelas derivadas e identificador do banco deixam de valer
+            # e todas as UFs podem ter mudado (a exportação por estado refaz todas)
+            descartar_tabelas_derivadas(conn)
+            conn.execute("DELETE FROM metadados WHERE chave = 'banco_id'")
+            registrar_geracao(conn)
+            conn.execute("DELETE FROM metadados WHERE chave = 'importacao_pendente'")
+            conn.commit()
+            reconstruir = True
+        
+        # Dados inalterados: constrói só o que faltar (ex: etapa interrompida antes)
+        construir_tabelas_derivadas(conn, apenas_ausentes=not reconstruir)
+        conn.close()
+    
+    @staticmethod
+    def _has_new_imports(conn: sqlite3.Connection) -> bool:
+        """
+        Verifica se algum arquivo começou a ser importado desde a última geração registrada
+        
+        A marca 'importacao_pendente' sobrevive a uma interrupção: a execução que
+        concluir a importação registra a geração mesmo sem reimportar nada.
+        """
+        if conn.execute("SELECT 1 FROM metadados WHERE chave = 'geracao_em'").fetchone() is None:
+            return True
+        return conn.execute("SELECT 1 FROM metadados WHERE chave = 'importacao_pendente'").fetchone() is not None
+    
+    def _get_metadata(self, chave: str, db_path: Optional[str] = None) -> Optional[str]:
+        """
+        Lê um valor da tabela metadados
+        
+        Args:
+            chave: Nome do metadado
+            db_path: Banco a consultar (padrão: o banco desta instância)
+        """
+        conn = sqlite3.connect(db_path or self.db_path)
+        try:
+            registro = conn.execute("SELECT valor FROM metadados WHERE chave = ?", (chave,)).fetchone()
+        except sqlite3.OperationalError:
+            registro = None
+        conn.close()
+        return registro[0] if registro else None
+    
+    def _set_metadata(self, chave: str, valor: str):
+        """Grava um valor na tabela metadados"""
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("INSERT OR REPLACE INTO metadados (chave, valor) VALUES (?, ?)", (chave, valor))
+        conn.commit()
+        conn.close()
+    
+    def _prepare_incremental(self):
+        """
+        Prepara o banco para receber a nova release nas tabelas stg_*
+        
+        Na primeira execução o banco da release anterior é copiado e o journal
+        de importação é zerado. Se uma carga desta release foi interrompida,
+        as tabelas stg_* e o journal são mantidos para retomar.
+        """
+        if not self.incremental:
+            return
+        
+        carregada = self._get_metadata('release')
+        if carregada == self.release:
+            logger.info(f"Banco já está na release {self.release}, nada a atualizar")
+            self.incremental = False
+            return
+        
+        if self._get_metadata('release_em_carga') == self.release:
+            logger.info(f"Retomando carga incremental da release {self.release}")
+            return
+        
+        if carregada is None and not self._copy_previous_release():
+            logger.warning("Nenhum banco de release anterior encontrado: importação completa")
+            self.incremental = False
+            return
+        
+        logger.info(f"Atualização incremental: {self._get_metadata('release') or 'release anterior'} "
+                    f"-> {self.release}")
+        
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("DELETE FROM importacao_membros")
+        conn.execute("DELETE FROM importacao_arquivos")
+        AtualizadorIncremental(conn, self.release).preparar_staging()
+        conn.execute("INSERT OR REPLACE INTO metadados (chave, valor) VALUES ('release_em_carga', ?)",
+                     (self.release,))
+        conn.commit()
+        conn.close()
+    
+    def _copy_previous_release(self) -> bool:
+        """
+        Copia o banco da release anterior mais recente para o banco desta release
+        
+        Procura em releases/AAAA-MM/ e, por último, no banco compartilhado
+        (caminho db_path original).
+        
+        Returns:
+            True se um banco foi copiado
+        """
+        candidatos = []
+        diretorio = self._db_path_base.parent / 'releases'
+        if diretorio.is_dir():
+            for pasta in diretorio.iterdir():
+                caminho = pasta / self._db_path_base.name
+                if re.fullmatch(r'\d{4}-\d{2}', pasta.name) and pasta.name < self.release and caminho.exists():
+                    candidatos.append((pasta.name, caminho))
+        
+        if not candidatos and self._db_path_base.exists():
+            release = self._get_metadata('release', str(self._db_path_base))
+            if release is None or release < self.release:
+                candidatos.append((release or '', self._db_path_base))
+        
+        if not candidatos:
+            return False
+        
+        release, caminho = max(candidatos)
+        logger.info(f"Copiando banco da release {release or 'anterior'} de {caminho}...")
+        
+        origem = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True)
+        destino = sqlite3.connect(self.db_path)
+        origem.backup(destino)
+        destino.close()
+        origem.close()
+        
+        # Bancos antigos podem não ter as tabelas mais novas (metadados, changelog, ...)
+        self._init_database()
+        return True
+    
+    def apply_delta(self) -> Dict[str, Dict[str, int]]:
+        """
+        Aplica o delta entre a release carregada e a nova (tabelas stg_*)
+        
+        Returns:
+            Dicionário tabela -> quantidade de registros inseridos, alterados e removidos
+        """
+        logger.info(f"Aplicando delta da release {self.release}...")
+        inicio = time.time()
+        
+        conn = sqlite3.connect(self.db_path)
+        resumo = AtualizadorIncremental(conn, self.release).aplicar()
+        conn.close()
+        
+        logger.info(f"Delta aplicado em {time.time() - inicio:.1f}s")
+        return resumo
+    
+    def release_paths(self, release: Optional[str]) -> tuple:
+        """
+        Diretório de download e banco usados por uma release
+        
+        Com separar_releases, cada release fica em sua própria subpasta
+        (ex: dados_cnpj/2025-06/ e releases/2025-06/cnpj_dados.db), permitindo
+        manter vários meses lado a lado.
+        
+        Args:
+            release: Release mensal (AAAA-MM)
+            
+        Returns:
+            Tupla (diretório de download, caminho do banco)
+        """
+        if not self.separar_releases or not release:
+            return self._download_dir_base, self._db_path_base
+        
+        return (self._download_dir_base / release,
+                self._db_path_base.parent / 'releases' / release / self._db_path_base.name)
+    
+    def list_releases(self) -> List[str]:
+        """
+        Consulta a listagem da Receita e retorna as releases publicadas
+        
+        Returns:
+            Releases (AAAA-MM) da mais antiga para a mais recente
+        """
+        response = self.session.get(self.index_url, timeout=30)
+        response.raise_for_status()
+        return parse_release_index(response.text)
+    
+    def discover_latest_release(self) -> str:
+        """
+        Descobre a release mais recente publicada
+        
+        Returns:
+            Release mais recente, ou RELEASE_PADRAO se a listagem não puder ser consultada
+        """
+        try:
+            releases = self.list_releases()
+        except requests.RequestException as e:
+            logger.warning(f"Erro ao consultar releases em {self.index_url}: {e}")
+            releases = []
+        
+        if not releases:
+            logger.warning(f"Nenhuma release encontrada, usando {RELEASE_PADRAO}")
+            return RELEASE_PADRAO
+        
+        logger.info(f"Release mais recente: {releases[-1]} ({len(releases)} disponíveis)")
+        return releases[-1]
+    
+    def _resolve_release(self):
+        """
+        Descobre a release mais recente na primeira vez que a URL de download é necessária
+        
+        Se ela for diferente da release dos ZIPs já baixados no diretório
+        compartilhado, o manifesto é recarregado para a nova release (os
+        arquivos antigos deixam de valer e são baixados novamente).
+        """
+        if self.base_url is not None:
+            return
+        
+        release = self.discover_latest_release()
+        self.base_url = urljoin(self.index_url, f"{release}/")
+        if release != self.release:
+            if self.release:
+                logger.info(f"Release {self.release} em {self.download_dir} substituída por {release}")
+            self.release = release
+            self.manifesto = ManifestoRelease(self.download_dir / 'manifesto.json', release)
+    
     def get_file_list(self) -> List[Dict[str, Any]]:
         """
         Obtém a lista de arquivos disponíveis para download
@@ -225,6 +670,7 @@ class CNPJDownloader:
         Returns:
             Lista de dicionários com informações dos arquivos
         """
+        self._resolve_release()
         logger.info(f"Obtendo lista de arquivos de {self.base_url}")
         
         try:
@@ -263,6 +709,10 @@ class CNPJDownloader:
         """
         Baixa um arquivo específico
         
+        O download é gravado em '<arquivo>.part' e só é renomeado quando o
+        tamanho confere com o Content-Length do servidor. Um '.part' deixado
+        por uma execução anterior é retomado com requisições HTTP Range.
+        
         Args:
             file_info: Informações do arquivo a ser baixado
             
@@ -272,42 +722,230 @@ class CNPJDownloader:
         url = file_info['url']
         filename = file_info['filename']
         filepath = self.download_dir / filename
+        part_path = self.download_dir / f"{filename}.part"
         
-        # Verificar se o arquivo já existe
-        if filepath.exists():
-            logger.info(f"Arquivo {filename} já existe, pulando download")
+        # Arquivo já conferido e inalterado: nem consulta o servidor
+        if self.manifesto.arquivo_verificado(filename, filepath):
+            logger.info(f"Arquivo {filename} verificado pelo manifesto, pulando download")
             return True
         
+        self._discard_other_release(filename, filepath, part_path)
+        
         try:
+            if 'content_length' not in file_info:
+                file_info['content_length'], file_info['accept_ranges'] = self._get_remote_info(url)
+            total_size = file_info['content_length']
+            accept_ranges = file_info['accept_ranges']
+            
+            # Verificar se o arquivo já existe e está completo
+            if filepath.exists():
+                local_size = filepath.stat().st_size
+                if total_size is None or local_size == total_size:
+                    logger.info(f"Arquivo {filename} já existe, pulando download")
+                    if total_size is not None:
+                        self.manifesto.registrar_download(filename, filepath, total_size)
+                    return True
+                
+                logger.warning(f"Arquivo {filename} incompleto ({local_size:,} de {total_size:,} bytes), "
+                               f"retomando download")
+                if part_path.exists():
+                    filepath.unlink()
+                else:
+                    filepath.rename(part_path)
+            
             logger.info(f"Baixando {filename} ({file_info['size']})...")
             
-            response = self.session.get(url, stream=True, timeout=60)
-            response.raise_for_status()
+            if (self.segmentos > 1 and accept_ranges and total_size
+                    and total_size >= self.SEGMENTO_MINIMO * self.segmentos):
+                self._download_segmented(url, part_path, total_size)
+            else:
+                self._download_range(self.session, url, part_path, 0, total_size, accept_ranges)
             
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
-            
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        
-                        # Mostrar progresso a cada 10MB
-                        if downloaded % (10 * 1024 * 1024) == 0:
-                            if total_size > 0:
-                                progress = (downloaded / total_size) * 100
-                                logger.info(f"  Progresso {filename}: {progress:.1f}%")
+            if total_size is not None and part_path.stat().st_size != total_size:
+                raise IOError(f"tamanho final {part_path.stat().st_size:,} difere do esperado {total_size:,}")
             
+            part_path.replace(filepath)
+            self.manifesto.registrar_download(filename, filepath, total_size)
             logger.info(f"Download concluído: {filename}")
             return True
             
         except Exception as e:
+            # O arquivo parcial é mantido para retomar na próxima tentativa
             logger.error(f"Erro ao baixar {filename}: {e}")
-            if filepath.exists():
-                filepath.unlink()  # Remove arquivo parcial
             return False
     
+    def _discard_other_release(self, filename: str, filepath: Path, part_path: Path):
+        """
+        Apaga o ZIP (e os '.part' e '.part.N') baixado para outra release no mesmo diretório
+        
+        Os nomes dos arquivos se repetem a cada mês; sem isso, um arquivo
+        antigo com o mesmo tamanho seria aceito como já baixado.
+        
+        Args:
+            filename: Nome do arquivo
+            filepath: Caminho do arquivo completo
+            part_path: Caminho do download parcial
+        """
+        if not self.manifesto.de_outra_release(filename):
+            return
+        
+        segmentos = part_path.parent.glob(glob.escape(part_path.name) + '.*')
+        for caminho in (filepath, part_path, *segmentos):
+            if caminho.exists():
+                logger.info(f"Arquivo {caminho.name} é de outra release, baixando novamente")
+                caminho.unlink()
+    
+    @staticmethod
+    def _new_session() -> requests.Session:
+        """Cria uma sessão HTTP com os cabeçalhos padrão"""
+        session = requests.Session()
+        session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        })
+        return session
+    
+    def _get_remote_info(self, url: str) -> tuple:
+        """
+        Consulta o tamanho do arquivo remoto e o suporte a Range
+        
+        Args:
+            url: URL do arquivo
+            
+        Returns:
+            Tupla (Content-Length ou None, True se o servidor aceita Range)
+        """
+        response = self.session.head(url, timeout=30, allow_redirects=True)
+        response.raise_for_status()
+        
+        content_length = response.headers.get('content-length')
+        accept_ranges = response.headers.get('accept-ranges', '').lower() == 'bytes'
+        return (int(content_length) if content_length else None), accept_ranges
+    
+    def _download_range(self, session: requests.Session, url: str, destino: Path,
+                        inicio: int, total: Optional[int], accept_ranges: bool,
+                        fim: Optional[int] = None):
+        """
+        Baixa (ou continua baixando) um intervalo de bytes para um arquivo local
+        
+        Args:
+            session: Sessão HTTP a usar (uma por thread)
+            url: URL do arquivo
+            destino: Arquivo local; o que já existir nele é considerado baixado
+            inicio: Primeiro byte do intervalo no arquivo remoto
+            total: Tamanho total do arquivo remoto (None se desconhecido)
+            accept_ranges: Se o servidor aceita requisições Range
+            fim: Último byte do intervalo (None = até o fim do arquivo)
+        """
+        if fim is None and total is not None:
+            fim = total - 1
+        esperado = fim - inicio + 1 if fim is not None else None
+        
+        offset = destino.stat().st_size if destino.exists() else 0
+        if esperado is not None and offset > esperado:
+            offset = 0
+        if offset and not accept_ranges:
+            logger.warning(f"  Servidor não aceita Range, reiniciando {destino.name}")
+            offset = 0
+        if esperado is not None and offset == esperado:
+            return
+        
+        headers = {}
+        if inicio + offset > 0 or fim is not None and fim != (total or 0) - 1:
+            headers['Range'] = f"bytes={inicio + offset}-{fim if fim is not None else ''}"
+            if offset:
+                logger.info(f"  Retomando {destino.name} a partir do byte {offset:,}")
+        
+        response = session.get(url, headers=headers, stream=True, timeout=60)
+        response.raise_for_status()
+        
+        if headers and response.status_code != 206:
+            if inicio > 0:
+                raise IOError("servidor ignorou o cabeçalho Range")
+            offset = 0
+        
+        downloaded = offset
+        proximo_log = downloaded + 10 * 1024 * 1024
+        
+        with open(destino, 'ab' if offset else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                if chunk:
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    
+                    # Mostrar progresso a cada 10MB
+                    if downloaded >= proximo_log:
+                        proximo_log += 10 * 1024 * 1024
+                        if esperado:
+                            progress = (downloaded / esperado) * 100
+                            logger.info(f"  Progresso {destino.name}: {progress:.1f}%")
+        
+        if esperado is not None and downloaded != esperado:
+            raise IOError(f"conexão encerrada em {downloaded:,} de {esperado:,} bytes")
+    
+    def _download_segmented(self, url: str, part_path: Path, total_size: int):
+        """
+        Baixa um arquivo em segmentos de bytes paralelos e junta o resultado
+        
+        Cada segmento é gravado em '<arquivo>.part.N' e pode ser retomado
+        individualmente. Os intervalos, o tamanho total e a release ficam em
+        '<arquivo>.part.segmentos'; segmentos de uma divisão diferente são
+        descartados em vez de retomados. Ao final os segmentos são
+        concatenados em part_path.
+        
+        Args:
+            url: URL do arquivo
+            part_path: Arquivo parcial de destino
+            total_size: Tamanho total do arquivo remoto
+        """
+        # Um .part de download único anterior não serve para segmentos
+        if part_path.exists():
+            part_path.unlink()
+        
+        tamanho_segmento = -(-total_size // self.segmentos)
+        segmentos = []
+        for i in range(self.segmentos):
+            inicio = i * tamanho_segmento
+            fim = min(inicio + tamanho_segmento, total_size) - 1
+            segmentos.append((part_path.with_name(f"{part_path.name}.{i}"), inicio, fim))
+        
+        divisao_path = part_path.with_name(f"{part_path.name}.segmentos")
+        divisao = {'release': self.manifesto.release, 'total': total_size,
+                   'segmentos': [[inicio, fim] for _, inicio, fim in segmentos]}
+        try:
+            with open(divisao_path, 'r', encoding='utf-8') as f:
+                anterior = json.load(f)
+        except (OSError, ValueError):
+            anterior = None
+        if anterior != divisao:
+            # Tamanho do segmento N só vale para o mesmo intervalo do mesmo arquivo
+            for antigo in part_path.parent.glob(glob.escape(part_path.name) + '.*'):
+                antigo.unlink()
+            with open(divisao_path, 'w', encoding='utf-8') as f:
+                json.dump(divisao, f)
+        
+        logger.info(f"  Download segmentado em {len(segmentos)} partes")
+        
+        def baixar_segmento(segmento):
+            destino, inicio, fim = segmento
+            session = self._new_session()
+            try:
+                self._download_range(session, url, destino, inicio, total_size, True, fim)
+            finally:
+                session.close()
+        
+        with ThreadPoolExecutor(max_workers=len(segmentos)) as executor:
+            # list() propaga a primeira exceção de qualquer segmento
+            list(executor.map(baixar_segmento, segmentos))
+        
+        with open(part_path, 'wb') as destino:
+            for segmento_path, _, _ in segmentos:
+                with open(segmento_path, 'rb') as origem:
+                    shutil.copyfileobj(origem, destino, 1024 * 1024)
+        
+        for segmento_path, _, _ in segmentos:
+            segmento_path.unlink()
+        divisao_path.unlink()
+    
     def download_all_files(self) -> List[str]:
         """
         Baixa todos os arquivos disponíveis
@@ -358,10 +996,58 @@ class CNPJDownloader:
             logger.error(f"Arquivo não encontrado: {zip_path}")
             return False
         
+        if not self.manifesto.tamanho_confere(zip_filename, zip_path):
+            logger.error(f"Arquivo {zip_filename} com tamanho diferente do manifesto (download incompleto?)")
+            self.manifesto.invalidar(zip_filename)
+            return False
+        
         try:
+            progresso = self._begin_file(zip_filename)
+            if progresso is None:
+                logger.info(f"Arquivo {zip_filename} já importado, pulando")
+                return True
+            
             logger.info(f"Processando {zip_filename}...")
             
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            sucesso = True
+            for member_name, csvfile in self._iter_csv_members(zip_path):
+                if not self._process_csv_stream(csvfile, zip_filename, member_name,
+                                                progresso.get(member_name)):
+                    sucesso = False
+            
+            if not sucesso:
+                logger.error(f"Processamento incompleto: {zip_filename}")
+                return False
+            
+            self._finish_file(zip_filename)
+            self.manifesto.registrar_importacao(zip_filename)
+            logger.info(f"Processamento concluído: {zip_filename}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Erro ao processar {zip_filename}: {e}")
+            return False
+    
+    def _iter_csv_members(self, zip_path: Path):
+        """
+        Percorre os CSVs contidos em um ZIP
+        
+        Args:
+            zip_path: Caminho do arquivo ZIP
+            
+        Yields:
+            Tuplas (nome do membro, fluxo de texto do CSV)
+        """
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            if self.streaming:
+                # Ler cada membro direto do ZIP, sem arquivos temporários
+                for member in zip_ref.infolist():
+                    if member.is_dir():
+                        continue
+                    with zip_ref.open(member) as raw:
+                        yield member.filename, io.TextIOWrapper(raw, encoding='latin-1',
+                                                                errors='ignore', newline='')
+            else:
                 # Extrair para diretório temporário
                 with tempfile.TemporaryDirectory() as temp_dir:
                     zip_ref.extractall(temp_dir)
@@ -371,22 +1057,80 @@ class CNPJDownloader:
                         # Aceitar qualquer arquivo que não seja diretório
                         csv_path = os.path.join(temp_dir, extracted_file)
                         if os.path.isfile(csv_path):
-                            self._process_csv_file(csv_path, zip_filename)
+                            with open(csv_path, 'r', encoding='latin-1', errors='ignore',
+                                      newline='') as csvfile:
+                                yield extracted_file, csvfile
+    
+    def _iter_batches(self, csvfile, file_type: str, batch_size: int = 1000,
+                      skip_rows: int = 0):
+        """
+        Lê um CSV e gera lotes de linhas já preparadas para inserção
+        
+        Args:
+            csvfile: Fluxo de texto do CSV (arquivo em disco ou membro do ZIP)
+            file_type: Tipo do arquivo
+            batch_size: Quantidade de linhas por lote
+            skip_rows: Linhas iniciais já importadas, que serão puladas
             
-            logger.info(f"Processamento concluído: {zip_filename}")
-            return True
+        Yields:
+            Tuplas (linhas do CSV lidas até aqui, lote de tuplas para o executemany).
+            O último lote é sempre entregue, mesmo vazio.
+        """
+        # A primeira linha serve de amostra; o fluxo pode não permitir seek
+        sample = csvfile.readline()
+        
+        # Detectar delimitador
+        delimiter = ';'
+        if sample.count(';') == 0 and '|' in sample:
+            delimiter = '|'
+        elif sample.count(';') == 0 and '\t' in sample:
+            delimiter = '\t'
+        
+        logger.info(f"  Usando delimitador: '{delimiter}'")
+        
+        reader = csv.reader(itertools.chain([sample], csvfile), delimiter=delimiter)
+        
+        if skip_rows:
+            logger.info(f"  Retomando a partir da linha {skip_rows:,}")
+            reader = itertools.islice(reader, skip_rows, None)
+        
+        batch = []
+        linhas = skip_rows
+        
+        for row_num, row in enumerate(reader, start=skip_rows):
+            linhas = row_num + 1
+            if row_num % 10000 == 0:
+                logger.info(f"  Processando linha {row_num}...")
             
-        except Exception as e:
-            logger.error(f"Erro ao processar {zip_filename}: {e}")
-            return False
+            # Preparar dados baseado no tipo
+            processed_row = self._prepare_row_data(row, file_type)
+            if processed_row:
+                batch.append(processed_row)
+            
+            # Entregar em lotes
+            if len(batch) >= batch_size:
+                yield linhas, batch
+                batch = []
+        
+        # Lote final
+        yield linhas, batch
     
-    def _process_csv_file(self, csv_path: str, zip_filename: str):
+    def _process_csv_stream(self, csvfile, zip_filename: str, member_name: str,
+                            progresso: Optional[tuple] = None) -> bool:
         """
-        Processa um arquivo CSV específico
+        Importa os registros de um CSV já aberto em modo texto
+        
+        O progresso é gravado no journal na mesma transação dos dados, a cada
+        CHECKPOINT_LINHAS linhas, para que uma falha custe no máximo um trecho.
         
         Args:
-            csv_path: Caminho do arquivo CSV
+            csvfile: Fluxo de texto do CSV (arquivo em disco ou membro do ZIP)
             zip_filename: Nome do arquivo ZIP original
+            member_name: Nome do CSV dentro do ZIP
+            progresso: Registro do journal (linhas, lotes, status) ou None
+            
+        Returns:
+            True se o CSV foi importado por completo
         """
         try:
             # Determinar o tipo de dados baseado no nome do arquivo
@@ -394,58 +1138,200 @@ class CNPJDownloader:
             
             if not file_type:
                 logger.warning(f"Tipo de arquivo não reconhecido: {zip_filename}")
-                return
+                return False
             
-            logger.info(f"Importando dados de {zip_filename} para tabela {file_type}")
+            if progresso and progresso[2] == 'concluido':
+                logger.info(f"  {member_name} já importado, pulando")
+                return True
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            skip_rows = progresso[0] if progresso else 0
             
-            # Ler CSV e inserir dados
-            with open(csv_path, 'r', encoding='latin-1', errors='ignore') as csvfile:
-                # Tentar diferentes delimitadores
-                sample = csvfile.read(2048)
-                csvfile.seek(0)
-                
-                # Detectar delimitador
-                delimiter = ';'
-                if sample.count(';') == 0 and '|' in sample:
-                    delimiter = '|'
-                elif sample.count(';') == 0 and '\t' in sample:
-                    delimiter = '\t'
-                
-                logger.info(f"  Usando delimitador: '{delimiter}'")
-                
-                reader = csv.reader(csvfile, delimiter=delimiter)
+            logger.info(f"Importando dados de {zip_filename} para tabela {file_type}")
+            
+            conn = self._connect_import()
+            try:
+                cursor = conn.cursor()
                 
-                batch_size = 1000
-                batch = []
+                linhas = ultimo_checkpoint = skip_rows
+                lotes = 0
                 
-                for row_num, row in enumerate(reader):
-                    if row_num % 10000 == 0:
-                        logger.info(f"  Processando linha {row_num}...")
-                    
-                    # Preparar dados baseado no tipo
-                    processed_row = self._prepare_row_data(row, file_type)
-                    if processed_row:
-                        batch.append(processed_row)
-                    
-                    # Inserir em lotes
-                    if len(batch) >= batch_size:
+                for linhas, batch in self._iter_batches(csvfile, file_type, skip_rows=skip_rows):
+                    if batch:
                         self._insert_batch(cursor, batch, file_type)
-                        batch = []
+                        lotes += 1
+                    
+                    if linhas - ultimo_checkpoint >= self.CHECKPOINT_LINHAS:
+                        self._checkpoint_member(cursor, zip_filename, member_name, linhas, lotes)
+                        conn.commit()
+                        ultimo_checkpoint = linhas
+                        lotes = 0
                 
-                # Inserir lote final
-                if batch:
-                    self._insert_batch(cursor, batch, file_type)
+                self._checkpoint_member(cursor, zip_filename, member_name, linhas, lotes, 'concluido')
+                conn.commit()
+            except Exception:
+                # Descarta o trecho desde o último checkpoint (a retomada parte dele)
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
             
-            conn.commit()
+            logger.info(f"Importação concluída: {zip_filename}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Erro ao processar CSV {member_name}: {e}")
+            return False
+    
+    def _begin_file(self, zip_filename: str) -> Optional[Dict[str, tuple]]:
+        """
+        Registra o início da importação de um ZIP e lê o progresso anterior
+        
+        Se o arquivo mudou de tamanho ou é de outra release desde a última
+        tentativa, o progresso anterior é descartado.
+        
+        Args:
+            zip_filename: Nome do arquivo ZIP
+            
+        Returns:
+            None se o arquivo já foi importado; senão, dicionário
+            membro -> (linhas processadas, lotes gravados, status)
+        """
+        tamanho = (self.download_dir / zip_filename).stat().st_size
+        
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT tamanho, status, release FROM importacao_arquivos WHERE arquivo = ?",
+                       (zip_filename,))
+        registro = cursor.fetchone()
+        mesmo_arquivo = registro is not None and registro[0] == tamanho and registro[2] == self.release
+        
+        if mesmo_arquivo and registro[1] == 'concluido':
             conn.close()
+            return None
+        
+        if registro and not mesmo_arquivo:
+            cursor.execute("DELETE FROM importacao_membros WHERE arquivo = ?", (zip_filename,))
+        
+        cursor.execute('''
+            INSERT OR REPLACE INTO importacao_arquivos (arquivo, tamanho, status, iniciado_em, concluido_em, release)
+            VALUES (?, ?, 'em_andamento', ?, NULL, ?)
+        ''', (zip_filename, tamanho, datetime.now().isoformat(timespec='seconds'), self.release))
+        
+        if not self.incremental:
+            # Marca que as tabelas definitivas mudaram (nova geração em _finalize_import)
+            cursor.execute("INSERT OR REPLACE INTO metadados (chave, valor) VALUES ('importacao_pendente', ?)",
+                           (zip_filename,))
             
-            logger.info(f"Importação concluída: {zip_filename}")
+            if self.bulk_load:
+                # Índices existentes seriam atualizados linha a linha; build_indexes os recria
+                for nome, _ in self.INDICES:
+                    cursor.execute(f"DROP INDEX IF EXISTS {nome}")
+        
+        cursor.execute('''
+            SELECT membro, linhas_processadas, lotes_gravados, status
+            FROM importacao_membros WHERE arquivo = ?
+        ''', (zip_filename,))
+        progresso = {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()}
+        
+        conn.commit()
+        conn.close()
+        
+        if progresso:
+            logger.info(f"Retomando {zip_filename} a partir do journal de importação")
+        return progresso
+    
+    def _finish_file(self, zip_filename: str, cursor=None):
+        """
+        Marca um ZIP como totalmente importado no journal
+        
+        Args:
+            zip_filename: Nome do arquivo ZIP
+            cursor: Cursor a usar (o commit fica com o chamador); None abre uma conexão própria
+        """
+        query = "UPDATE importacao_arquivos SET status = 'concluido', concluido_em = ? WHERE arquivo = ?"
+        params = (datetime.now().isoformat(timespec='seconds'), zip_filename)
+        
+        if cursor is not None:
+            cursor.execute(query, params)
+            return
+        
+        conn = sqlite3.connect(self.db_path)
+        conn.execute(query, params)
+        conn.commit()
+        conn.close()
+    
+    def _checkpoint_member(self, cursor, zip_filename: str, member_name: str,
+                           linhas: int, lotes: int, status: str = 'em_andamento'):
+        """
+        Atualiza o progresso de um CSV no journal (sem commit)
+        
+        Args:
+            cursor: Cursor da transação que gravou os lotes
+            zip_filename: Nome do arquivo ZIP
+            member_name: Nome do CSV dentro do ZIP
+            linhas: Linhas do CSV já gravadas
+            lotes: Lotes gravados desde o último checkpoint
+            status: 'em_andamento' ou 'concluido'
+        """
+        cursor.execute('''
+            INSERT INTO importacao_membros (arquivo, membro, linhas_processadas, lotes_gravados, status, atualizado_em)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (arquivo, membro) DO UPDATE SET
+                linhas_processadas = excluded.linhas_processadas,
+                lotes_gravados = lotes_gravados + excluded.lotes_gravados,
+                status = excluded.status,
+                atualizado_em = excluded.atualizado_em
+        ''', (zip_filename, member_name, linhas, lotes, status,
+              datetime.now().isoformat(timespec='seconds')))
+    
+    def _produce_batches(self, zip_filename: str, fila, progresso: Dict[str, tuple]) -> bool:
+        """
+        Lê um ZIP e envia os lotes preparados para a fila do escritor
+        
+        Usado pelos processos trabalhadores da importação paralela: a
+        decodificação, limpeza e filtro de MEI acontecem aqui, e somente o
+        processo escritor toca no banco.
+        
+        Args:
+            zip_filename: Nome do arquivo ZIP
+            fila: Fila limitada compartilhada com o processo escritor
+            progresso: Progresso do journal por membro (ver _begin_file)
+            
+        Returns:
+            True se o arquivo foi lido por completo
+        """
+        zip_path = self.download_dir / zip_filename
+        file_type = self._get_file_type(zip_filename)
+        
+        if not file_type:
+            logger.warning(f"Tipo de arquivo não reconhecido: {zip_filename}")
+            return False
+        
+        try:
+            logger.info(f"Processando {zip_filename}...")
+            
+            for member_name, csvfile in self._iter_csv_members(zip_path):
+                registro = progresso.get(member_name)
+                if registro and registro[2] == 'concluido':
+                    logger.info(f"  {member_name} já importado, pulando")
+                    continue
+                
+                linhas = skip_rows = registro[0] if registro else 0
+                for linhas, batch in self._iter_batches(csvfile, file_type, batch_size=5000,
+                                                        skip_rows=skip_rows):
+                    fila.put(('lote', zip_filename, member_name, file_type, linhas, batch))
+                
+                fila.put(('membro', zip_filename, member_name, linhas))
+            
+            # Só marca o arquivo como concluído se todos os membros foram lidos
+            fila.put(('arquivo', zip_filename))
+            logger.info(f"Processamento concluído: {zip_filename}")
+            return True
             
         except Exception as e:
-            logger.error(f"Erro ao processar CSV {csv_path}: {e}")
+            logger.error(f"Erro ao processar {zip_filename}: {e}")
+            return False
     
     def _get_file_type(self, filename: str) -> Optional[str]:
         """
@@ -614,7 +1500,12 @@ class CNPJDownloader:
             }
             
             if file_type in placeholders:
-                query = f"INSERT OR REPLACE INTO {file_type} VALUES {placeholders[file_type]}"
+                # No modo incremental a nova release vai para as tabelas stg_*
+                tabela = file_type
+                if self.incremental and file_type in AtualizadorIncremental.TABELAS:
+                    tabela = AtualizadorIncremental.tabela_staging(file_type)
+                
+                query = f"INSERT OR REPLACE INTO {tabela} VALUES {placeholders[file_type]}"
                 cursor.executemany(query, batch)
             
         except Exception as e:
@@ -630,13 +1521,110 @@ class CNPJDownloader:
         
         logger.info(f"Processando {len(zip_files)} arquivos...")
         
+        self._prepare_incremental()
+        
+        if self.import_workers > 1:
+            self._process_files_parallel(zip_files)
+        else:
+            for zip_file in zip_files:
+                self.extract_and_process_file(zip_file)
+        
+        self._finalize_import()
+    
+    def _process_files_parallel(self, zip_files: List[str]):
+        """
+        Importa vários ZIPs em paralelo com um único escritor SQLite
+        
+        Os processos trabalhadores leem e preparam as linhas; um processo
+        escritor dedicado é o único dono da conexão e grava lotes grandes
+        retirados de uma fila limitada.
+        
+        Args:
+            zip_files: Nomes dos arquivos ZIP a importar
+        """
+        logger.info(f"Importação paralela: {self.import_workers} processos leitores + 1 escritor")
+        
+        # Ler o journal antes de iniciar o escritor (único dono da conexão depois)
+        pendentes = {}
         for zip_file in zip_files:
-            self.extract_and_process_file(zip_file)
+            if not self.manifesto.tamanho_confere(zip_file, self.download_dir / zip_file):
+                logger.error(f"Arquivo {zip_file} com tamanho diferente do manifesto (download incompleto?)")
+                self.manifesto.invalidar(zip_file)
+                continue
+            
+            progresso = self._begin_file(zip_file)
+            if progresso is None:
+                logger.info(f"Arquivo {zip_file} já importado, pulando")
+            else:
+                pendentes[zip_file] = progresso
+        
+        if not pendentes:
+            return
+        
+        fila = multiprocessing.Queue(maxsize=self.import_workers * 4)
+        escritor = multiprocessing.Process(target=_sqlite_writer_loop,
+                                           args=(self, fila, self.CHECKPOINT_LINHAS))
+        escritor.start()
+        
+        concluidos = []
+        try:
+            with ProcessPoolExecutor(max_workers=self.import_workers,
+                                     initializer=_init_import_worker,
+                                     initargs=(self, fila)) as executor:
+                future_to_file = {executor.submit(_import_worker_task, zip_file, progresso): zip_file
+                                  for zip_file, progresso in pendentes.items()}
+                
+                for future in as_completed(future_to_file):
+                    zip_file = future_to_file[future]
+                    try:
+                        if future.result():
+                            concluidos.append(zip_file)
+                        else:
+                            logger.error(f"Falha ao processar {zip_file}")
+                    except Exception as e:
+                        logger.error(f"Erro no processamento de {zip_file}: {e}")
+        finally:
+            # Sinalizar fim para o escritor e aguardar o último commit
+            fila.put(None)
+            escritor.join()
+        
+        for zip_file in concluidos:
+            self.manifesto.registrar_importacao(zip_file)
+        
+        logger.info("Importação paralela concluída")
+    
+    def verify_downloads(self, calcular_hash: bool = False) -> List[str]:
+        """
+        Confere os arquivos baixados contra o manifesto da release
+        
+        Args:
+            calcular_hash: Se True, calcula também o SHA-256 (em paralelo)
+            
+        Returns:
+            Lista de arquivos com problema, que serão baixados novamente
+        """
+        logger.info(f"Verificando {len(self.manifesto.arquivos)} arquivos do manifesto...")
+        problemas = self.manifesto.verificar(self.download_dir, calcular_hash, self.max_workers)
+        
+        for nome in problemas:
+            # Tamanho certo mas hash diferente: conteúdo corrompido, não dá para retomar
+            caminho = self.download_dir / nome
+            if caminho.exists() and self.manifesto.tamanho_confere(nome, caminho):
+                caminho.unlink()
+        
+        if problemas:
+            logger.warning(f"{len(problemas)} arquivo(s) com problema: {', '.join(problemas)}")
+        else:
+            logger.info("Todos os arquivos conferem com o manifesto")
+        return problemas
     
     def get_database_stats(self) -> Dict[str, int]:
         """
         Obtém estatísticas do banco de dados
         
+        Lê a tabela estatisticas (calculada ao final da importação); sem ela,
+        ou com uma importação ainda pendente, conta os registros de cada tabela.
+        
         Returns:
             Dicionário com contagem de registros por tabela
         """
@@ -646,8 +1634,13 @@ class CNPJDownloader:
         tables = ['empresas', 'estabelecimentos', 'socios', 'simples', 
                  'cnaes', 'municipios', 'naturezas', 'paises', 'qualificacoes', 'motivos']
         
+        totais = ler_estatisticas(conn, 'tabela') or {}
+        
         stats = {}
         for table in tables:
+            if table in totais:
+                stats[table] = totais[table]
+                continue
             try:
                 cursor.execute(f"SELECT COUNT(*) FROM {table}")
                 count = cursor.fetchone()[0]
@@ -659,21 +1652,114 @@ class CNPJDownloader:
         conn.close()
         return stats
     
-    def run_complete_process(self):
-        """Executa o processo completo de download e processamento"""
-        logger.info("Iniciando processo completo de download e processamento...")
+    def download_and_import_pipeline(self, max_fila: int = 4) -> List[str]:
+        """
+        Baixa e importa ao mesmo tempo: cada ZIP entra na fila de importação
+        assim que seu download termina
         
-        start_time = time.time()
+        As tabelas de referência (CNAEs, municípios, ...) são baixadas e
+        importadas primeiro. A fila é limitada: quando a importação fica para
+        trás, as threads de download esperam. Isso limita o trabalho adiantado,
+        não o disco: os ZIPs importados continuam em download_dir (o manifesto
+        os reaproveita na próxima execução), então o espaço ocupado ao final é
+        o da release inteira, como no modo sequencial.
+        
+        Args:
+            max_fila: Máximo de ZIPs baixados aguardando importação
+            
+        Returns:
+            Lista de arquivos baixados com sucesso
+        """
+        files = self.get_file_list()
+        if not files:
+            logger.error("Nenhum arquivo encontrado para download")
+            return []
         
-        # 1. Baixar arquivos
-        downloaded_files = self.download_all_files()
+        files.sort(key=lambda f: (self._import_priority(f['filename']), f['filename']))
         
-        if not downloaded_files:
-            logger.error("Nenhum arquivo foi baixado. Encerrando processo.")
-            return
+        self._prepare_incremental()
+        
+        logger.info(f"Iniciando download e importação em pipeline de {len(files)} arquivos...")
+        
+        fila = queue.PriorityQueue(maxsize=max_fila)
+        ordem = itertools.count()
+        downloaded_files = []
+        
+        def importador():
+            while True:
+                _, _, filename = fila.get()
+                if filename is None:
+                    break
+                try:
+                    self.extract_and_process_file(filename)
+                except Exception as e:
+                    # A thread precisa continuar consumindo a fila, senão os downloads ficam bloqueados
+                    logger.error(f"Erro na importação de {filename}: {e}")
         
-        # 2. Processar arquivos
-        self.process_all_files()
+        thread_importacao = threading.Thread(target=importador, name="importador")
+        thread_importacao.start()
+        
+        def baixar_e_enfileirar(file_info):
+            if not self.download_file(file_info):
+                return False
+            prioridade = self._import_priority(file_info['filename'])
+            fila.put((prioridade, next(ordem), file_info['filename']))
+            return True
+        
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                future_to_file = {executor.submit(baixar_e_enfileirar, file_info): file_info
+                                  for file_info in files}
+                
+                for future in as_completed(future_to_file):
+                    file_info = future_to_file[future]
+                    try:
+                        if future.result():
+                            downloaded_files.append(file_info['filename'])
+                    except Exception as e:
+                        logger.error(f"Erro no download de {file_info['filename']}: {e}")
+        finally:
+            # Sentinela com a menor prioridade: processado depois de todos os ZIPs
+            fila.put((2, next(ordem), None))
+            thread_importacao.join()
+        
+        self._finalize_import()
+        
+        logger.info(f"Pipeline concluído! {len(downloaded_files)} arquivos baixados")
+        return downloaded_files
+    
+    def _import_priority(self, filename: str) -> int:
+        """Prioridade de importação: 0 para tabelas de referência, 1 para as demais"""
+        return 0 if self._get_file_type(filename) in self.TABELAS_REFERENCIA else 1
+    
+    def run_complete_process(self, pipeline: bool = False):
+        """
+        Executa o processo completo de download e processamento
+        
+        Args:
+            pipeline: Se True, importa cada arquivo assim que seu download termina
+        """
+        logger.info("Iniciando processo completo de download e processamento...")
+        
+        start_time = time.time()
+        
+        if pipeline:
+            # 1+2. Baixar e processar em paralelo
+            downloaded_files = self.download_and_import_pipeline()
+            
+            if not downloaded_files:
+                logger.error("Nenhum arquivo foi baixado. Encerrando processo.")
+                return
+        else:
+            # 1. Baixar arquivos
+            downloaded_files = self.download_all_files()
+            
+            if not downloaded_files:
+                logger.error("Nenhum arquivo foi baixado. Encerrando processo.")
+                return
+            
+            # 2. Processar arquivos
+            self.process_all_files()
         
         # 3. Mostrar estatísticas
         stats = self.get_database_stats()
@@ -693,6 +1779,100 @@ class CNPJDownloader:
         logger.info("="*50)
 
 
+# Estado dos processos da importação paralela (definido no initializer)
+_worker_downloader = None
+_worker_fila = None
+
+
+def _init_import_worker(downloader: CNPJDownloader, fila):
+    """Guarda o downloader e a fila do escritor no processo trabalhador"""
+    global _worker_downloader, _worker_fila
+    _worker_downloader = downloader
+    _worker_fila = fila
+
+
+def _import_worker_task(zip_filename: str, progresso: Dict[str, tuple]) -> bool:
+    """Tarefa executada no pool: prepara os lotes de um ZIP"""
+    return _worker_downloader._produce_batches(zip_filename, _worker_fila, progresso)
+
+
+def _sqlite_writer_loop(downloader: CNPJDownloader, fila, commit_rows: int):
+    """
+    Processo escritor: único dono da conexão SQLite na importação paralela
+    
+    Mensagens da fila:
+        ('lote', arquivo, membro, tipo, linhas, lote): grava o lote
+        ('membro', arquivo, membro, linhas): CSV lido por completo
+        ('arquivo', arquivo): ZIP lido por completo
+        None: encerra o escritor
+    
+    Os checkpoints do journal são gravados na mesma transação dos lotes.
+    
+    Args:
+        downloader: Instância com a configuração do banco
+        fila: Fila de mensagens dos trabalhadores
+        commit_rows: Quantidade de linhas entre commits
+    """
+    conn = None
+    try:
+        conn = downloader._connect_import()
+        cursor = conn.cursor()
+        
+        # Progresso ainda não gravado no journal: (arquivo, membro) -> [linhas, lotes]
+        progresso = {}
+        pendentes = 0
+        total = 0
+        
+        def checkpoint():
+            for (arquivo, membro), (linhas, lotes) in progresso.items():
+                downloader._checkpoint_member(cursor, arquivo, membro, linhas, lotes)
+            progresso.clear()
+            conn.commit()
+        
+        while True:
+            item = fila.get()
+            if item is None:
+                break
+            
+            if item[0] == 'lote':
+                _, arquivo, membro, file_type, linhas, batch = item
+                registro = progresso.setdefault((arquivo, membro), [0, 0])
+                registro[0] = linhas
+                if batch:
+                    downloader._insert_batch(cursor, batch, file_type)
+                    registro[1] += 1
+                    pendentes += len(batch)
+                    total += len(batch)
+                
+                if pendentes >= commit_rows:
+                    checkpoint()
+                    pendentes = 0
+            
+            elif item[0] == 'membro':
+                _, arquivo, membro, linhas = item
+                _, lotes = progresso.pop((arquivo, membro), (linhas, 0))
+                downloader._checkpoint_member(cursor, arquivo, membro, linhas, lotes, 'concluido')
+            
+            elif item[0] == 'arquivo':
+                downloader._finish_file(item[1], cursor)
+                checkpoint()
+        
+        checkpoint()
+        logger.info(f"Escritor SQLite finalizado: {total:,} linhas gravadas")
+        
+    except Exception as e:
+        logger.error(f"Erro no escritor SQLite: {e}")
+        if conn is not None:
+            conn.rollback()  # a retomada parte do último checkpoint
+        # Continuar consumindo a fila para não travar os trabalhadores
+        while fila.get() is not None:
+            pass
+    
+    finally:
+        if conn is not None:
+            conn.close()
+
+
 if __name__ == "__main__":
     import argparse
     
@@ -701,6 +1881,35 @@ if __name__ == "__main__":
                        help='Excluir dados de MEI da importação')
     parser.add_argument('--incluir-mei', action='store_true', default=True,
                        help='Incluir dados de MEI na importação (padrão: True)')
+    parser.add_argument('--extrair-temp', action='store_true',
+                       help='Extrair os ZIPs para diretório temporário em vez de ler direto do ZIP')
+    parser.add_argument('--workers', type=int, default=1,
+                       help='Processos para ler e preparar os ZIPs na importação (padrão: 1)')
+    parser.add_argument('--segmentos', type=int, default=1,
+                       help='Dividir cada download em N intervalos de bytes baixados em paralelo')
+    parser.add_argument('--pipeline', action='store_true',
+                       help='Importar cada arquivo assim que seu download terminar')
+    parser.add_argument('--bulk-load', action='store_true',
+                       help='Carga em massa: remover os índices secundários durante a importação, recriá-los '
+                            'no final e ajustar o SQLite para inserção em massa')
+    parser.add_argument('--verificar', action='store_true',
+                       help='Apenas conferir os arquivos baixados contra o manifesto e sair')
+    parser.add_argument('--hash', action='store_true',
+                       help='Com --verificar, calcular também o SHA-256 de cada arquivo')
+    parser.add_argument('--release',
+                       help='Release mensal a baixar (AAAA-MM). Padrão: a mais recente publicada')
+    parser.add_argument('--listar-releases', action='store_true',
+                       help='Listar as releases publicadas e sair')
+    parser.add_argument('--por-release', action='store_true',
+                       help='Guardar downloads e banco em diretórios separados por release')
+    parser.add_argument('--incremental', action='store_true',
+                       help='Partir do banco da release anterior e aplicar apenas o que mudou (implica --por-release)')
+    parser.add_argument('--async', dest='usar_async', action='store_true',
+                       help='Usar o downloader assíncrono (requer aiohttp)')
+    parser.add_argument('--concorrencia', type=int, default=8,
+                       help='Downloads simultâneos no modo --async (padrão: 8)')
+    parser.add_argument('--limite-banda', type=float,
+                       help='Limite global de banda em MB/s no modo --async')
     
     args = parser.parse_args()
     
@@ -712,23 +1921,47 @@ if __name__ == "__main__":
     else:
         logger.info("✅ MEI será INCLUÍDO na importação (CPF será anonimizado)")
     
+    if args.listar_releases:
+        resposta = CNPJDownloader._new_session().get(URL_DADOS_ABERTOS, timeout=30)
+        resposta.raise_for_status()
+        for release in parse_release_index(resposta.text):
+            print(release)
+        sys.exit(0)
+    
     # Configurações
-    BASE_URL = "https://arquivos.receitafederal.gov.br/dados/cnpj/dados_abertos_cnpj/2025-06/"
     DOWNLOAD_DIR = "./dados_cnpj"
     DB_PATH = "./cnpj_dados.db"
     MAX_WORKERS = 4
     
-    # Criar e executar o downloader
-    downloader = CNPJDownloader(
-        base_url=BASE_URL,
+    opcoes = dict(
         download_dir=DOWNLOAD_DIR,
         db_path=DB_PATH,
         max_workers=MAX_WORKERS,
-        incluir_mei=incluir_mei
+        incluir_mei=incluir_mei,
+        streaming=not args.extrair_temp,
+        import_workers=args.workers,
+        bulk_load=args.bulk_load,
+        segmentos=args.segmentos,
+        release=args.release,
+        separar_releases=args.por_release,
+        incremental=args.incremental
     )
     
+    # Criar e executar o downloader
+    if args.usar_async:
+        from downloader_async import AsyncCNPJDownloader
+        limite = int(args.limite_banda * 1024 * 1024) if args.limite_banda else None
+        downloader = AsyncCNPJDownloader(max_concorrencia=args.concorrencia,
+                                         limite_banda=limite, **opcoes)
+    else:
+        downloader = CNPJDownloader(**opcoes)
+    
     try:
-        downloader.run_complete_process()
+        if args.verificar:
+            problemas = downloader.verify_downloads(calcular_hash=args.hash)
+            sys.exit(1 if problemas else 0)
+        
+        downloader.run_complete_process(pipeline=args.pipeline)
     except KeyboardInterrupt:
         logger.info("Processo interrompido pelo usuário")
     except Exception as e:
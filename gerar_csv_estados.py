@@ -0,0 +1,1359 @@
+#!/usr/bin/env python3
+"""
+Gerador de arquivos CSV unificados por estado para importação no WordPress
+Autor: Bruno Qualhato
+Data: 23 de junho de 2025
+"""
+
+import sqlite3
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+import logging
+from typing import Dict, List, Optional
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import sys
+
+try:
+    import zstandard
+except ImportError:  # dependência opcional (--compress zstd)
+    zstandard = None
+
+from tabelas_derivadas import construir_tabelas_derivadas, ler_estatisticas
+
+# Configuração de logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler('gerador_csv.log'),
+        logging.StreamHandler(sys.stdout)
+    ]
+)
+logger = logging.getLogger(__name__)
+
+# Extensão dos arquivos gerados para cada tipo de compressão
+EXTENSOES = {None: '.csv', 'gzip': '.csv.gz', 'zstd': '.csv.zst'}
+
+MB = 1024 * 1024
+
+
+class GeradorCSVEstados:
+    """Gera arquivos CSV unificados por estado para WordPress"""
+    
+    # Cabeçalho do CSV
+    COLUNAS = [
+        'cnpj_basico', 'razao_social', 'natureza_juridica', 'natureza_descricao',
+        'capital_social', 'porte_empresa', 'porte_descricao',
+        'cnpj_ordem', 'cnpj_dv', 'cnpj_completo', 'tipo_estabelecimento',
+        'nome_fantasia', 'situacao_cadastral', 'data_situacao_cadastral', 'data_inicio_atividade',
+        'cnae_fiscal_principal', 'cnae_descricao', 'cnae_fiscal_secundaria', 'atividades_secundarias',
+        'tipo_logradouro', 'logradouro', 'numero', 'complemento', 'bairro', 'cep',
+        'uf', 'codigo_municipio', 'municipio_nome',
+        'ddd_1', 'telefone_1', 'ddd_2', 'telefone_2', 'ddd_fax', 'fax', 'correio_eletronico',
+        'situacao_especial', 'data_situacao_especial',
+        'opcao_simples', 'data_opcao_simples', 'data_exclusao_simples',
+        'opcao_mei', 'data_opcao_mei', 'data_exclusao_mei',
+        'total_socios', 'socios_cnpj'
+    ]
+    
+    # Cabeçalho do arquivo de sócios
+    COLUNAS_SOCIOS = [
+        'cnpj_basico', 'razao_social', 'identificador_socio', 'nome_socio',
+        'cpf_cnpj_socio', 'codigo_qualificacao_socio', 'qualificacao_descricao',
+        'data_entrada_sociedade', 'codigo_pais', 'pais_descricao',
+        'representante_legal', 'nome_representante', 'codigo_qualificacao_representante',
+        'faixa_etaria'
+    ]
+    
+    # Tabelas de referência usadas nas exportações (entram na impressão digital)
+    TABELAS_REFERENCIA = ['naturezas', 'cnaes', 'municipios', 'qualificacoes', 'paises']
+    
+    # Impressões digitais da última geração de cada estado (no diretório de saída)
+    ARQUIVO_IMPRESSOES = 'impressoes_digitais.json'
+    
+    # Tabelas derivadas usadas na exportação (a busca textual fica de fora)
+    TABELAS_DERIVADAS = ['socios_resumo', 'estabelecimento_cnae_secundario', 'estatisticas', 'ordem_exportacao']
+    
+    # Registros lidos por página na exportação por chave (keyset)
+    TAMANHO_PAGINA = 10000
+    
+    # Consulta principal unindo todas as tabelas: uma página na ordem escolhida
+    # ({chave}, {origem} e {filtro} vêm de ORDENACOES; ver consulta_pagina)
+    CONSULTA_PRINCIPAL = """
+    SELECT 
+        -- Dados da empresa
+        emp.cnpj_basico,
+        emp.razao_social,
+        emp.natureza_juridica,
+        nat.descricao as natureza_descricao,
+        emp.capital_social,
+        emp.porte_empresa,
+        CASE emp.porte_empresa
+            WHEN '01' THEN 'Micro Empresa'
+            WHEN '03' THEN 'Empresa de Pequeno Porte'
+            WHEN '05' THEN 'Demais'
+            ELSE emp.porte_empresa
+        END as porte_descricao,
+        
+        -- Dados do estabelecimento
+        e.cnpj_ordem,
+        e.cnpj_dv,
+        (emp.cnpj_basico || e.cnpj_ordem || e.cnpj_dv) as cnpj_completo,
+        CASE e.identificador_matriz_filial
+            WHEN '1' THEN 'Matriz'
+            WHEN '2' THEN 'Filial'
+            ELSE 'N/A'
+        END as tipo_estabelecimento,
+        e.nome_fantasia,
+        'Ativa' as situacao_cadastral,
+        e.data_situacao_cadastral,
+        e.data_inicio_atividade,
+        
+        -- CNAE
+        e.cnae_fiscal_principal,
+        cnae.descricao as cnae_descricao,
+        e.cnae_fiscal_secundaria,
+        -- descrições dos CNAEs secundários, na ordem original (chave primária de ecs)
+        (SELECT GROUP_CONCAT(COALESCE(c.descricao, 'CNAE ' || ecs.cnae), ', ')
+         FROM estabelecimento_cnae_secundario ecs
+         LEFT JOIN cnaes c ON ecs.cnae = c.codigo
+         WHERE ecs.cnpj_basico = e.cnpj_basico
+           AND ecs.cnpj_ordem = e.cnpj_ordem
+           AND ecs.cnpj_dv = e.cnpj_dv) as atividades_secundarias,
+        
+        -- Endereço
+        e.tipo_logradouro,
+        e.logradouro,
+        e.numero,
+        e.complemento,
+        e.bairro,
+        e.cep,
+        e.uf,
+        e.codigo_municipio,
+        mun.descricao as municipio_nome,
+        
+        -- Contato
+        e.ddd_1,
+        e.telefone_1,
+        e.ddd_2,
+        e.telefone_2,
+        e.ddd_fax,
+        e.fax,
+        e.correio_eletronico,
+        
+        -- Situação especial
+        e.situacao_especial,
+        e.data_situacao_especial,
+        
+        -- Simples Nacional
+        s.opcao_simples,
+        s.data_opcao_simples,
+        s.data_exclusao_simples,
+        s.opcao_mei,
+        s.data_opcao_mei,
+        s.data_exclusao_mei,
+        
+        -- Sócios (pré-agregados em socios_resumo)
+        COALESCE(sr.total_socios, 0) as total_socios,
+        sr.socios_cnpj,
+        
+        -- Chave de paginação (não vai para o CSV)
+        {chave}
+        
+    FROM {origem}
+    JOIN empresas emp ON e.cnpj_basico = emp.cnpj_basico
+    LEFT JOIN naturezas nat ON emp.natureza_juridica = nat.codigo
+    LEFT JOIN cnaes cnae ON e.cnae_fiscal_principal = cnae.codigo
+    LEFT JOIN municipios mun ON e.codigo_municipio = mun.codigo
+    LEFT JOIN simples s ON emp.cnpj_basico = s.cnpj_basico
+    LEFT JOIN socios_resumo sr ON emp.cnpj_basico = sr.cnpj_basico
+    WHERE {filtro}
+    ORDER BY {chave}
+    LIMIT ?
+    """
+    
+    # Sócios das empresas com estabelecimento em uma UF; a subconsulta IN não é
+    # correlacionada: as empresas do estado são lidas uma vez pelo índice de UF
+    CONSULTA_SOCIOS = """
+    SELECT DISTINCT
+        s.cnpj_basico,
+        emp.razao_social,
+        s.identificador_socio,
+        s.nome_socio,
+        s.cpf_cnpj_socio,
+        s.codigo_qualificacao_socio,
+        q.descricao as qualificacao_descricao,
+        s.data_entrada_sociedade,
+        s.codigo_pais,
+        p.descricao as pais_descricao,
+        s.representante_legal,
+        s.nome_representante,
+        s.codigo_qualificacao_representante,
+        s.faixa_etaria
+    FROM socios s
+    JOIN empresas emp ON s.cnpj_basico = emp.cnpj_basico
+    LEFT JOIN qualificacoes q ON s.codigo_qualificacao_socio = q.codigo
+    LEFT JOIN paises p ON s.codigo_pais = p.codigo
+    WHERE s.cnpj_basico IN (SELECT cnpj_basico FROM estabelecimentos WHERE uf = ?)
+    ORDER BY s.cnpj_basico, s.nome_socio
+    """
+    
+    # Ordenações da exportação, ambas percorridas por índice, sem ordenação temporária:
+    # - razao: razão social, pela chave primária de ordem_exportacao, um estado por vez
+    # - cnpj: chave primária de estabelecimentos, todos os estados em um único percurso
+    #   ('+' impede o uso do índice de UF, que exigiria ordenar o resultado); um estado
+    #   sozinho (--jobs, --por-estado, uma única UF) usa o índice (uf, CNPJ) de
+    #   ordem_exportacao em vez de percorrer a tabela inteira
+    ORDENACOES = {
+        'razao': {
+            'origem': """ordem_exportacao o
+    JOIN estabelecimentos e ON e.cnpj_basico = o.cnpj_basico
+                           AND e.cnpj_ordem = o.cnpj_ordem
+                           AND e.cnpj_dv = o.cnpj_dv""",
+            'chave': ['o.razao_social', 'o.cnpj_ordem', 'o.cnpj_basico', 'o.cnpj_dv'],
+            'filtro': "o.uf IN ({estados})",
+        },
+        'cnpj': {
+            'origem': "estabelecimentos e",
+            'chave': ['e.cnpj_basico', 'e.cnpj_ordem', 'e.cnpj_dv'],
+            'filtro': "+e.uf IN ({estados}) AND +e.situacao_cadastral = '02'",
+            'estado_unico': {
+                'origem': """ordem_exportacao o
+    JOIN estabelecimentos e ON e.cnpj_basico = o.cnpj_basico
+                           AND e.cnpj_ordem = o.cnpj_ordem
+                           AND e.cnpj_dv = o.cnpj_dv""",
+                'chave': ['o.cnpj_basico', 'o.cnpj_ordem', 'o.cnpj_dv'],
+                'filtro': "o.uf IN ({estados})",
+            },
+        },
+    }
+    
+    def __init__(self, db_path: str = "./cnpj_dados.db", output_dir: str = "./csv_estados",
+                 somente_leitura: bool = False, compressao: Optional[str] = None,
+                 ordem: str = 'razao'):
+        """
+        Inicializa o gerador
+        
+        Args:
+            db_path: Caminho do banco SQLite
+            output_dir: Diretório de saída dos arquivos CSV
+            somente_leitura: Se True, abre o banco em modo somente leitura
+            compressao: None, 'gzip' ou 'zstd' (arquivos .csv.gz / .csv.zst)
+            ordem: 'razao' (razão social, padrão) ou 'cnpj' (chave primária)
+        """
+        if compressao not in EXTENSOES:
+            raise ValueError(f"Compressão inválida: {compressao} (use gzip ou zstd)")
+        if ordem not in self.ORDENACOES:
+            raise ValueError(f"Ordem inválida: {ordem} (use {' ou '.join(self.ORDENACOES)})")
+        if compressao == 'zstd' and zstandard is None:
+            raise ImportError("zstandard não instalado. Execute: pip install zstandard")
+        
+        self.db_path = db_path
+        self.somente_leitura = somente_leitura
+        self.compressao = compressao
+        self.ordem = ordem
+        self.extensao = EXTENSOES[compressao]
+        self.bytes_por_estado: Dict[str, List[int]] = {}  # UF -> [bytes do CSV, bytes gravados]
+        self.output_dir = Path(output_dir)
+        self.max_linhas_arquivo = 100000  # 100 mil linhas por arquivo
+        self._derivadas_prontas = False
+        
+        # Criar diretório de saída
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        
+        logger.info(f"Gerador inicializado - Banco: {db_path}, Saída: {output_dir}")
+    
+    def get_connection(self) -> sqlite3.Connection:
+        """Retorna conexão com o banco"""
+        if self.somente_leitura:
+            return sqlite3.connect(Path(self.db_path).resolve().as_uri() + '?mode=ro', uri=True)
+        return sqlite3.connect(self.db_path)
+    
+    def preparar_tabelas_derivadas(self):
+        """
+        Garante as tabelas pré-agregadas usadas na exportação (ex: socios_resumo)
+        
+        Normalmente já foram criadas ao final da importação; bancos importados
+        por versões anteriores recebem as tabelas aqui, uma única vez.
+        """
+        if self._derivadas_prontas:
+            return
+        
+        conn = self.get_connection()
+        try:
+            construir_tabelas_derivadas(conn, apenas_ausentes=True, tabelas=self.TABELAS_DERIVADAS)
+        finally:
+            conn.close()
+        self._derivadas_prontas = True
+    
+    def get_socios_cnpj(self, cnpj_basico: str) -> str:
+        """
+        Busca todos os CNPJs dos sócios de uma empresa
+        
+        Args:
+            cnpj_basico: CNPJ básico da empresa
+            
+        Returns:
+            String com CNPJs dos sócios separados por vírgula
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            self.preparar_tabelas_derivadas()
+            cursor.execute("SELECT socios_cnpj FROM socios_resumo WHERE cnpj_basico = ?", (cnpj_basico,))
+            result = cursor.fetchone()
+            return (result[0] or '') if result else ''
+        
+        except Exception as e:
+            logger.warning(f"Erro ao buscar sócios CNPJ: {e}")
+            return ''
+        
+        finally:
+            conn.close()
+
+    def get_estados_disponiveis(self) -> List[str]:
+        """
+        Obtém lista de estados com dados (da tabela estatisticas, se existir)
+        
+        Returns:
+            Lista de códigos UF
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        por_uf = ler_estatisticas(conn, 'uf')
+        if por_uf is not None:
+            estados = sorted(por_uf)
+        else:
+            query = """
+            SELECT DISTINCT uf 
+            FROM estabelecimentos 
+            WHERE uf IS NOT NULL AND uf != ''
+            ORDER BY uf
+            """
+            
+            cursor.execute(query)
+            estados = [row[0] for row in cursor.fetchall()]
+        
+        conn.close()
+        
+        logger.info(f"Estados encontrados: {len(estados)} - {', '.join(estados)}")
+        return estados
+    
+    def contar_registros_por_estado(self, uf: str) -> int:
+        """
+        Conta quantos registros existem para um estado
+        
+        Args:
+            uf: Código do estado
+            
+        Returns:
+            Número de registros
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        ativos = ler_estatisticas(conn, 'uf_ativos')
+        if ativos is not None:
+            conn.close()
+            return ativos.get(uf, 0)
+        
+        query = """
+        SELECT COUNT(*)
+        FROM estabelecimentos e
+        LEFT JOIN empresas emp ON e.cnpj_basico = emp.cnpj_basico
+        WHERE e.uf = ? AND e.situacao_cadastral = '02'
+        """
+        
+        cursor.execute(query, (uf,))
+        count = cursor.fetchone()[0]
+        
+        conn.close()
+        return count
+    
+    def contar_registros_todos_estados(self) -> Dict[str, int]:
+        """
+        Conta os registros ativos de todos os estados (tabela estatisticas ou uma única consulta)
+        
+        Returns:
+            Dicionário UF -> número de registros
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        contagem = ler_estatisticas(conn, 'uf_ativos')
+        if contagem is None:
+            cursor.execute("""
+            SELECT uf, COUNT(*)
+            FROM estabelecimentos
+            WHERE situacao_cadastral = '02' AND uf IS NOT NULL AND uf != ''
+            GROUP BY uf
+            """)
+            contagem = dict(cursor.fetchall())
+        
+        conn.close()
+        return contagem
+    
+    def gerar_csv_para_estado(self, uf: str) -> List[str]:
+        """
+        Gera arquivos CSV para um estado específico
+        
+        Args:
+            uf: Código do estado
+            
+        Returns:
+            Lista de arquivos gerados
+        """
+        logger.info(f"Processando estado: {uf}")
+        
+        arquivos_gerados = self.gerar_csv_estados([uf])[uf]
+        
+        if not arquivos_gerados:
+            logger.warning(f"Nenhum registro encontrado para {uf}")
+        return arquivos_gerados
+    
+    def gerar_csv_estados(self, estados: List[str]) -> Dict[str, List[str]]:
+        """
+        Gera os CSVs de vários estados com uma única conexão
+        
+        Os registros são lidos em páginas de TAMANHO_PAGINA pela chave da
+        ordenação escolhida (keyset): a página seguinte começa depois da última
+        chave lida, sem cursor aberto durante o estado inteiro nem ordenação
+        temporária. Na ordem por razão social cada estado é um percurso de
+        ordem_exportacao; na ordem por CNPJ todos os estados saem de um único
+        percurso da chave primária (um estado sozinho percorre só as suas
+        linhas, pelo índice (uf, CNPJ) de ordem_exportacao).
+        
+        O escritor de cada estado troca de arquivo a cada max_linhas_arquivo
+        registros (UF_001.csv, UF_002.csv...; UF.csv quando o estado cabe em um
+        arquivo) e, a cada arquivo concluído, o progresso do estado é gravado
+        em .UF.progresso.json: uma geração interrompida continua a partir do
+        último arquivo concluído.
+        
+        Args:
+            estados: Códigos UF a gerar
+            
+        Returns:
+            Dicionário UF -> lista de arquivos gerados
+        """
+        self.preparar_tabelas_derivadas()
+        
+        # Valida a retomada: o progresso só vale para os mesmos dados e opções
+        impressoes = self.calcular_impressoes(estados, incluir_socios=False)
+        
+        grupos = [[uf] for uf in estados] if self.ordem == 'razao' else [estados]
+        
+        conn = self.get_connection()
+        arquivos_gerados = {}
+        
+        try:
+            for grupo in grupos:
+                arquivos_gerados.update(self._gerar_csv_grupo(conn, grupo, impressoes))
+        
+        finally:
+            conn.close()
+        
+        return arquivos_gerados
+    
+    def consulta_pagina(self, quantidade_estados: int, apos_chave: bool) -> str:
+        """
+        Monta a consulta de uma página da exportação na ordem escolhida
+        
+        Parâmetros da consulta: as UFs, a última chave lida (se apos_chave) e
+        o tamanho da página.
+        
+        Args:
+            quantidade_estados: Número de UFs no filtro
+            apos_chave: Se True, começa depois de uma chave (páginas seguintes)
+        
+        Returns:
+            SQL da consulta
+        """
+        ordenacao = self.ORDENACOES[self.ordem]
+        if quantidade_estados == 1:
+            ordenacao = ordenacao.get('estado_unico', ordenacao)
+        chave = ', '.join(ordenacao['chave'])
+        filtro = ordenacao['filtro'].format(estados=', '.join('?' * quantidade_estados))
+        if apos_chave:
+            filtro += f" AND ({chave}) > ({', '.join('?' * len(ordenacao['chave']))})"
+        
+        return self.CONSULTA_PRINCIPAL.format(chave=chave, origem=ordenacao['origem'], filtro=filtro)
+    
+    def plano_exportacao(self) -> List[str]:
+        """
+        Plano de execução (EXPLAIN QUERY PLAN) das consultas de página
+        
+        Returns:
+            Linhas do plano da primeira página e das seguintes (na ordem por
+            CNPJ, de um estado sozinho e depois de vários estados)
+        """
+        self.preparar_tabelas_derivadas()
+        
+        # Razão social: sempre um estado por percurso; CNPJ: um estado ou vários
+        quantidades = [1] if self.ordem == 'razao' else [1, 2]
+        chave = [''] * len(self.ORDENACOES[self.ordem]['chave'])
+        
+        conn = self.get_connection()
+        try:
+            plano = []
+            for quantidade in quantidades:
+                for apos_chave in (False, True):
+                    parametros = ['SP'] * quantidade + (chave if apos_chave else []) + [self.TAMANHO_PAGINA]
+                    consulta = self.consulta_pagina(quantidade, apos_chave)
+                    plano.extend(linha[3] for linha in conn.execute(f"EXPLAIN QUERY PLAN {consulta}", parametros))
+        finally:
+            conn.close()
+        
+        return plano
+    
+    def plano_socios(self) -> List[str]:
+        """
+        Plano de execução (EXPLAIN QUERY PLAN) da consulta de sócios de uma UF
+        
+        Returns:
+            Linhas do plano
+        """
+        conn = self.get_connection()
+        try:
+            return [linha[3] for linha in conn.execute(f"EXPLAIN QUERY PLAN {self.CONSULTA_SOCIOS}", ('SP',))]
+        finally:
+            conn.close()
+    
+    def verificar_plano_exportacao(self) -> List[str]:
+        """
+        Confere que a exportação não ordena em uma B-tree temporária
+        
+        Returns:
+            Linhas do plano de execução
+        
+        Raises:
+            RuntimeError: Se o plano usa USE TEMP B-TREE (ordenação sem índice)
+        """
+        plano = self.plano_exportacao()
+        temporarias = [linha for linha in plano if 'TEMP B-TREE' in linha]
+        if temporarias:
+            raise RuntimeError(f"Exportação na ordem '{self.ordem}' usa ordenação temporária: "
+                               f"{'; '.join(temporarias)}")
+        return plano
+    
+    def _gerar_csv_grupo(self, conn: sqlite3.Connection, estados: List[str],
+                         impressoes: Dict[str, Optional[Dict]]) -> Dict[str, List[str]]:
+        """
+        Gera os CSVs de um grupo de estados lidos no mesmo percurso
+        
+        Cada estado retoma do seu próprio progresso: o percurso começa na menor
+        chave já gravada e ignora as linhas que o estado já tinha escrito.
+        
+        Args:
+            conn: Conexão com o banco
+            estados: Códigos UF do percurso
+            impressoes: Impressão digital dos dados de cada estado
+        
+        Returns:
+            Dicionário UF -> lista de arquivos gerados
+        """
+        escritores = {}
+        retomadas = {}
+        for uf in estados:
+            progresso = self._carregar_progresso(uf, impressoes[uf])
+            escritor = _EscritorRotativo(self.output_dir, uf, self.COLUNAS, self.max_linhas_arquivo,
+                                         self.compressao, retomar=progresso)
+            escritor.ao_concluir_arquivo = (
+                lambda concluido, uf=uf: self._salvar_progresso(uf, concluido, impressoes[uf])
+            )
+            escritores[uf] = escritor
+            retomadas[uf] = escritor.ultima_chave
+        
+        chave = None if None in retomadas.values() else min(retomadas.values())
+        
+        # Coluna usada no encaminhamento (a chave de paginação vem depois das colunas do CSV)
+        total_colunas = len(self.COLUNAS)
+        col_uf = self.COLUNAS.index('uf')
+        
+        primeira_pagina = self.consulta_pagina(len(estados), apos_chave=False)
+        paginas_seguintes = self.consulta_pagina(len(estados), apos_chave=True)
+        
+        linha_atual = 0
+        
+        try:
+            while True:
+                # Buscar a próxima página
+                if chave is None:
+                    rows = conn.execute(primeira_pagina, (*estados, self.TAMANHO_PAGINA)).fetchall()
+                else:
+                    rows = conn.execute(paginas_seguintes, (*estados, *chave, self.TAMANHO_PAGINA)).fetchall()
+                if not rows:
+                    break
+                
+                for row in rows:
+                    chave = row[total_colunas:]
+                    uf = row[col_uf]
+                    if retomadas[uf] is not None and chave <= retomadas[uf]:
+                        continue  # já gravada antes da interrupção
+                    
+                    escritores[uf].escrever(row[:total_colunas], chave)
+                    linha_atual += 1
+                    
+                    # Log de progresso
+                    if linha_atual % 50000 == 0:
+                        logger.info(f"{', '.join(estados)}: processadas {linha_atual:,} linhas")
+        
+        except Exception as e:
+            logger.error(f"Erro ao gerar CSVs de {', '.join(estados)}: {e}")
+            for escritor in escritores.values():
+                escritor.abortar()
+            raise
+        
+        arquivos_gerados = {}
+        for uf, escritor in escritores.items():
+            arquivos_gerados[uf] = escritor.fechar()
+            self._remover_progresso(uf)
+            self._registrar_bytes(uf, escritor.bytes_csv, escritor.bytes_gravados)
+            logger.info(f"Estado {uf} concluído: {len(arquivos_gerados[uf])} arquivos, "
+                        f"{escritor.total:,} registros")
+        
+        return arquivos_gerados
+    
+    def _caminho_progresso(self, uf: str) -> Path:
+        """Arquivo de progresso da geração de um estado"""
+        return self.output_dir / f".{uf}.progresso.json"
+    
+    def _carregar_progresso(self, uf: str, impressao: Optional[Dict]) -> Optional[Dict]:
+        """
+        Lê o progresso de uma geração interrompida, se ainda for válido
+        
+        Args:
+            uf: Código do estado
+            impressao: Impressão digital atual dos dados do estado
+        
+        Returns:
+            Progresso salvo, ou None para gerar o estado desde o início
+        """
+        caminho = self._caminho_progresso(uf)
+        if not caminho.exists():
+            return None
+        
+        try:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                progresso = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Progresso de {uf} ilegível, gerando desde o início: {e}")
+            return None
+        
+        if impressao is None or progresso.get('impressao') != impressao:
+            logger.info(f"Progresso de {uf} descartado: dados ou opções mudaram desde a interrupção")
+            return None
+        
+        concluidos = [_EscritorRotativo.caminho_parte(self.output_dir, uf, indice, self.extensao)
+                      for indice in range(1, progresso['arquivos_concluidos'] + 1)]
+        if not all(arquivo.exists() for arquivo in concluidos):
+            logger.info(f"Progresso de {uf} descartado: arquivos concluídos ausentes")
+            return None
+        
+        logger.info(f"Retomando {uf} após {progresso['arquivos_concluidos']} arquivo(s) "
+                    f"({progresso['registros']:,} registros)")
+        return progresso
+    
+    def _salvar_progresso(self, uf: str, escritor: '_EscritorRotativo', impressao: Optional[Dict]):
+        """Grava (de forma atômica) o progresso após um arquivo concluído"""
+        if impressao is None:
+            return  # sem controle de gerações não há como validar a retomada
+        
+        progresso = {
+            'impressao': impressao,
+            'arquivos_concluidos': len(escritor.arquivos),
+            'ultima_chave': list(escritor.ultima_chave),
+            'registros': escritor.total,
+            'bytes_csv': escritor.bytes_csv,
+            'bytes_gravados': escritor.bytes_gravados
+        }
+        
+        caminho = self._caminho_progresso(uf)
+        temporario = caminho.with_name(caminho.name + '.tmp')
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(progresso, f, ensure_ascii=False)
+        os.replace(temporario, caminho)
+    
+    def _remover_progresso(self, uf: str):
+        """Remove o progresso de um estado concluído"""
+        caminho = self._caminho_progresso(uf)
+        if caminho.exists():
+            caminho.unlink()
+    
+    def gerar_arquivo_socios_separado(self, uf: str) -> List[str]:
+        """
+        Gera arquivo separado com dados dos sócios para um estado
+        
+        As empresas do estado vêm de uma única leitura do índice de UF
+        (subconsulta IN, avaliada uma vez, e não uma subconsulta correlacionada
+        por sócio); cada sócio sai uma vez, mesmo que a empresa tenha várias
+        filiais no estado, e linhas repetidas na tabela socios saem uma só vez
+        (DISTINCT). Acima de max_linhas_arquivo registros o arquivo é dividido
+        (UF_socios_001.csv, UF_socios_002.csv, ...).
+        
+        Args:
+            uf: Código do estado
+            
+        Returns:
+            Lista de arquivos gerados (vazia se não há sócios)
+        """
+        logger.info(f"Gerando arquivo de sócios para {uf}")
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        escritor = _EscritorRotativo(self.output_dir, f"{uf}_socios", self.COLUNAS_SOCIOS,
+                                     self.max_linhas_arquivo, self.compressao)
+        
+        try:
+            cursor.execute(self.CONSULTA_SOCIOS, (uf,))
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    break
+                for row in rows:
+                    escritor.escrever(row)
+        
+        except Exception:
+            escritor.abortar()
+            raise
+        
+        finally:
+            conn.close()
+        
+        arquivos = escritor.fechar()
+        self._registrar_bytes(uf, escritor.bytes_csv, escritor.bytes_gravados)
+        
+        if arquivos:
+            logger.info(f"Sócios de {uf}: {len(arquivos)} arquivo(s), {escritor.total:,} registros")
+        else:
+            logger.info(f"Nenhum sócio encontrado para {uf}")
+        return arquivos
+    
+    def _registrar_bytes(self, uf: str, bytes_csv: int, bytes_gravados: int):
+        """Acumula o volume escrito de um estado (antes e depois da compressão)"""
+        volume = self.bytes_por_estado.setdefault(uf, [0, 0])
+        volume[0] += bytes_csv
+        volume[1] += bytes_gravados
+    
+    def _anexar_bytes(self, uf: str, info: Dict) -> Dict:
+        """Inclui no resumo do estado o volume escrito"""
+        info['bytes_csv'], info['bytes_gravados'] = self.bytes_por_estado.get(uf, [0, 0])
+        return info
+    
+    def gerar_estado(self, uf: str, incluir_socios: bool = True) -> Dict:
+        """
+        Gera os arquivos principais e, se solicitado, o de sócios de um estado
+        
+        Args:
+            uf: Código do estado
+            incluir_socios: Se deve gerar o arquivo separado de sócios
+            
+        Returns:
+            Resumo do estado (mesmo formato usado em gerar_arquivo_resumo)
+        """
+        arquivos = self.gerar_csv_para_estado(uf)
+        socios = self.gerar_arquivo_socios_separado(uf) if incluir_socios else []
+        info = {
+            'arquivos_principais': len(arquivos),
+            'arquivos_socios': len(socios),
+            'arquivos': [Path(arquivo).name for arquivo in arquivos + socios]
+        }
+        
+        return self._anexar_bytes(uf, info)
+    
+    def _gerar_estados_paralelo(self, estados: List[str], incluir_socios: bool, jobs: int) -> Dict:
+        """
+        Gera os estados em um pool de processos, maiores primeiro
+        
+        Cada processo abre sua própria conexão somente leitura. Começar pelos
+        estados com mais registros (SP, MG, RJ...) evita que um estado grande
+        fique sozinho no final, com os demais processos ociosos.
+        
+        Args:
+            estados: Códigos UF a gerar
+            incluir_socios: Se deve gerar os arquivos de sócios
+            jobs: Número de processos
+            
+        Returns:
+            Resumo por estado
+        """
+        # Tabelas derivadas precisam existir antes: os processos não gravam no banco
+        self.preparar_tabelas_derivadas()
+        
+        contagem = self.contar_registros_todos_estados()
+        ordem = sorted(estados, key=lambda uf: contagem.get(uf, 0), reverse=True)
+        logger.info(f"Geração paralela com {jobs} processos, ordem: {', '.join(ordem)}")
+        
+        resumo = {}
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futuros = {
+                executor.submit(_gerar_estado_em_processo, self.db_path, str(self.output_dir),
+                                self.max_linhas_arquivo, uf, incluir_socios, self.compressao,
+                                self.ordem): uf
+                for uf in ordem
+            }
+            
+            for futuro in as_completed(futuros):
+                uf = futuros[futuro]
+                try:
+                    resumo[uf] = futuro.result()
+                    logger.info(f"Estado {uf} finalizado ({len(resumo)}/{len(ordem)})")
+                except Exception as e:
+                    logger.error(f"Erro ao processar estado {uf}: {e}")
+                    resumo[uf] = {'erro': str(e)}
+        
+        return resumo
+    
+    def calcular_impressoes(self, estados: List[str], incluir_socios: bool = True) -> Dict[str, Optional[Dict]]:
+        """
+        Calcula a impressão digital dos dados exportados de cada estado
+        
+        A impressão combina o identificador do banco, a geração em que os dados
+        da UF mudaram por último (tabela geracao_uf, mantida pela importação),
+        um hash das tabelas de referência e as opções de exportação. Não exige
+        ler os estabelecimentos.
+        
+        Args:
+            estados: Códigos UF
+            incluir_socios: Se os arquivos de sócios fazem parte da geração
+        
+        Returns:
+            Dicionário UF -> impressão (None se o banco não controla gerações)
+        """
+        conn = self.get_connection()
+        try:
+            try:
+                banco = conn.execute("SELECT valor FROM metadados WHERE chave = 'banco_id'").fetchone()
+                geracoes = dict(conn.execute("SELECT uf, geracao FROM geracao_uf"))
+            except sqlite3.OperationalError:
+                banco = None
+            
+            if banco is None:
+                logger.info("Banco sem controle de gerações: todos os estados serão gerados")
+                return {uf: None for uf in estados}
+            
+            referencias = hashlib.blake2b(digest_size=16)
+            for tabela in self.TABELAS_REFERENCIA:
+                for linha in conn.execute(f"SELECT * FROM {tabela} ORDER BY 1"):
+                    referencias.update(repr(linha).encode('utf-8'))
+        finally:
+            conn.close()
+        
+        formato = hashlib.blake2b(digest_size=16)
+        formato.update(repr((self.consulta_pagina(1, True), self.COLUNAS, self.COLUNAS_SOCIOS)).encode('utf-8'))
+        
+        return {
+            uf: {
+                'banco': banco[0],
+                'geracao': geracoes.get(uf),
+                'referencias': referencias.hexdigest(),
+                'formato': formato.hexdigest(),
+                'compressao': self.compressao,
+                'max_linhas': self.max_linhas_arquivo,
+                'ordem': self.ordem,
+                'socios': incluir_socios
+            }
+            for uf in estados
+        }
+    
+    def _estado_inalterado(self, uf: str, impressao: Optional[Dict], registro: Optional[Dict]) -> bool:
+        """Verifica se a última geração de um estado continua válida"""
+        if impressao is None or not registro or registro.get('impressao') != impressao:
+            return False
+        return all((self.output_dir / arquivo).exists() for arquivo in registro['resumo']['arquivos'])
+    
+    def _carregar_impressoes(self) -> Dict[str, Dict]:
+        """Lê as impressões da última geração (vazio se não houver)"""
+        caminho = self.output_dir / self.ARQUIVO_IMPRESSOES
+        if not caminho.exists():
+            return {}
+        try:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"{caminho} ilegível, todos os estados serão gerados: {e}")
+            return {}
+    
+    def _salvar_impressoes(self, registros: Dict[str, Dict]):
+        """Grava as impressões de forma atômica"""
+        caminho = self.output_dir / self.ARQUIVO_IMPRESSOES
+        temporario = caminho.with_name(caminho.name + '.tmp')
+        with open(temporario, 'w', encoding='utf-8') as f:
+            json.dump(registros, f, indent=2, ensure_ascii=False, sort_keys=True)
+        os.replace(temporario, caminho)
+    
+    def gerar_todos_estados(self, incluir_socios: bool = True, estados_especificos: List[str] = None,
+                            passagem_unica: bool = True, jobs: int = 1, forcar: bool = False):
+        """
+        Gera arquivos CSV para todos os estados
+        
+        Estados cuja impressão digital não mudou desde a última geração (e cujos
+        arquivos continuam no diretório de saída) são mantidos como estão.
+        
+        Args:
+            incluir_socios: Se deve gerar arquivos separados de sócios
+            estados_especificos: Lista de estados específicos (None = todos)
+            passagem_unica: Se True, gera os arquivos principais de todos os estados com uma
+                única conexão e depois os de sócios; se False, gera estado por estado
+            jobs: Processos paralelos, um estado por vez em cada (> 1 ignora passagem_unica)
+            forcar: Se True, regenera também os estados inalterados
+        """
+        logger.info("Iniciando geração de arquivos CSV por estado")
+        inicio = time.time()
+        
+        if estados_especificos:
+            estados = estados_especificos
+            logger.info(f"Processando estados específicos: {', '.join(estados)}")
+        else:
+            estados = self.get_estados_disponiveis()
+        
+        impressoes = self.calcular_impressoes(estados, incluir_socios)
+        registros = self._carregar_impressoes()
+        if forcar:
+            # Regeneração completa: gerações interrompidas também recomeçam do início
+            for uf in estados:
+                self._remover_progresso(uf)
+        inalterados = {}
+        if not forcar:
+            for uf in estados:
+                if self._estado_inalterado(uf, impressoes[uf], registros.get(uf)):
+                    inalterados[uf] = dict(registros[uf]['resumo'], inalterado=True)
+            if inalterados:
+                logger.info(f"Estados inalterados desde a última geração (mantidos): "
+                            f"{', '.join(sorted(inalterados))}")
+                estados = [uf for uf in estados if uf not in inalterados]
+        
+        total_arquivos = 0
+        resumo = {}
+        
+        arquivos_por_estado = {}
+        if not estados:
+            logger.info("Nenhum estado a gerar (use --force para regenerar)")
+        elif jobs > 1:
+            resumo = self._gerar_estados_paralelo(estados, incluir_socios, jobs)
+        elif passagem_unica:
+            try:
+                arquivos_por_estado = self.gerar_csv_estados(estados)
+            except Exception as e:
+                logger.error(f"Erro na geração em passagem única: {e}")
+                resumo = {uf: {'erro': str(e)} for uf in estados}
+        
+        for uf in estados:
+            if uf in resumo:
+                continue
+            
+            try:
+                if passagem_unica:
+                    # Arquivos principais já gerados na passagem única
+                    arquivos = arquivos_por_estado[uf]
+                    
+                    # Gerar arquivo de sócios se solicitado
+                    socios = self.gerar_arquivo_socios_separado(uf) if incluir_socios else []
+                    resumo[uf] = self._anexar_bytes(uf, {
+                        'arquivos_principais': len(arquivos),
+                        'arquivos_socios': len(socios),
+                        'arquivos': [Path(arquivo).name for arquivo in arquivos + socios]
+                    })
+                else:
+                    resumo[uf] = self.gerar_estado(uf, incluir_socios)
+                
+            except Exception as e:
+                logger.error(f"Erro ao processar estado {uf}: {e}")
+                resumo[uf] = {'erro': str(e)}
+        
+        # Guardar as impressões dos estados gerados (um estado com erro será refeito)
+        for uf in estados:
+            if 'erro' in resumo[uf]:
+                registros.pop(uf, None)
+            else:
+                registros[uf] = {
+                    'impressao': impressoes[uf],
+                    'resumo': {chave: resumo[uf][chave]
+                               for chave in ('arquivos_principais', 'arquivos_socios', 'arquivos')},
+                    'gerado_em': datetime.now().isoformat(timespec='seconds')
+                }
+        self._salvar_impressoes(registros)
+        resumo.update(inalterados)
+        
+        for info in resumo.values():
+            if 'erro' not in info:
+                total_arquivos += info['arquivos_principais'] + info['arquivos_socios']
+        
+        # Mostrar resumo
+        logger.info("="*60)
+        logger.info("RESUMO DA GERAÇÃO")
+        logger.info("="*60)
+        logger.info(f"Total de arquivos gerados: {total_arquivos}")
+        logger.info(f"Diretório de saída: {self.output_dir}")
+        
+        for uf, info in resumo.items():
+            if 'erro' in info:
+                logger.error(f"{uf}: ERRO - {info['erro']}")
+            else:
+                socios_txt = f" + {info['arquivos_socios']} de sócios" if info['arquivos_socios'] else ""
+                inalterado_txt = " (inalterado)" if info.get('inalterado') else ""
+                logger.info(f"{uf}: {info['arquivos_principais']} arquivo(s){socios_txt}{inalterado_txt}")
+        
+        logger.info("="*60)
+        
+        # Gerar arquivo de resumo
+        self.gerar_arquivo_resumo(resumo, time.time() - inicio)
+    
+    def gerar_arquivo_resumo(self, resumo: Dict, duracao: Optional[float] = None):
+        """
+        Gera arquivo de resumo da geração
+        
+        Args:
+            resumo: Dicionário com resumo da geração
+            duracao: Tempo total da geração em segundos (para a vazão)
+        """
+        resumo_path = self.output_dir / "RESUMO.txt"
+        
+        with open(resumo_path, 'w', encoding='utf-8') as f:
+            f.write("RESUMO DA GERAÇÃO DE ARQUIVOS CSV\n")
+            f.write("=" * 50 + "\n")
+            f.write(f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
+            f.write(f"Diretório: {self.output_dir}\n")
+            f.write(f"Limite por arquivo: {self.max_linhas_arquivo:,} linhas\n\n")
+            
+            total_arquivos = 0
+            for uf, info in resumo.items():
+                if 'erro' not in info:
+                    total_arquivos += info['arquivos_principais'] + info['arquivos_socios']
+            
+            f.write(f"Total de arquivos gerados: {total_arquivos}\n\n")
+            
+            f.write("DETALHES POR ESTADO:\n")
+            f.write("-" * 30 + "\n")
+            
+            for uf in sorted(resumo.keys()):
+                info = resumo[uf]
+                if 'erro' in info:
+                    f.write(f"{uf}: ERRO - {info['erro']}\n")
+                else:
+                    socios_txt = (f" + {info['arquivos_socios']} arquivo(s) de sócios"
+                                  if info['arquivos_socios'] else "")
+                    volume_txt = ""
+                    if self.compressao and info.get('bytes_gravados'):
+                        volume_txt = (f" ({info['bytes_csv'] / MB:,.1f} MB -> "
+                                      f"{info['bytes_gravados'] / MB:,.1f} MB)")
+                    if info.get('inalterado'):
+                        volume_txt = " (inalterado, mantido da geração anterior)"
+                    f.write(f"{uf}: {info['arquivos_principais']} arquivo(s) principal(is){socios_txt}{volume_txt}\n")
+            
+            # Volume escrito, compressão e vazão
+            bytes_csv = sum(info.get('bytes_csv', 0) for info in resumo.values())
+            bytes_gravados = sum(info.get('bytes_gravados', 0) for info in resumo.values())
+            
+            f.write("\nVOLUME:\n")
+            f.write("-" * 20 + "\n")
+            f.write(f"Compressão: {self.compressao or 'nenhuma'}\n")
+            f.write(f"CSV gerado: {bytes_csv / MB:,.1f} MB\n")
+            f.write(f"Gravado em disco: {bytes_gravados / MB:,.1f} MB\n")
+            if bytes_gravados:
+                f.write(f"Taxa de compressão: {bytes_csv / bytes_gravados:.2f}x\n")
+            if duracao:
+                f.write(f"Tempo total: {duracao:,.1f}s\n")
+                f.write(f"Vazão: {bytes_csv / MB / duracao:,.1f} MB/s de CSV\n")
+            
+            f.write("\nFORMATO DOS ARQUIVOS:\n")
+            f.write("-" * 20 + "\n")
+            f.write(f"- {{UF}}{self.extensao}: Dados completos (se < {self.max_linhas_arquivo:,} registros)\n")
+            f.write(f"- {{UF}}_001{self.extensao}, {{UF}}_002{self.extensao}, etc: Dados divididos "
+                    f"(se > {self.max_linhas_arquivo:,} registros)\n")
+            f.write(f"- {{UF}}_socios{self.extensao} ({{UF}}_socios_001{self.extensao}, ...): "
+                    f"Dados dos sócios separados\n")
+            f.write("\nEncoding: UTF-8\n")
+            f.write("Separador: vírgula (,)\n")
+        
+        logger.info(f"Arquivo de resumo criado: {resumo_path}")
+
+
+def _gerar_estado_em_processo(db_path: str, output_dir: str, max_linhas: int,
+                              uf: str, incluir_socios: bool, compressao: Optional[str] = None,
+                              ordem: str = 'razao') -> Dict:
+    """
+    Gera um estado dentro de um processo do pool (conexão somente leitura própria)
+    
+    Args:
+        db_path: Caminho do banco SQLite
+        output_dir: Diretório de saída
+        max_linhas: Registros por arquivo
+        uf: Código do estado
+        incluir_socios: Se deve gerar o arquivo de sócios
+        compressao: None, 'gzip' ou 'zstd'
+        ordem: 'razao' ou 'cnpj'
+        
+    Returns:
+        Resumo do estado
+    """
+    gerador = GeradorCSVEstados(db_path, output_dir, somente_leitura=True, compressao=compressao,
+                                ordem=ordem)
+    gerador.max_linhas_arquivo = max_linhas
+    gerador._derivadas_prontas = True  # preparadas pelo processo principal
+    return gerador.gerar_estado(uf, incluir_socios)
+
+
+class _ContadorBytes(io.RawIOBase):
+    """Camada binária que conta os bytes do CSV antes de repassá-los ao compressor"""
+    
+    def __init__(self, destino, arquivo):
+        """
+        Inicializa o contador
+        
+        Args:
+            destino: Fluxo que recebe os bytes (compressor ou o próprio arquivo)
+            arquivo: Arquivo em disco, fechado depois do destino
+        """
+        self.destino = destino
+        self.arquivo = arquivo
+        self.bytes = 0
+    
+    def writable(self):
+        return True
+    
+    def write(self, dados):
+        self.bytes += len(dados)
+        self.destino.write(dados)
+        return len(dados)
+    
+    def close(self):
+        if not self.closed:
+            self.destino.close()
+            if not self.arquivo.closed:
+                self.arquivo.close()
+        super().close()
+
+
+def _abrir_csv_saida(caminho: Path, compressao: Optional[str] = None):
+    """
+    Abre um arquivo CSV para escrita em streaming, comprimido ou não
+    
+    Args:
+        caminho: Arquivo de saída
+        compressao: None, 'gzip' ou 'zstd'
+        
+    Returns:
+        Tupla (fluxo de texto UTF-8 para o csv.writer, contador de bytes do CSV)
+    """
+    arquivo = open(caminho, 'wb')
+    if compressao == 'gzip':
+        destino = gzip.GzipFile(fileobj=arquivo, mode='wb', compresslevel=6)
+    elif compressao == 'zstd':
+        destino = zstandard.ZstdCompressor(level=3).stream_writer(arquivo)
+    else:
+        destino = arquivo
+    
+    contador = _ContadorBytes(destino, arquivo)
+    texto = io.TextIOWrapper(io.BufferedWriter(contador, buffer_size=1024 * 1024),
+                             encoding='utf-8', newline='')
+    return texto, contador
+
+
+class _EscritorRotativo:
+    """
+    Escritor CSV que troca de arquivo a cada max_linhas registros
+    
+    Grava UF_001.csv, UF_002.csv, ...; se tudo couber em um único
+    arquivo, ele é renomeado para UF.csv ao fechar.
+    """
+    
+    def __init__(self, output_dir: Path, prefixo: str, colunas: List[str], max_linhas: int,
+                 compressao: Optional[str] = None, retomar: Optional[Dict] = None):
+        """
+        Inicializa o escritor (os arquivos só são criados na primeira linha)
+        
+        Args:
+            output_dir: Diretório de saída
+            prefixo: Início do nome dos arquivos (ex: SP ou SP_socios)
+            colunas: Cabeçalho dos arquivos
+            max_linhas: Registros por arquivo
+            compressao: None, 'gzip' ou 'zstd'
+            retomar: Progresso de uma geração interrompida: os arquivos já
+                concluídos são mantidos e a escrita continua no seguinte
+        """
+        self.output_dir = output_dir
+        self.prefixo = prefixo
+        self.colunas = colunas
+        self.max_linhas = max_linhas
+        self.compressao = compressao
+        self.extensao = EXTENSOES[compressao]
+        self.arquivos: List[Path] = []
+        self.total = 0
+        self.bytes_csv = 0
+        self.bytes_gravados = 0
+        self._arquivo = None
+        self._contador = None
+        self._writer = None
+        self._linhas_arquivo = 0
+        self.ultima_chave = None
+        self.ao_concluir_arquivo = None  # chamada com o escritor a cada arquivo cheio fechado
+        
+        if retomar:
+            self.arquivos = [self.caminho_parte(output_dir, prefixo, indice, self.extensao)
+                             for indice in range(1, retomar['arquivos_concluidos'] + 1)]
+            self.total = retomar['registros']
+            self.bytes_csv = retomar['bytes_csv']
+            self.bytes_gravados = retomar['bytes_gravados']
+            self.ultima_chave = tuple(retomar['ultima_chave'])
+        
+        # Remover arquivos de uma geração anterior (qualquer compressão), menos os retomados
+        for extensao in EXTENSOES.values():
+            for antigo in [output_dir / f"{prefixo}{extensao}",
+                           *output_dir.glob(f"{prefixo}_[0-9][0-9][0-9]{extensao}")]:
+                if antigo.exists() and antigo not in self.arquivos:
+                    antigo.unlink()
+    
+    @staticmethod
+    def caminho_parte(output_dir: Path, prefixo: str, indice: int, extensao: str) -> Path:
+        """Caminho do arquivo de número indice da sequência (ex: SP_003.csv)"""
+        return output_dir / f"{prefixo}_{indice:03d}{extensao}"
+    
+    def escrever(self, row: list, chave: Optional[tuple] = None):
+        """
+        Escreve uma linha, abrindo o próximo arquivo quando necessário
+        
+        Args:
+            row: Valores das colunas
+            chave: Chave de ordenação da linha (guardada para retomar a geração)
+        """
+        if self._arquivo is None or self._linhas_arquivo >= self.max_linhas:
+            self._abrir_proximo()
+        
+        self._writer.writerow(row)
+        self._linhas_arquivo += 1
+        self.total += 1
+        self.ultima_chave = chave
+    
+    def _abrir_proximo(self):
+        """Fecha o arquivo atual e abre o próximo da sequência"""
+        if self._arquivo is not None:
+            self._fechar_atual()
+            if self.ao_concluir_arquivo:
+                self.ao_concluir_arquivo(self)
+        
+        arquivo_path = self.caminho_parte(self.output_dir, self.prefixo, len(self.arquivos) + 1, self.extensao)
+        self._arquivo, self._contador = _abrir_csv_saida(arquivo_path, self.compressao)
+        self._writer = csv.writer(self._arquivo)
+        self._writer.writerow(self.colunas)
+        self.arquivos.append(arquivo_path)
+        self._linhas_arquivo = 0
+        
+        logger.info(f"Criando arquivo: {arquivo_path.name}")
+    
+    def _fechar_atual(self):
+        """Fecha o arquivo aberto, se houver"""
+        if self._arquivo:
+            self._arquivo.close()
+            self._arquivo = None
+            self.bytes_csv += self._contador.bytes
+            self.bytes_gravados += self.arquivos[-1].stat().st_size
+            logger.info(f"Arquivo concluído: {self.arquivos[-1].name} ({self._linhas_arquivo:,} linhas)")
+    
+    def abortar(self):
+        """Fecha o arquivo aberto após um erro, sem renomear"""
+        if self._arquivo:
+            self._arquivo.close()
+            self._arquivo = None
+    
+    def fechar(self) -> List[str]:
+        """
+        Fecha o escritor
+        
+        Returns:
+            Arquivos gerados (UF.csv se houve apenas um)
+        """
+        self._fechar_atual()
+        
+        if len(self.arquivos) == 1:
+            unico = self.output_dir / f"{self.prefixo}{self.extensao}"
+            self.arquivos[0].replace(unico)
+            self.arquivos = [unico]
+        
+        return [str(arquivo) for arquivo in self.arquivos]
+
+
+def main():
+    """Função principal"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Gerar arquivos CSV por estado para WordPress')
+    parser.add_argument('--db', default='./cnpj_dados.db', help='Caminho do banco SQLite')
+    parser.add_argument('--output', default='./csv_estados', help='Diretório de saída')
+    parser.add_argument('--estados', nargs='+', help='Estados específicos (ex: SP RJ MG)')
+    parser.add_argument('--sem-socios', action='store_true', help='Não gerar arquivos de sócios')
+    parser.add_argument('--teste', action='store_true', help='Processar apenas alguns estados para teste')
+    parser.add_argument('--por-estado', action='store_true',
+                        help='Gerar estado por estado (principais e sócios) em vez de todos os principais primeiro')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Gerar N estados em paralelo, cada um em seu processo (padrão: 1)')
+    parser.add_argument('--compress', choices=['gzip', 'zstd'],
+                        help='Comprimir os CSVs gerados (.csv.gz ou .csv.zst; zstd requer zstandard)')
+    parser.add_argument('--force', action='store_true',
+                        help='Regenerar todos os estados, mesmo os inalterados desde a última geração')
+    parser.add_argument('--ordem', choices=['razao', 'cnpj'], default='razao',
+                        help='Ordem dos registros: razão social (padrão) ou CNPJ (chave primária)')
+    parser.add_argument('--verificar-plano', action='store_true',
+                        help='Mostrar o plano da consulta de exportação e falhar se houver ordenação temporária')
+    
+    args = parser.parse_args()
+    
+    # Verificar se banco existe
+    if not os.path.exists(args.db):
+        print(f"Erro: Banco de dados não encontrado: {args.db}")
+        print("Execute primeiro o downloader_cnpj.py para baixar os dados")
+        return
+    
+    # Criar gerador
+    gerador = GeradorCSVEstados(args.db, args.output, compressao=args.compress, ordem=args.ordem)
+    
+    if args.verificar_plano:
+        try:
+            for linha in gerador.verificar_plano_exportacao():
+                print(linha)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"✅ Exportação na ordem '{args.ordem}' sem ordenação temporária")
+        return
+    
+    # Determinar estados a processar
+    estados = None
+    if args.teste:
+        estados = ['SP', 'RJ', 'MG']  # Apenas alguns para teste
+        print("Modo teste: processando apenas SP, RJ e MG")
+    elif args.estados:
+        estados = [e.upper() for e in args.estados]
+    
+    try:
+        # Gerar arquivos
+        gerador.gerar_todos_estados(
+            incluir_socios=not args.sem_socios,
+            estados_especificos=estados,
+            passagem_unica=not args.por_estado,
+            jobs=args.jobs,
+            forcar=args.force
+        )
+        
+        print(f"\n✅ Processo concluído!")
+        print(f"📁 Arquivos salvos em: {args.output}")
+        print(f"📄 Veja o arquivo RESUMO.txt para detalhes")
+        
+    except KeyboardInterrupt:
+        print("\n❌ Processo interrompido pelo usuário")
+    except Exception as e:
+        print(f"\n❌ Erro: {e}")
+        logger.exception("Erro detalhado:")
+
+
+if __name__ == "__main__":
+    main()
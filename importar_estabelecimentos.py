@@ -9,6 +9,7 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from downloader_cnpj import CNPJDownloader
+from tabelas_derivadas import contar_registros, ler_estatisticas
 import logging
 
 def importar_estabelecimentos():
@@ -37,11 +38,8 @@ def importar_estabelecimentos():
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
-    cursor.execute("SELECT COUNT(*) FROM estabelecimentos")
-    count_est = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM empresas")
-    count_emp = cursor.fetchone()[0]
+    count_est = contar_registros(conn, 'estabelecimentos')
+    count_emp = contar_registros(conn, 'empresas')
     
     conn.close()
     
@@ -113,14 +111,15 @@ def importar_estabelecimentos():
             if success:
                 success_count += 1
                 
-                # Verificar progresso
+                # Verificar progresso (linhas registradas no journal, sem percorrer a tabela)
                 conn = sqlite3.connect(db_path)
                 cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM estabelecimentos")
+                cursor.execute("SELECT COALESCE(SUM(linhas_processadas), 0) FROM importacao_membros WHERE arquivo = ?",
+                               (filename,))
                 current_count = cursor.fetchone()[0]
                 conn.close()
                 
-                print(f"✅ {filename} processado! Total de estabelecimentos: {current_count:,}")
+                print(f"✅ {filename} processado! Linhas lidas do arquivo: {current_count:,}")
             else:
                 print(f"❌ Erro ao processar {filename}")
                 
@@ -130,18 +129,14 @@ def importar_estabelecimentos():
     print(f"\n🎯 Processamento concluído!")
     print(f"📊 Arquivos processados com sucesso: {success_count}/{len(estabelecimentos_files)}")
     
-    # Estatísticas finais
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT COUNT(*) FROM estabelecimentos")
-    final_count = cursor.fetchone()[0]
-    
-    cursor.execute("SELECT COUNT(*) FROM estabelecimentos WHERE uf IS NOT NULL")
-    with_uf = cursor.fetchone()[0]
+    # Mesmo encerramento do downloader: nova geração e tabelas derivadas (inclui estatisticas)
+    downloader._finalize_import()
     
-    cursor.execute("SELECT uf, COUNT(*) FROM estabelecimentos WHERE uf IS NOT NULL GROUP BY uf ORDER BY COUNT(*) DESC LIMIT 5")
-    top_ufs = cursor.fetchall()
+    conn = sqlite3.connect(db_path)
+    final_count = contar_registros(conn, 'estabelecimentos')
+    por_uf = ler_estatisticas(conn, 'uf')
+    with_uf = sum(por_uf.values())
+    top_ufs = sorted(por_uf.items(), key=lambda item: item[1], reverse=True)[:5]
     
     conn.close()
     
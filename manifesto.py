@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Manifesto de integridade dos arquivos baixados de uma release mensal
+Guarda tamanho esperado, SHA-256 local e data da última importação de cada ZIP
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+
+class ManifestoRelease:
+    """
+    Manifesto (JSON) com o estado de verificação dos ZIPs de uma release
+    
+    Cada registro guarda a release em que o arquivo foi baixado. Sem
+    separar_releases o mesmo diretório (e o mesmo manifesto) serve a vários
+    meses, e os arquivos têm os mesmos nomes: registros de outra release
+    nunca são considerados verificados.
+    """
+    
+    def __init__(self, caminho: Path, release: Optional[str] = None):
+        """
+        Carrega o manifesto, se existir
+        
+        Args:
+            caminho: Arquivo JSON do manifesto
+            release: Identificador da release (ex: 2025-06); None = a release do manifesto
+        """
+        self.caminho = Path(caminho)
+        self.release = release
+        self.arquivos: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        
+        if self.caminho.exists():
+            try:
+                with open(self.caminho, 'r', encoding='utf-8') as f:
+                    dados = json.load(f)
+                self.arquivos = dados.get('arquivos', {})
+                # Manifestos antigos guardavam a release só no topo do arquivo
+                for registro in self.arquivos.values():
+                    registro.setdefault('release', dados.get('release'))
+                self.release = self.release or dados.get('release')
+            except (OSError, ValueError) as e:
+                logger.warning(f"Manifesto {self.caminho} ilegível, recriando: {e}")
+    
+    def __getstate__(self):
+        # O lock não é serializável (processos da importação paralela)
+        estado = self.__dict__.copy()
+        del estado['_lock']
+        return estado
+    
+    def __setstate__(self, estado):
+        self.__dict__.update(estado)
+        self._lock = threading.Lock()
+    
+    def salvar(self):
+        """Grava o manifesto de forma atômica"""
+        with self._lock:
+            dados = {'release': self.release, 'arquivos': self.arquivos}
+            temporario = self.caminho.with_name(self.caminho.name + '.tmp')
+            with open(temporario, 'w', encoding='utf-8') as f:
+                json.dump(dados, f, indent=2, ensure_ascii=False, sort_keys=True)
+            os.replace(temporario, self.caminho)
+    
+    def _registro(self, nome: str) -> Optional[Dict[str, Any]]:
+        """Registro de um arquivo nesta release (None se ausente ou de outra release)"""
+        registro = self.arquivos.get(nome)
+        if registro is None or registro.get('release') != self.release:
+            return None
+        return registro
+    
+    def de_outra_release(self, nome: str) -> bool:
+        """
+        Indica se o arquivo local com esse nome foi baixado para outra release
+        
+        Args:
+            nome: Nome do arquivo
+        """
+        registro = self.arquivos.get(nome)
+        return registro is not None and registro.get('release') != self.release
+    
+    def arquivo_verificado(self, nome: str, caminho: Path) -> bool:
+        """
+        Verificação rápida: o arquivo local é o mesmo que foi baixado e conferido?
+        
+        Compara apenas tamanho e data de modificação com o manifesto, sem
+        acessar a rede nem ler o conteúdo.
+        
+        Args:
+            nome: Nome do arquivo
+            caminho: Caminho local do arquivo
+        
+        Returns:
+            True se o arquivo pode ser usado sem novo download
+        """
+        registro = self._registro(nome)
+        if not registro or not registro.get('verificado_em') or not caminho.exists():
+            return False
+        
+        stat = caminho.stat()
+        return (stat.st_size == registro.get('tamanho_esperado')
+                and stat.st_mtime == registro.get('mtime'))
+    
+    def tamanho_confere(self, nome: str, caminho: Path) -> bool:
+        """
+        Confere o tamanho local com o esperado (True se o manifesto não conhece o arquivo)
+        
+        Args:
+            nome: Nome do arquivo
+            caminho: Caminho local do arquivo
+        """
+        registro = self._registro(nome)
+        if not registro or registro.get('tamanho_esperado') is None:
+            return True
+        return caminho.exists() and caminho.stat().st_size == registro['tamanho_esperado']
+    
+    def registrar_download(self, nome: str, caminho: Path, tamanho_esperado: Optional[int]):
+        """
+        Registra um arquivo baixado e conferido contra o Content-Length
+        
+        Args:
+            nome: Nome do arquivo
+            caminho: Caminho local do arquivo
+            tamanho_esperado: Tamanho informado pelo servidor
+        """
+        stat = caminho.stat()
+        with self._lock:
+            registro = self.arquivos.setdefault(nome, {})
+            if (registro.get('release') != self.release or registro.get('tamanho_esperado') != tamanho_esperado
+                    or registro.get('mtime') != stat.st_mtime):
+                # Conteúdo novo: hash anterior não vale mais
+                registro.pop('sha256', None)
+                registro.pop('importado_em', None)
+            registro.update({
+                'release': self.release,
+                'tamanho_esperado': tamanho_esperado,
+                'tamanho_local': stat.st_size,
+                'mtime': stat.st_mtime,
+                'verificado_em': datetime.now().isoformat(timespec='seconds'),
+            })
+        self.salvar()
+    
+    def registrar_importacao(self, nome: str):
+        """
+        Registra a data da última importação bem-sucedida de um arquivo
+        
+        Args:
+            nome: Nome do arquivo
+        """
+        with self._lock:
+            registro = self.arquivos.setdefault(nome, {'release': self.release})
+            registro['importado_em'] = datetime.now().isoformat(timespec='seconds')
+        self.salvar()
+    
+    def invalidar(self, nome: str):
+        """Remove a marca de verificação de um arquivo (força novo download)"""
+        with self._lock:
+            if nome in self.arquivos:
+                self.arquivos[nome].pop('verificado_em', None)
+        self.salvar()
+    
+    def verificar(self, diretorio: Path, calcular_hash: bool = False,
+                  max_workers: int = 4) -> List[str]:
+        """
+        Verifica os arquivos do manifesto
+        
+        O tamanho é sempre conferido. Com calcular_hash, o SHA-256 é calculado
+        em paralelo: gravado na primeira vez e comparado nas seguintes.
+        
+        Args:
+            diretorio: Diretório dos arquivos
+            calcular_hash: Se True, calcula o SHA-256 de cada arquivo
+            max_workers: Threads usadas no cálculo dos hashes
+        
+        Returns:
+            Lista de arquivos com problema (já invalidados no manifesto)
+        """
+        problemas = []
+        para_hash = []
+        
+        for nome, registro in sorted(self.arquivos.items()):
+            if registro.get('release') != self.release:
+                continue
+            caminho = Path(diretorio) / nome
+            if not self.tamanho_confere(nome, caminho) or not caminho.exists():
+                logger.warning(f"  {nome}: ausente ou com tamanho diferente do esperado")
+                problemas.append(nome)
+            elif calcular_hash:
+                para_hash.append((nome, caminho))
+        
+        if para_hash:
+            logger.info(f"Calculando SHA-256 de {len(para_hash)} arquivos...")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                hashes = list(executor.map(lambda item: calcular_sha256(item[1]), para_hash))
+            
+            for (nome, caminho), sha256 in zip(para_hash, hashes):
+                registro = self.arquivos[nome]
+                if registro.get('sha256') and registro['sha256'] != sha256:
+                    logger.warning(f"  {nome}: SHA-256 diferente do registrado")
+                    problemas.append(nome)
+                else:
+                    with self._lock:
+                        registro['sha256'] = sha256
+        
+        for nome in problemas:
+            with self._lock:
+                self.arquivos[nome].pop('verificado_em', None)
+        
+        self.salvar()
+        return problemas
+
+
+def calcular_sha256(caminho: Path, bloco: int = 4 * 1024 * 1024) -> str:
+    """
+    Calcula o SHA-256 de um arquivo em blocos
+    
+    Args:
+        caminho: Caminho do arquivo
+        bloco: Tamanho de cada leitura
+    
+    Returns:
+        Hash em hexadecimal
+    """
+    sha256 = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for dados in iter(lambda: f.read(bloco), b''):
+            sha256.update(dados)
+    return sha256.hexdigest()
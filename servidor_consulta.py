@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Servidor HTTP local de consultas CNPJ (JSON)
+Expõe as consultas do CNPJQuery sem o custo de iniciar o Python e abrir o banco a cada consulta
+
+Rotas:
+    GET /cnpj/{cnpj}          empresa, estabelecimentos e sócios (8 ou 14 dígitos, com ou sem pontuação)
+    GET /busca?q=termo        busca por nome (índice textual ou razão social)
+    GET /uf/{uf}              estabelecimentos de uma UF
+    GET /metricas             histograma de latência e estatísticas dos caches
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from consultar_cnpj import CacheLRU, CNPJQuery
+
+logger = logging.getLogger(__name__)
+
+
+class HistogramaLatencia:
+    """Histograma de latência por rota, em faixas fixas de milissegundos"""
+    
+    FAIXAS_MS = [0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+    
+    def __init__(self):
+        self._rotas: Dict[str, Dict[str, Any]] = {}
+    
+    def registrar(self, rota: str, segundos: float):
+        """Registra a duração de uma requisição"""
+        dados = self._rotas.setdefault(rota, {
+            'contagens': [0] * (len(self.FAIXAS_MS) + 1), 'total': 0, 'soma_ms': 0.0, 'max_ms': 0.0
+        })
+        ms = segundos * 1000
+        indice = next((i for i, limite in enumerate(self.FAIXAS_MS) if ms <= limite), len(self.FAIXAS_MS))
+        dados['contagens'][indice] += 1
+        dados['total'] += 1
+        dados['soma_ms'] += ms
+        dados['max_ms'] = max(dados['max_ms'], ms)
+    
+    def _percentil(self, contagens: List[int], total: int, fracao: float) -> float:
+        """Limite superior da faixa que contém o percentil (estimativa pelo histograma)"""
+        alvo = fracao * total
+        acumulado = 0
+        for limite, contagem in zip(self.FAIXAS_MS, contagens):
+            acumulado += contagem
+            if acumulado >= alvo:
+                return limite
+        return float('inf')
+    
+    def resumo(self) -> Dict[str, Any]:
+        """Histograma, média e percentis aproximados de cada rota"""
+        resumo = {}
+        for rota, dados in sorted(self._rotas.items()):
+            faixas = [f"<={limite}ms" for limite in self.FAIXAS_MS] + [f">{self.FAIXAS_MS[-1]}ms"]
+            resumo[rota] = {
+                'requisicoes': dados['total'],
+                'media_ms': round(dados['soma_ms'] / dados['total'], 3),
+                'max_ms': round(dados['max_ms'], 3),
+                'p50_ms': self._percentil(dados['contagens'], dados['total'], 0.50),
+                'p95_ms': self._percentil(dados['contagens'], dados['total'], 0.95),
+                'p99_ms': self._percentil(dados['contagens'], dados['total'], 0.99),
+                'histograma': {faixa: n for faixa, n in zip(faixas, dados['contagens']) if n}
+            }
+        return resumo
+
+
+class ErroHTTP(Exception):
+    """Erro com status HTTP a devolver ao cliente"""
+    
+    def __init__(self, status: int, mensagem: str):
+        super().__init__(mensagem)
+        self.status = status
+
+
+class ServidorConsulta:
+    """Servidor HTTP assíncrono sobre o CNPJQuery"""
+    
+    MOTIVOS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               431: 'Request Header Fields Too Large', 500: 'Internal Server Error'}
+    
+    LIMITE_PADRAO = 20
+    LIMITE_MAXIMO = 1000
+    
+    def __init__(self, db_path: str = "./cnpj_dados.db", host: str = "127.0.0.1", porta: int = 8080,
+                 workers: int = 4, cache_tamanho: int = 10000, cache_ttl: float = 300.0):
+        """
+        Inicializa o servidor
+        
+        Args:
+            db_path: Caminho do banco SQLite
+            host: Endereço de escuta (padrão: apenas local)
+            porta: Porta TCP (0 = escolhida pelo sistema)
+            workers: Threads que executam as consultas (uma conexão do pool cada)
+            cache_tamanho: Respostas mantidas no cache LRU (0 = sem cache)
+            cache_ttl: Validade das respostas em cache, em segundos
+        """
+        self.host = host
+        self.porta = porta
+        self.workers = max(1, workers)
+        self.query = CNPJQuery(db_path, tamanho_pool=self.workers)
+        self.cache = CacheLRU(cache_tamanho, cache_ttl)
+        self.latencia = HistogramaLatencia()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='consulta')
+        self._servidor: Optional[asyncio.AbstractServer] = None
+    
+    async def iniciar(self):
+        """Abre a porta de escuta (self.porta recebe a porta efetiva)"""
+        self._servidor = await asyncio.start_server(self._atender, self.host, self.porta)
+        self.porta = self._servidor.sockets[0].getsockname()[1]
+        logger.info(f"Servidor de consultas em http://{self.host}:{self.porta} "
+                    f"({self.workers} workers, cache de {self.cache.capacidade} respostas)")
+    
+    async def executar(self):
+        """Inicia e atende requisições até ser interrompido"""
+        await self.iniciar()
+        try:
+            async with self._servidor:
+                await self._servidor.serve_forever()
+        finally:
+            self.fechar()
+    
+    async def parar(self):
+        """Para de aceitar conexões e libera os recursos"""
+        if self._servidor is not None:
+            self._servidor.close()
+            await self._servidor.wait_closed()
+        self.fechar()
+    
+    def fechar(self):
+        """Encerra as threads de consulta e o pool de conexões"""
+        self._executor.shutdown(wait=True)
+        self.query.fechar()
+    
+    async def _atender(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Atende as requisições de uma conexão (HTTP/1.1 com keep-alive)"""
+        try:
+            while True:
+                try:
+                    cabecalho = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break  # cliente fechou a conexão
+                except asyncio.LimitOverrunError:
+                    await self._responder(writer, 431, {'erro': 'Cabeçalho muito grande'}, manter=False)
+                    break
+                
+                inicio = time.perf_counter()
+                linhas = cabecalho.decode('latin-1').split('\r\n')
+                partes = linhas[0].split(' ')
+                cabecalhos = {}
+                for linha in linhas[1:]:
+                    nome, _, valor = linha.partition(':')
+                    if nome:
+                        cabecalhos[nome.strip().lower()] = valor.strip()
+                
+                if len(partes) != 3:
+                    await self._responder(writer, 400, {'erro': 'Requisição inválida'}, manter=False)
+                    break
+                metodo, alvo, versao = partes
+                
+                conexao = cabecalhos.get('connection', '').lower()
+                manter = conexao != 'close' and (versao == 'HTTP/1.1' or conexao == 'keep-alive')
+                
+                rota, status, corpo = await self._processar(metodo, alvo)
+                await self._responder(writer, status, corpo, manter)
+                self.latencia.registrar(rota, time.perf_counter() - inicio)
+                
+                if not manter:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    
+    async def _processar(self, metodo: str, alvo: str) -> Tuple[str, int, bytes]:
+        """
+        Encaminha uma requisição para a rota
+        
+        Returns:
+            (rota para o histograma, status HTTP, corpo JSON)
+        """
+        url = urlsplit(alvo)
+        segmentos = [unquote(s) for s in url.path.split('/') if s]
+        rota = f"/{segmentos[0]}" if segmentos else '/'
+        
+        try:
+            if metodo != 'GET':
+                raise ErroHTTP(405, 'Apenas GET é suportado')
+            
+            if rota == '/metricas' and len(segmentos) == 1:
+                return rota, 200, self._json({'latencia': self.latencia.resumo(), 'cache': self.cache.resumo(),
+                                              'cache_cnpj': self.query.estatisticas_cache()})
+            
+            if rota not in ('/cnpj', '/busca', '/uf'):
+                rota = 'outras'  # uma única entrada no histograma para caminhos desconhecidos
+                raise ErroHTTP(404, 'Rota não encontrada')
+            
+            # A geração dos dados entra na chave: depois de uma nova importação as
+            # respostas anteriores deixam de ser servidas, sem esperar o TTL
+            loop = asyncio.get_running_loop()
+            geracao = None
+            if self.cache.capacidade > 0:
+                geracao = await loop.run_in_executor(self._executor, self.query.geracao_atual)
+            chave = (geracao, url.path + ('?' + url.query if url.query else ''))
+            corpo = self.cache.obter(chave)
+            if corpo is None:
+                parametros = parse_qs(url.query)
+                resultado = await loop.run_in_executor(self._executor, self._consultar,
+                                                       rota, segmentos[1:], parametros)
+                corpo = self._json(resultado)
+                self.cache.guardar(chave, corpo)
+            return rota, 200, corpo
+        
+        except ErroHTTP as e:
+            return rota, e.status, self._json({'erro': str(e)})
+        except Exception as e:
+            logger.error(f"Erro em {metodo} {alvo}: {e}")
+            return rota, 500, self._json({'erro': 'Erro interno'})
+    
+    def _limite(self, parametros: Dict[str, List[str]]) -> int:
+        """Lê o parâmetro ?limite= (padrão LIMITE_PADRAO, no máximo LIMITE_MAXIMO)"""
+        valor = parametros.get('limite', [str(self.LIMITE_PADRAO)])[0]
+        if not valor.isdigit() or int(valor) < 1:
+            raise ErroHTTP(400, 'limite deve ser um inteiro positivo')
+        return min(int(valor), self.LIMITE_MAXIMO)
+    
+    def _consultar(self, rota: str, argumentos: List[str], parametros: Dict[str, List[str]]) -> Any:
+        """Executa a consulta de uma rota (em uma thread do executor)"""
+        if rota == '/cnpj':
+            if not argumentos:
+                raise ErroHTTP(404, 'Use /cnpj/{cnpj}')
+            # A barra do CNPJ formatado (00.000.000/0001-00) chega como outro segmento
+            chave = CNPJQuery.normalizar_cnpj('/'.join(argumentos))
+            if chave is None:
+                raise ErroHTTP(400, 'CNPJ inválido')
+            
+            cnpj_basico, cnpj_ordem, cnpj_dv = chave
+            empresa = self.query.buscar_empresa_por_cnpj(cnpj_basico)
+            if empresa is None:
+                raise ErroHTTP(404, 'CNPJ não encontrado')
+            
+            estabelecimentos = self.query.buscar_estabelecimentos_por_cnpj(cnpj_basico)
+            if cnpj_ordem is not None:
+                estabelecimentos = [e for e in estabelecimentos
+                                    if (e['cnpj_ordem'], e['cnpj_dv']) == (cnpj_ordem, cnpj_dv)]
+                if not estabelecimentos:
+                    raise ErroHTTP(404, 'Estabelecimento não encontrado')
+            
+            return {
+                'empresa': empresa,
+                'estabelecimentos': estabelecimentos,
+                'socios': self.query.buscar_socios_por_cnpj(cnpj_basico)
+            }
+        
+        if rota == '/busca':
+            termo = parametros.get('q', [''])[0].strip()
+            if argumentos or not termo:
+                raise ErroHTTP(400, 'Use /busca?q=termo')
+            limite = self._limite(parametros)
+            resultados = self.query.buscar_texto(termo, limite)
+            if resultados is None:
+                resultados = self.query.buscar_por_razao_social(termo, limite)
+            return {'termo': termo, 'resultados': resultados}
+        
+        if len(argumentos) != 1 or len(argumentos[0]) != 2:
+            raise ErroHTTP(404, 'Use /uf/{uf}')
+        uf = argumentos[0].upper()
+        return {'uf': uf, 'estabelecimentos': self.query.buscar_por_uf(uf, self._limite(parametros))}
+    
+    @staticmethod
+    def _json(dados: Any) -> bytes:
+        return json.dumps(dados, ensure_ascii=False).encode('utf-8')
+    
+    async def _responder(self, writer: asyncio.StreamWriter, status: int, corpo, manter: bool):
+        """Envia a resposta JSON"""
+        if isinstance(corpo, dict):
+            corpo = self._json(corpo)
+        cabecalho = (
+            f"HTTP/1.1 {status} {self.MOTIVOS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(corpo)}\r\n"
+            f"Connection: {'keep-alive' if manter else 'close'}\r\n\r\n"
+        )
+        writer.write(cabecalho.encode('latin-1') + corpo)
+        await writer.drain()
+
+
+def main():
+    """Função principal"""
+    import argparse
+    
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    
+    parser = argparse.ArgumentParser(description='Servidor HTTP local de consultas CNPJ')
+    parser.add_argument('--db', default='./cnpj_dados.db', help='Caminho do banco SQLite')
+    parser.add_argument('--host', default='127.0.0.1', help='Endereço de escuta (padrão: apenas local)')
+    parser.add_argument('--porta', type=int, default=8080, help='Porta TCP (padrão: 8080)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Consultas simultâneas, cada uma com sua conexão (padrão: 4)')
+    parser.add_argument('--cache', type=int, default=10000,
+                        help='Respostas mantidas no cache LRU (0 = sem cache; padrão: 10000)')
+    parser.add_argument('--ttl', type=float, default=300,
+                        help='Validade das respostas em cache, em segundos (padrão: 300)')
+    
+    args = parser.parse_args()
+    
+    try:
+        servidor = ServidorConsulta(args.db, args.host, args.porta, args.workers, args.cache, args.ttl)
+    except FileNotFoundError:
+        print(f"Banco de dados não encontrado: {args.db}")
+        print("Execute primeiro o downloader_cnpj.py para baixar os dados")
+        return
+    
+    try:
+        asyncio.run(servidor.executar())
+    except KeyboardInterrupt:
+        print("\n✅ Servidor encerrado")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Tabelas derivadas construídas depois da importação
+Pré-agregações usadas pela exportação de CSVs e pelas consultas
+"""
+
+import logging
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def construir_socios_resumo(conn: sqlite3.Connection):
+    """
+    Cria a tabela socios_resumo: total de sócios e CNPJs dos sócios pessoa jurídica
+    
+    Uma linha por cnpj_basico, calculada uma única vez por importação em vez
+    de duas subconsultas correlacionadas por linha exportada. Em socios_cnpj
+    entram apenas documentos com 14 dígitos (CNPJ), nunca CPFs.
+    
+    Args:
+        conn: Conexão com o banco (o commit fica com o chamador)
+    """
+    conn.execute("DROP TABLE IF EXISTS socios_resumo")
+    conn.execute('''
+        CREATE TABLE socios_resumo (
+            cnpj_basico TEXT PRIMARY KEY,
+            total_socios INTEGER,
+            socios_cnpj TEXT
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO socios_resumo (cnpj_basico, total_socios, socios_cnpj)
+        SELECT cnpj_basico,
+               COUNT(*),
+               GROUP_CONCAT(CASE WHEN length(cpf_cnpj_socio) = 14
+                                  AND cpf_cnpj_socio NOT GLOB '*[^0-9]*'
+                                 THEN cpf_cnpj_socio END, ', ')
+        FROM (SELECT cnpj_basico, cpf_cnpj_socio FROM socios ORDER BY cnpj_basico, cpf_cnpj_socio)
+        GROUP BY cnpj_basico
+    ''')
+
+
+def construir_cnae_secundario(conn: sqlite3.Connection):
+    """
+    Cria a tabela estabelecimento_cnae_secundario: um CNAE secundário por linha
+    
+    Separa a lista "cnae1,cnae2,..." de estabelecimentos.cnae_fiscal_secundaria
+    (com a posição original), permitindo juntar com cnaes e filtrar por CNAE
+    com índice.
+    
+    Args:
+        conn: Conexão com o banco (o commit fica com o chamador)
+    """
+    conn.execute("DROP TABLE IF EXISTS estabelecimento_cnae_secundario")
+    conn.execute('''
+        CREATE TABLE estabelecimento_cnae_secundario (
+            cnpj_basico TEXT,
+            cnpj_ordem TEXT,
+            cnpj_dv TEXT,
+            posicao INTEGER,
+            cnae TEXT,
+            PRIMARY KEY (cnpj_basico, cnpj_ordem, cnpj_dv, posicao)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO estabelecimento_cnae_secundario (cnpj_basico, cnpj_ordem, cnpj_dv, posicao, cnae)
+        WITH RECURSIVE partes (cnpj_basico, cnpj_ordem, cnpj_dv, posicao, cnae, resto) AS (
+            SELECT cnpj_basico, cnpj_ordem, cnpj_dv, 0, NULL, cnae_fiscal_secundaria || ','
+            FROM estabelecimentos
+            WHERE cnae_fiscal_secundaria IS NOT NULL AND cnae_fiscal_secundaria != ''
+            UNION ALL
+            SELECT cnpj_basico, cnpj_ordem, cnpj_dv, posicao + 1,
+                   trim(substr(resto, 1, instr(resto, ',') - 1)),
+                   substr(resto, instr(resto, ',') + 1)
+            FROM partes
+            WHERE resto != ''
+        )
+        SELECT cnpj_basico, cnpj_ordem, cnpj_dv, posicao, cnae
+        FROM partes
+        WHERE posicao > 0 AND cnae != ''
+    ''')
+    conn.execute("CREATE INDEX idx_cnae_secundario_cnae ON estabelecimento_cnae_secundario(cnae)")
+
+
+# Tabelas com total de registros em estatisticas (dimensão 'tabela')
+TABELAS_CONTADAS = ['empresas', 'estabelecimentos', 'socios', 'simples',
+                    'cnaes', 'municipios', 'naturezas', 'paises', 'qualificacoes', 'motivos']
+
+
+def construir_estatisticas(conn: sqlite3.Connection):
+    """
+    Cria a tabela estatisticas: contagens pré-calculadas (dimensao, chave, total)
+    
+    Dimensões: 'tabela' (registros por tabela), 'uf' e 'uf_ativos'
+    (estabelecimentos por UF, todos e só os ativos), 'situacao_cadastral'
+    (estabelecimentos) e 'porte_empresa' (empresas). Os estabelecimentos são
+    lidos uma única vez para as três dimensões deles.
+    
+    Args:
+        conn: Conexão com o banco (o commit fica com o chamador)
+    """
+    conn.execute("DROP TABLE IF EXISTS estatisticas")
+    conn.execute('''
+        CREATE TABLE estatisticas (
+            dimensao TEXT,
+            chave TEXT,
+            total INTEGER,
+            PRIMARY KEY (dimensao, chave)
+        ) WITHOUT ROWID
+    ''')
+    
+    for tabela in TABELAS_CONTADAS:
+        if tabela_existe(conn, tabela):
+            conn.execute(f"INSERT INTO estatisticas SELECT 'tabela', ?, COUNT(*) FROM {tabela}", (tabela,))
+    
+    conn.execute("DROP TABLE IF EXISTS temp.contagem_uf_situacao")
+    conn.execute('''
+        CREATE TEMP TABLE contagem_uf_situacao AS
+        SELECT uf, situacao_cadastral, COUNT(*) AS total
+        FROM estabelecimentos
+        GROUP BY uf, situacao_cadastral
+    ''')
+    conn.execute('''
+        INSERT INTO estatisticas
+        SELECT 'uf', uf, SUM(total) FROM contagem_uf_situacao
+        WHERE uf IS NOT NULL AND uf != '' GROUP BY uf
+    ''')
+    conn.execute('''
+        INSERT INTO estatisticas
+        SELECT 'uf_ativos', uf, SUM(total) FROM contagem_uf_situacao
+        WHERE uf IS NOT NULL AND uf != '' AND situacao_cadastral = '02' GROUP BY uf
+    ''')
+    conn.execute('''
+        INSERT INTO estatisticas
+        SELECT 'situacao_cadastral', situacao_cadastral, SUM(total) FROM contagem_uf_situacao
+        WHERE situacao_cadastral IS NOT NULL GROUP BY situacao_cadastral
+    ''')
+    conn.execute("DROP TABLE temp.contagem_uf_situacao")
+    
+    conn.execute('''
+        INSERT INTO estatisticas
+        SELECT 'porte_empresa', porte_empresa, COUNT(*) FROM empresas
+        WHERE porte_empresa IS NOT NULL GROUP BY porte_empresa
+    ''')
+
+
+def construir_ordem_exportacao(conn: sqlite3.Connection):
+    """
+    Cria a tabela ordem_exportacao: chave de ordenação dos estabelecimentos ativos
+    
+    A chave primária (uf, razao_social, cnpj_ordem, cnpj_basico, cnpj_dv) é a
+    ordem dos CSVs por estado. A exportação percorre a tabela em páginas a
+    partir da última chave gravada (keyset), sem ordenar o estado inteiro e
+    podendo retomar uma geração interrompida. Razão social nula vira texto
+    vazio para que a chave possa ser comparada. O índice (uf, CNPJ) serve a
+    exportação de um único estado na ordem de CNPJ.
+    
+    Args:
+        conn: Conexão com o banco (o commit fica com o chamador)
+    """
+    conn.execute("DROP TABLE IF EXISTS ordem_exportacao")
+    conn.execute('''
+        CREATE TABLE ordem_exportacao (
+            uf TEXT,
+            razao_social TEXT,
+            cnpj_ordem TEXT,
+            cnpj_basico TEXT,
+            cnpj_dv TEXT,
+            PRIMARY KEY (uf, razao_social, cnpj_ordem, cnpj_basico, cnpj_dv)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT INTO ordem_exportacao (uf, razao_social, cnpj_ordem, cnpj_basico, cnpj_dv)
+        SELECT e.uf, COALESCE(emp.razao_social, ''), e.cnpj_ordem, e.cnpj_basico, e.cnpj_dv
+        FROM estabelecimentos e
+        JOIN empresas emp ON e.cnpj_basico = emp.cnpj_basico
+        WHERE e.situacao_cadastral = '02' AND e.uf IS NOT NULL AND e.uf != ''
+          AND e.cnpj_ordem IS NOT NULL AND e.cnpj_dv IS NOT NULL
+        ORDER BY 1, 2, 3, 4, 5
+    ''')
+    conn.execute("CREATE INDEX idx_ordem_exportacao_cnpj ON ordem_exportacao(uf, cnpj_basico, cnpj_ordem, cnpj_dv)")
+
+
+def fts5_disponivel(conn: sqlite3.Connection) -> bool:
+    """Verifica se o SQLite foi compilado com FTS5"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.teste_fts5 USING fts5(texto)")
+        conn.execute("DROP TABLE temp.teste_fts5")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def construir_busca_textual(conn: sqlite3.Connection):
+    """
+    Cria o índice de texto completo busca_empresas (FTS5)
+    
+    Uma linha por empresa com a razão social e os nomes fantasia dos seus
+    estabelecimentos. O tokenizador unicode61 ignora acentos e maiúsculas
+    ("sao joao" encontra "SÃO JOÃO") e os índices de prefixo aceleram buscas
+    por início de palavra ("petro*"). Sem FTS5 no SQLite a etapa é pulada e
+    as consultas continuam com LIKE.
+    
+    Args:
+        conn: Conexão com o banco (o commit fica com o chamador)
+    """
+    conn.execute("DROP TABLE IF EXISTS busca_empresas")
+    if not fts5_disponivel(conn):
+        logger.warning("SQLite sem FTS5: índice de busca textual não será criado")
+        return
+    
+    conn.execute('''
+        CREATE VIRTUAL TABLE busca_empresas USING fts5(
+            cnpj_basico UNINDEXED,
+            razao_social,
+            nome_fantasia,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO busca_empresas (cnpj_basico, razao_social, nome_fantasia)
+        SELECT emp.cnpj_basico, emp.razao_social,
+               (SELECT GROUP_CONCAT(DISTINCT e.nome_fantasia) FROM estabelecimentos e
+                WHERE e.cnpj_basico = emp.cnpj_basico AND e.nome_fantasia != '')
+        FROM empresas emp
+    ''')
+    # Relevância padrão (ORDER BY rank): razão social pesa o dobro do nome fantasia
+    conn.execute("INSERT INTO busca_empresas (busca_empresas, rank) VALUES ('rank', 'bm25(0.0, 2.0, 1.0)')")
+    conn.execute("INSERT INTO busca_empresas (busca_empresas) VALUES ('optimize')")
+
+
+# Etapas na ordem de execução: (tabela criada, função)
+ETAPAS = [
+    ('socios_resumo', construir_socios_resumo),
+    ('estabelecimento_cnae_secundario', construir_cnae_secundario),
+    ('estatisticas', construir_estatisticas),
+    ('ordem_exportacao', construir_ordem_exportacao),
+    ('busca_empresas', construir_busca_textual),
+]
+
+
+def tabela_existe(conn: sqlite3.Connection, tabela: str) -> bool:
+    """Verifica se uma tabela existe no banco"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,)
+    ).fetchone() is not None
+
+
+def descartar_tabelas_derivadas(conn: sqlite3.Connection):
+    """
+    Remove as tabelas derivadas, que deixam de valer quando os dados mudam
+    
+    Chamado uma vez ao final de cada importação que alterou as tabelas
+    definitivas (e dentro da transação de um delta incremental); as tabelas
+    são refeitas em seguida (ou pela exportação, se estiverem ausentes).
+    
+    Args:
+        conn: Conexão com o banco (o commit fica com o chamador)
+    """
+    for tabela, _ in ETAPAS:
+        conn.execute(f"DROP TABLE IF EXISTS {tabela}")
+
+
+def construir_tabelas_derivadas(conn: sqlite3.Connection, apenas_ausentes: bool = False,
+                                tabelas: Optional[List[str]] = None) -> Dict[str, float]:
+    """
+    Executa as etapas de pós-importação
+    
+    Args:
+        conn: Conexão com o banco
+        apenas_ausentes: Se True, constrói só as tabelas que ainda não existem
+        tabelas: Se informado, executa só as etapas destas tabelas
+    
+    Returns:
+        Dicionário tabela -> segundos gastos
+    """
+    tempos = {}
+    
+    for tabela, construir in ETAPAS:
+        if tabelas is not None and tabela not in tabelas:
+            continue
+        if apenas_ausentes and tabela_existe(conn, tabela):
+            continue
+        
+        logger.info(f"Construindo tabela derivada {tabela}...")
+        inicio = time.time()
+        construir(conn)
+        conn.commit()
+        tempos[tabela] = time.time() - inicio
+        logger.info(f"  {tabela}: {tempos[tabela]:.2f}s")
+    
+    return tempos
+
+
+def ler_estatisticas(conn: sqlite3.Connection, dimensao: str) -> Optional[Dict[str, int]]:
+    """
+    Lê uma dimensão da tabela estatisticas
+    
+    A tabela só é refeita ao final da importação (_finalize_import). Enquanto
+    houver uma importação pendente ela descreve a carga anterior e é ignorada.
+    
+    Args:
+        conn: Conexão com o banco
+        dimensao: 'tabela', 'uf', 'uf_ativos', 'situacao_cadastral' ou 'porte_empresa'
+    
+    Returns:
+        Dicionário chave -> total, ou None se as estatísticas não existem ou
+        estão desatualizadas (o chamador deve contar direto nas tabelas)
+    """
+    if not tabela_existe(conn, 'estatisticas'):
+        return None
+    if tabela_existe(conn, 'metadados') and conn.execute(
+            "SELECT 1 FROM metadados WHERE chave = 'importacao_pendente'").fetchone() is not None:
+        return None
+    return dict(conn.execute("SELECT chave, total FROM estatisticas WHERE dimensao = ?", (dimensao,)))
+
+
+def contar_registros(conn: sqlite3.Connection, tabela: str) -> int:
+    """
+    Total de registros de uma tabela, pelas estatísticas ou com COUNT(*)
+    
+    Args:
+        conn: Conexão com o banco
+        tabela: Nome da tabela
+    
+    Returns:
+        Número de registros
+    """
+    totais = ler_estatisticas(conn, 'tabela')
+    if totais is not None and tabela in totais:
+        return totais[tabela]
+    return conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
@@ -7,8 +7,1317 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from downloader_cnpj import CNPJDownloader
+from downloader_cnpj import CNPJDownloader, parse_release_index, _sqlite_writer_loop
+from downloader_async import AsyncCNPJDownloader, LimitadorBanda, aiohttp
+from gerar_csv_estados import GeradorCSVEstados, _EscritorRotativo, zstandard
+from consultar_cnpj import CNPJQuery, escrever_lote
+from servidor_consulta import ServidorConsulta
+from atualizacao_incremental import registrar_geracao
+from tabelas_derivadas import TABELAS_CONTADAS, construir_tabelas_derivadas, fts5_disponivel, ler_estatisticas
+import asyncio
+import csv
+import gzip
+import http.client
+import io
+import json
+import queue
+import re
+import sqlite3
 import time
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class ServidorArquivosLocal(BaseHTTPRequestHandler):
+    """Servidor HTTP local que imita a listagem da Receita, com suporte a Range"""
+    
+    arquivos = {}          # nome -> bytes
+    requisicoes = []       # (método, caminho, cabeçalho Range)
+    cortar_apos = None     # encerra a próxima resposta após N bytes (simula queda)
+    paginas = {}           # caminho -> HTML fixo (ex: listagem de releases)
+    falhar = set()         # arquivos listados que respondem 404
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_HEAD(self):
+        self._responder(enviar_corpo=False)
+    
+    def do_GET(self):
+        self._responder(enviar_corpo=True)
+    
+    def _responder(self, enviar_corpo):
+        self.requisicoes.append((self.command, self.path, self.headers.get('Range')))
+        nome = self.path.lstrip('/')
+        
+        if self.path in self.paginas:
+            corpo = self.paginas[self.path]
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            if enviar_corpo:
+                self.wfile.write(corpo)
+            return
+        
+        if nome == '':
+            linhas = ''.join(
+                f'<tr><td><a href="{n}">{n}</a></td><td>2025-06-15 10:00</td><td>{len(d)}</td></tr>'
+                for n, d in self.arquivos.items()
+            )
+            corpo = f'<html><body><table>{linhas}</table></body></html>'.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(corpo)))
+            self.end_headers()
+            if enviar_corpo:
+                self.wfile.write(corpo)
+            return
+        
+        if nome not in self.arquivos or nome in self.falhar:
+            self.send_error(404)
+            return
+        
+        dados = self.arquivos[nome]
+        inicio, fim = 0, len(dados) - 1
+        intervalo = self.headers.get('Range')
+        if intervalo:
+            a, b = intervalo.replace('bytes=', '').split('-')
+            inicio = int(a)
+            fim = int(b) if b else len(dados) - 1
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {inicio}-{fim}/{len(dados)}')
+        else:
+            self.send_response(200)
+        
+        parte = dados[inicio:fim + 1]
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(parte)))
+        self.end_headers()
+        
+        if enviar_corpo:
+            cortar = ServidorArquivosLocal.cortar_apos
+            if cortar is not None:
+                ServidorArquivosLocal.cortar_apos = None
+                self.wfile.write(parte[:cortar])
+                self.close_connection = True
+                return
+            self.wfile.write(parte)
+
+
+def criar_zip(membro, linhas):
+    """Cria em memória um ZIP com um CSV no formato da Receita (';', aspas, latin-1)"""
+    conteudo = ''.join(';'.join(f'"{valor}"' for valor in linha) + '\n' for linha in linhas)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr(membro, conteudo.encode('latin-1'))
+    return buffer.getvalue()
+
+
+def linha_estabelecimento(cnpj_basico, cnpj_ordem, cnpj_dv, uf, nome_fantasia='', situacao='02'):
+    """Linha de estabelecimento com as 30 colunas do layout da Receita"""
+    linha = [''] * 30
+    linha[0:6] = [cnpj_basico, cnpj_ordem, cnpj_dv, '1', nome_fantasia, situacao]
+    linha[19] = uf
+    return linha
+
+
+def arquivos_release(empresas, estabelecimentos, socios):
+    """
+    ZIPs de uma release pequena, no formato servido por ServidorArquivosLocal
+    
+    Args:
+        empresas: Linhas (cnpj_basico, razao_social)
+        estabelecimentos: Linhas completas (ver linha_estabelecimento)
+        socios: Linhas (cnpj_basico, nome_socio)
+    """
+    return {
+        'Cnaes.zip': criar_zip('F.K03200$Z.D50614.CNAECSV', [('6201501', 'Desenvolvimento de software')]),
+        'Municipios.zip': criar_zip('F.K03200$Z.D50614.MUNICCSV', [('7107', 'SAO PAULO'), ('6001', 'RIO DE JANEIRO')]),
+        'Empresas0.zip': criar_zip('K3241.K03200Y0.D50614.EMPRECSV',
+                                   [(c, r, '2062', '49', '1000,00', '03', '') for c, r in empresas]),
+        'Estabelecimentos0.zip': criar_zip('K3241.K03200Y0.D50614.ESTABELE', estabelecimentos),
+        'Socios0.zip': criar_zip('K3241.K03200Y0.D50614.SOCIOCSV',
+                                 [(c, '2', n, '', '49', '20200101', '', '', '', '00', '5') for c, n in socios]),
+    }
+
+
+def contar_registros(db_path):
+    """Quantidade de registros de cada tabela importada"""
+    conn = sqlite3.connect(db_path)
+    contagem = {tabela: conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+                for tabela in ('cnaes', 'municipios', 'empresas', 'estabelecimentos', 'socios')}
+    conn.close()
+    return contagem
+
+
+def criar_banco_exportacao(temp_dir):
+    """
+    Banco pequeno para os testes de exportação, com a geração já registrada
+    
+    Treze empresas em SP (7, uma delas com filial), RJ (4) e MG (2), com as
+    razões sociais em ordem inversa à dos CNPJs; cada UF tem também um
+    estabelecimento baixado, que não entra na exportação.
+    
+    Returns:
+        Caminho do banco
+    """
+    db_path = os.path.join(temp_dir, 'exportacao.db')
+    CNPJDownloader(base_url='http://127.0.0.1/', download_dir=os.path.join(temp_dir, 'dados'),
+                   db_path=db_path)
+    
+    ufs = ['SP'] * 7 + ['RJ'] * 4 + ['MG'] * 2
+    empresas = [(f'{i + 1:08d}', f'EMPRESA {chr(ord("Z") - i)}', '01' if i % 2 else '03')
+                for i in range(len(ufs))]
+    estabelecimentos = [(cnpj, '0001', '00', uf, '02') for (cnpj, _, _), uf in zip(empresas, ufs)]
+    estabelecimentos.append(('00000001', '0002', '00', 'SP', '02'))
+    estabelecimentos += [(cnpj, '0009', '00', uf, '08')
+                         for cnpj, uf in (('00000001', 'SP'), ('00000008', 'RJ'), ('00000012', 'MG'))]
+    
+    conn = sqlite3.connect(db_path)
+    conn.executemany("INSERT INTO empresas (cnpj_basico, razao_social, porte_empresa) VALUES (?, ?, ?)",
+                     empresas)
+    conn.executemany("INSERT INTO estabelecimentos (cnpj_basico, cnpj_ordem, cnpj_dv, uf, situacao_cadastral) "
+                     "VALUES (?, ?, ?, ?, ?)", estabelecimentos)
+    conn.executemany("INSERT INTO socios (cnpj_basico, nome_socio) VALUES (?, ?)",
+                     [(cnpj, f'SOCIO {cnpj}') for cnpj, _, _ in empresas])
+    registrar_geracao(conn)
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def arquivos_estado(diretorio, prefixo):
+    """Arquivos exportados de um estado (UF.csv ou UF_001.csv, UF_002.csv...), em ordem"""
+    return sorted(str(arquivo) for arquivo in Path(diretorio).iterdir()
+                  if re.fullmatch(rf'{prefixo}(_\d{{3}})?\.csv(\.gz|\.zst)?', arquivo.name))
+
+
+def ler_csvs(arquivos):
+    """Linhas (dicionários) de uma sequência de CSVs exportados, comprimidos ou não"""
+    linhas = []
+    for arquivo in arquivos:
+        with open(arquivo, 'rb') as f:
+            dados = f.read()
+        if arquivo.endswith('.gz'):
+            dados = gzip.decompress(dados)
+        elif arquivo.endswith('.zst'):
+            dados = zstandard.ZstdDecompressor().decompressobj().decompress(dados)
+        linhas.extend(csv.DictReader(io.StringIO(dados.decode('utf-8'), newline='')))
+    return linhas
+
+
+def estabelecimentos_ativos(db_path, uf, ordem='razao'):
+    """CNPJs completos dos estabelecimentos ativos de uma UF, na ordem da exportação"""
+    ordenacao = ("emp.razao_social, e.cnpj_ordem, e.cnpj_basico, e.cnpj_dv" if ordem == 'razao'
+                 else "e.cnpj_basico, e.cnpj_ordem, e.cnpj_dv")
+    conn = sqlite3.connect(db_path)
+    cnpjs = [cnpj for cnpj, in conn.execute(f"""
+        SELECT e.cnpj_basico || e.cnpj_ordem || e.cnpj_dv
+        FROM estabelecimentos e JOIN empresas emp ON e.cnpj_basico = emp.cnpj_basico
+        WHERE e.uf = ? AND e.situacao_cadastral = '02'
+        ORDER BY {ordenacao}
+    """, (uf,))]
+    conn.close()
+    return cnpjs
+
+
+def divergencias_estatisticas(conn):
+    """Dimensões da tabela estatisticas que não batem com COUNT(*) nas tabelas"""
+    contagens = {
+        'tabela': {tabela: conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+                   for tabela in TABELAS_CONTADAS},
+        'uf': dict(conn.execute("SELECT uf, COUNT(*) FROM estabelecimentos WHERE uf != '' GROUP BY uf")),
+        'uf_ativos': dict(conn.execute("SELECT uf, COUNT(*) FROM estabelecimentos "
+                                       "WHERE uf != '' AND situacao_cadastral = '02' GROUP BY uf")),
+        'situacao_cadastral': dict(conn.execute("SELECT situacao_cadastral, COUNT(*) FROM estabelecimentos "
+                                                "WHERE situacao_cadastral IS NOT NULL GROUP BY 1")),
+        'porte_empresa': dict(conn.execute("SELECT porte_empresa, COUNT(*) FROM empresas "
+                                           "WHERE porte_empresa IS NOT NULL GROUP BY 1")),
+    }
+    return [dimensao for dimensao, contagem in contagens.items() if ler_estatisticas(conn, dimensao) != contagem]
+
+
+def teste_download_local():
+    """Testa download retomável e segmentado contra um servidor HTTP local"""
+    print("=== TESTE DE DOWNLOAD COM SERVIDOR LOCAL ===\n")
+    
+    dados = os.urandom(3 * 1024 * 1024 + 123)
+    ServidorArquivosLocal.arquivos = {'Estabelecimentos9.zip': dados}
+    
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), ServidorArquivosLocal)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{servidor.server_address[1]}/"
+    
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            def novo_downloader(segmentos=1):
+                return CNPJDownloader(
+                    base_url=base_url,
+                    download_dir=os.path.join(temp_dir, 'dados'),
+                    db_path=os.path.join(temp_dir, 'teste.db'),
+                    segmentos=segmentos
+                )
+            
+            downloader = novo_downloader()
+            destino = Path(downloader.download_dir) / 'Estabelecimentos9.zip'
+            
+            files = downloader.get_file_list()
+            assert len(files) == 1, f"Listagem local retornou {len(files)} arquivos"
+            print("✓ Listagem lida do servidor local")
+            
+            # 1. Queda no meio do download: o .part deve ser mantido e retomado
+            ServidorArquivosLocal.cortar_apos = 1024 * 1024
+            assert not downloader.download_file(dict(files[0])), (
+                "Download interrompido foi considerado completo")
+            parcial = Path(str(destino) + '.part')
+            assert parcial.exists(), "Arquivo parcial não foi preservado após a queda"
+            assert parcial.stat().st_size == 1024 * 1024, "Arquivo parcial não foi preservado após a queda"
+            
+            ServidorArquivosLocal.requisicoes.clear()
+            assert downloader.download_file(dict(files[0])), "Retomada do download falhou"
+            assert destino.read_bytes() == dados, "Retomada do download falhou"
+            assert any(r[2] and r[2].startswith(f'bytes={1024 * 1024}-')
+                       for r in ServidorArquivosLocal.requisicoes), "Retomada não usou requisição Range"
+            print("✓ Download retomado com Range após queda de conexão")
+            
+            # 2. Arquivo truncado deixado por versão antiga não é mais aceito
+            destino.write_bytes(dados[:500000])
+            assert downloader.download_file(dict(files[0])), "Arquivo truncado não foi completado"
+            assert destino.read_bytes() == dados, "Arquivo truncado não foi completado"
+            print("✓ Arquivo truncado detectado pelo Content-Length e completado")
+            
+            # 3. Download segmentado em intervalos paralelos
+            destino.unlink()
+            downloader = novo_downloader(segmentos=4)
+            downloader.SEGMENTO_MINIMO = 256 * 1024
+            ServidorArquivosLocal.requisicoes.clear()
+            assert downloader.download_file(dict(files[0])), "Download segmentado falhou"
+            assert destino.read_bytes() == dados, "Download segmentado falhou"
+            intervalos = [r for r in ServidorArquivosLocal.requisicoes if r[0] == 'GET' and r[2]]
+            assert len(intervalos) == 4, f"Esperados 4 segmentos, servidor recebeu {len(intervalos)}"
+            print("✓ Download segmentado em 4 partes e unido corretamente")
+            
+            # Segmentos de uma divisão em 4 partes não são retomados numa divisão em 2
+            destino.unlink()
+            ServidorArquivosLocal.cortar_apos = 100 * 1024
+            assert not downloader.download_file(dict(files[0])), "Download segmentado interrompido foi aceito"
+            assert Path(str(destino) + '.part.1').exists(), "Segmentos interrompidos não foram preservados"
+            downloader = novo_downloader(segmentos=2)
+            downloader.SEGMENTO_MINIMO = 256 * 1024
+            assert downloader.download_file(dict(files[0])), "Download em 2 segmentos falhou"
+            assert destino.read_bytes() == dados, "Segmentos de outra divisão corromperam o arquivo"
+            restos = sorted(p.name for p in destino.parent.glob(destino.name + '.*'))
+            assert not restos, f"Arquivos parciais restantes: {restos}"
+            print("✓ Segmentos de outra divisão descartados antes da retomada")
+            
+            # 4. Nova release no mesmo diretório: mesmo nome e tamanho, conteúdo diferente
+            novos_dados = os.urandom(len(dados))
+            ServidorArquivosLocal.arquivos = {'Estabelecimentos9.zip': novos_dados}
+            downloader = CNPJDownloader(base_url=base_url, download_dir=os.path.join(temp_dir, 'dados'),
+                                        db_path=os.path.join(temp_dir, 'teste.db'), release='2025-07')
+            assert not downloader.manifesto.arquivo_verificado('Estabelecimentos9.zip', destino), (
+                "Manifesto da release anterior aceito na nova release")
+            assert downloader.download_file(dict(files[0])), "Arquivo da release anterior aceito pelo tamanho"
+            assert destino.read_bytes() == novos_dados, "Arquivo da release anterior aceito pelo tamanho"
+            nova = CNPJDownloader(base_url=base_url, download_dir=os.path.join(temp_dir, 'dados'),
+                                  db_path=os.path.join(temp_dir, 'teste.db'), release='2025-07')
+            assert nova.manifesto.arquivo_verificado('Estabelecimentos9.zip', destino), (
+                "Arquivo baixado na nova release não ficou verificado")
+            print("✓ Manifesto compartilhado não aproveita arquivos de outra release")
+            
+            # Segmentos deixados pela release anterior também são apagados
+            for sufixo in ('.part.0', '.part.1', '.part.segmentos'):
+                Path(str(destino) + sufixo).write_bytes(b'release anterior')
+            downloader = CNPJDownloader(base_url=base_url, download_dir=os.path.join(temp_dir, 'dados'),
+                                        db_path=os.path.join(temp_dir, 'teste.db'), release='2025-08')
+            assert downloader.download_file(dict(files[0])), "Download da release seguinte falhou"
+            restos = sorted(p.name for p in destino.parent.glob(destino.name + '.*'))
+            assert not restos, f"Segmentos de outra release mantidos: {restos}"
+            print("✓ Segmentos de outra release descartados")
+    finally:
+        servidor.shutdown()
+    
+    print("\n=== TESTE DE DOWNLOAD CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_importacao_pipeline():
+    """Testa a importação serial, paralela (escritor único) e em pipeline com ZIPs locais"""
+    print("\n=== TESTE DE IMPORTAÇÃO PARALELA E PIPELINE ===\n")
+    
+    ServidorArquivosLocal.arquivos = arquivos_release(
+        empresas=[(f'{i:08d}', f'EMPRESA {i}') for i in range(1, 301)],
+        estabelecimentos=[linha_estabelecimento(f'{i:08d}', '0001', '00', 'SP' if i % 2 else 'RJ')
+                          for i in range(1, 301)],
+        socios=[(f'{i % 300 + 1:08d}', f'SOCIO {i}') for i in range(450)],
+    )
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), ServidorArquivosLocal)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{servidor.server_address[1]}/"
+    
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            def novo_downloader(nome, dados='dados', **opcoes):
+                return CNPJDownloader(base_url=base_url, download_dir=os.path.join(temp_dir, dados),
+                                      db_path=os.path.join(temp_dir, f'{nome}.db'), **opcoes)
+            
+            serial = novo_downloader('serial')
+            serial.download_all_files()
+            serial.process_all_files()
+            esperado = contar_registros(serial.db_path)
+            assert esperado == {'cnaes': 1, 'municipios': 2, 'empresas': 300, 'estabelecimentos': 300,
+                                'socios': 450}, f"Importação serial: {esperado}"
+            print("✓ Importação serial dos ZIPs locais")
+            
+            def journal():
+                conn = sqlite3.connect(serial.db_path)
+                releases = {linha[0] for linha in conn.execute("SELECT release FROM importacao_arquivos")}
+                banco_id = conn.execute("SELECT valor FROM metadados WHERE chave = 'banco_id'").fetchone()
+                conn.close()
+                return releases, banco_id
+            
+            # Mesma release: nada é reimportado e o banco mantém sua identificação
+            _, banco_id = journal()
+            conn = sqlite3.connect(serial.db_path)
+            conn.execute("UPDATE estatisticas SET total = -1 WHERE dimensao = 'tabela' AND chave = 'empresas'")
+            conn.execute("DROP TABLE socios_resumo")
+            conn.commit()
+            conn.close()
+            serial.process_all_files()
+            assert journal() == ({None}, banco_id), f"Segunda importação da mesma release: {journal()}"
+            
+            # Sem importação nova, só as tabelas derivadas ausentes são construídas
+            conn = sqlite3.connect(serial.db_path)
+            empresas = ler_estatisticas(conn, 'tabela')['empresas']
+            socios_resumo = conn.execute("SELECT COUNT(*) FROM socios_resumo").fetchone()[0]
+            conn.close()
+            assert empresas == -1, "Tabelas derivadas reconstruídas sem importação nova"
+            assert socios_resumo == 300, f"socios_resumo ausente não foi construída: {socios_resumo}"
+            print("✓ Sem importação nova, só as tabelas derivadas ausentes são construídas")
+            
+            # Outra release com ZIPs de mesmo nome e tamanho: o journal não pode pular
+            serial.release = '2025-07'
+            serial.process_all_files()
+            releases, novo_banco_id = journal()
+            assert releases == {'2025-07'}, f"Journal com outra release: {releases}, {novo_banco_id}"
+            assert novo_banco_id != banco_id, f"Journal com outra release: {releases}, {novo_banco_id}"
+            print("✓ Journal só pula arquivos concluídos da mesma release")
+            
+            # bulk_load sobre um banco existente: índices removidos na carga e recriados no final
+            def indices():
+                conn = sqlite3.connect(serial.db_path)
+                nomes = {linha[0] for linha in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+                conn.close()
+                return nomes & {nome for nome, _ in CNPJDownloader.INDICES}
+            
+            assert indices() == {nome for nome, _ in CNPJDownloader.INDICES}, f"Índices do banco: {indices()}"
+            carga = novo_downloader('serial', bulk_load=True, release='2025-08')
+            durante = []
+            importar_carga = carga.extract_and_process_file
+            
+            def registrar_indices(filename):
+                sucesso = importar_carga(filename)
+                durante.append(indices())
+                return sucesso
+            
+            carga.extract_and_process_file = registrar_indices
+            carga.process_all_files()
+            assert durante and not any(durante), f"Índices durante a carga: {durante}"
+            assert indices() == {nome for nome, _ in CNPJDownloader.INDICES}, f"Índices após a carga: {indices()}"
+            print("✓ bulk_load remove os índices durante a carga e os recria no final")
+            
+            paralelo = novo_downloader('paralelo', import_workers=2)
+            paralelo.process_all_files()
+            assert contar_registros(paralelo.db_path) == esperado, (
+                f"Importação paralela: {contar_registros(paralelo.db_path)}")
+            print("✓ Processos leitores + escritor único gravam o mesmo que a importação serial")
+            
+            # Pipeline: um download por vez, importação na ordem de prioridade
+            pipeline = novo_downloader('pipeline', dados='dados_pipeline', max_workers=1)
+            ordem = []
+            importar = pipeline.extract_and_process_file
+            
+            def registrar_ordem(filename):
+                ordem.append(filename)
+                return importar(filename)
+            
+            pipeline.extract_and_process_file = registrar_ordem
+            baixados = pipeline.download_and_import_pipeline(max_fila=1)
+            assert len(baixados) == 5, f"Pipeline: {baixados}, {contar_registros(pipeline.db_path)}"
+            assert contar_registros(pipeline.db_path) == esperado, (
+                f"Pipeline: {baixados}, {contar_registros(pipeline.db_path)}")
+            assert ordem[:2] == ['Cnaes.zip', 'Municipios.zip'], f"Ordem de importação do pipeline: {ordem}"
+            assert len(ordem) == 5, f"Ordem de importação do pipeline: {ordem}"
+            print("✓ Pipeline importa tudo, tabelas de referência primeiro")
+            
+            # Falhas: download com 404, ZIP corrompido e exceção na importação
+            ServidorArquivosLocal.falhar = {'Empresas0.zip'}
+            ServidorArquivosLocal.arquivos['Socios0.zip'] = b'conteudo que nao e zip'
+            falhas = novo_downloader('falhas', dados='dados_falhas', max_workers=2)
+            importar_falhas = falhas.extract_and_process_file
+            
+            def falhar_municipios(filename):
+                if filename == 'Municipios.zip':
+                    raise RuntimeError("falha simulada")
+                return importar_falhas(filename)
+            
+            falhas.extract_and_process_file = falhar_municipios
+            resultado = {}
+            thread = threading.Thread(target=lambda: resultado.update(
+                baixados=falhas.download_and_import_pipeline(max_fila=1)), daemon=True)
+            thread.start()
+            thread.join(60)
+            assert not thread.is_alive(), "Pipeline travou depois de uma falha"
+            contagem = contar_registros(falhas.db_path)
+            assert sorted(resultado['baixados']) == ['Cnaes.zip', 'Estabelecimentos0.zip', 'Municipios.zip',
+                                                     'Socios0.zip'], (
+                f"Pipeline com falhas: {resultado['baixados']}, {contagem}")
+            assert contagem == {**esperado, 'municipios': 0, 'empresas': 0, 'socios': 0}, (
+                f"Pipeline com falhas: {resultado['baixados']}, {contagem}")
+            print("✓ Falhas de download e de importação não travam o pipeline")
+            
+            # Escritor sem conexão: continua consumindo a fila até a sentinela
+            fila = queue.Queue()
+            for _ in range(3):
+                fila.put(('arquivo', 'Empresas0.zip'))
+            fila.put(None)
+            quebrado = novo_downloader('quebrado')
+            quebrado.db_path = temp_dir
+            escritor = threading.Thread(target=_sqlite_writer_loop, args=(quebrado, fila, 1000), daemon=True)
+            escritor.start()
+            escritor.join(10)
+            assert not escritor.is_alive(), "Escritor com erro não esvaziou a fila"
+            assert fila.empty(), "Escritor com erro não esvaziou a fila"
+            print("✓ Escritor com erro esvazia a fila e encerra")
+    finally:
+        servidor.shutdown()
+        ServidorArquivosLocal.falhar = set()
+    
+    print("\n=== TESTE DE IMPORTAÇÃO CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_atualizacao_incremental():
+    """Testa a atualização incremental entre releases (alteração, remoção, inclusão e nada mudou)"""
+    print("\n=== TESTE DE ATUALIZAÇÃO INCREMENTAL ===\n")
+    
+    def release(empresas):
+        ufs = {'00000001': 'SP', '00000002': 'RJ', '00000003': 'MG', '00000006': 'BA'}
+        return arquivos_release(
+            empresas=empresas,
+            estabelecimentos=[linha_estabelecimento(c, '0001', '00', ufs[c]) for c, _ in empresas],
+            socios=[(c, f'SOCIO {c}') for c, _ in empresas],
+        )
+    
+    junho = [('00000001', 'EMPRESA UM'), ('00000002', 'EMPRESA DOIS'), ('00000003', 'EMPRESA TRES')]
+    julho = [('00000001', 'EMPRESA UM'), ('00000002', 'EMPRESA DOIS NOVO NOME'), ('00000006', 'EMPRESA SEIS')]
+    
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), ServidorArquivosLocal)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{servidor.server_address[1]}/"
+    
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            def importar(nome_release, empresas, incremental=True):
+                ServidorArquivosLocal.arquivos = release(empresas)
+                downloader = CNPJDownloader(base_url=base_url, download_dir=os.path.join(temp_dir, 'dados'),
+                                            db_path=os.path.join(temp_dir, 'cnpj.db'), release=nome_release,
+                                            separar_releases=True, incremental=incremental)
+                downloader.download_all_files()
+                downloader.process_all_files()
+                return sqlite3.connect(downloader.db_path)
+            
+            def changelog(conn, nome_release):
+                return {(tabela, operacao): total for tabela, operacao, total in conn.execute(
+                    "SELECT tabela, operacao, COUNT(*) FROM changelog WHERE release = ? GROUP BY 1, 2",
+                    (nome_release,))}
+            
+            importar('2025-06', junho, incremental=False).close()
+            
+            conn = importar('2025-07', julho)
+            empresas = conn.execute("SELECT cnpj_basico, razao_social FROM empresas ORDER BY 1").fetchall()
+            socios = conn.execute("SELECT cnpj_basico FROM socios ORDER BY 1").fetchall()
+            assert empresas == julho, f"Tabelas após o delta: {empresas}, {socios}"
+            assert socios == [('00000001',), ('00000002',), ('00000006',)], (
+                f"Tabelas após o delta: {empresas}, {socios}")
+            print("✓ Registro alterado, removido e incluído aplicados nas tabelas definitivas")
+            
+            esperado = {('empresas', 'atualizado'): 1, ('empresas', 'removido'): 1, ('empresas', 'inserido'): 1,
+                        ('estabelecimentos', 'removido'): 1, ('estabelecimentos', 'inserido'): 1,
+                        ('socios', 'removido'): 1, ('socios', 'inserido'): 1}
+            assert changelog(conn, '2025-07') == esperado, (
+                f"Changelog da release: {changelog(conn, '2025-07')}")
+            geracoes = dict(conn.execute("SELECT uf, geracao FROM geracao_uf"))
+            assert geracoes == {'SP': 1, 'RJ': 2, 'MG': 2, 'BA': 2}, f"Geração por UF: {geracoes}"
+            print("✓ Changelog e geração registram só as chaves e UFs alteradas")
+            assert not divergencias_estatisticas(conn), (
+                f"Estatísticas após o delta: {divergencias_estatisticas(conn)}")
+            print("✓ Estatísticas refeitas após o delta conferem com COUNT(*)")
+            conn.close()
+            
+            # Nova release idêntica: nada muda além da própria release
+            conn = importar('2025-08', julho)
+            empresas = conn.execute("SELECT cnpj_basico, razao_social FROM empresas ORDER BY 1").fetchall()
+            assert empresas == julho, "Empresas alteradas por uma release sem mudanças"
+            geracao = conn.execute("SELECT valor FROM metadados WHERE chave = 'geracao'").fetchone()[0]
+            release_carregada = conn.execute("SELECT valor FROM metadados WHERE chave = 'release'").fetchone()[0]
+            assert not changelog(conn, '2025-08'), (
+                f"Release sem mudanças: {changelog(conn, '2025-08')}, geração {geracao}")
+            assert dict(conn.execute("SELECT uf, geracao FROM geracao_uf")) == geracoes, (
+                f"Release sem mudanças: {changelog(conn, '2025-08')}, geração {geracao}")
+            assert (geracao, release_carregada) == ('3', '2025-08'), (
+                f"Release sem mudanças: {changelog(conn, '2025-08')}, geração {geracao}")
+            print("✓ Release sem mudanças: changelog vazio e nenhuma UF com nova geração")
+            conn.close()
+    finally:
+        servidor.shutdown()
+    
+    print("\n=== TESTE DE ATUALIZAÇÃO INCREMENTAL CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_download_async():
+    """Testa o downloader assíncrono (bloco adaptativo e retomada) e o limite global de banda"""
+    print("\n=== TESTE DO DOWNLOAD ASSÍNCRONO ===\n")
+    
+    async def consumir(limitador, blocos):
+        inicio = time.monotonic()
+        for _ in range(blocos):
+            await limitador.consumir(256 * 1024)
+        return time.monotonic() - inicio
+    
+    # 5 blocos de 256 KB a 1 MB/s: o primeiro passa direto, os outros 4 esperam 0,25s cada
+    assert asyncio.run(consumir(LimitadorBanda(None), 5)) <= 0.1, "Limitador sem limite atrasou a leitura"
+    duracao = asyncio.run(consumir(LimitadorBanda(1024 * 1024), 5))
+    assert 0.9 <= duracao < 2.0, f"Limitador de 1 MB/s liberou 1,25 MB em {duracao:.2f}s"
+    print(f"✓ Limitador de banda: 1,25 MB a 1 MB/s em {duracao:.2f}s")
+    
+    if aiohttp is None:
+        print("✓ aiohttp não instalado: downloader assíncrono não testado")
+        return
+    
+    dados = {'Empresas0.zip': os.urandom(6 * 1024 * 1024), 'Socios0.zip': os.urandom(2 * 1024 * 1024)}
+    ServidorArquivosLocal.arquivos = dict(dados)
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), ServidorArquivosLocal)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{servidor.server_address[1]}/"
+    
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            def novo_downloader(limite_banda=None):
+                return AsyncCNPJDownloader(base_url=base_url, download_dir=os.path.join(temp_dir, 'dados'),
+                                           db_path=os.path.join(temp_dir, 'teste.db'),
+                                           max_concorrencia=2, limite_banda=limite_banda)
+            
+            downloader = novo_downloader()
+            (downloader.download_dir / 'Socios0.zip.part').write_bytes(dados['Socios0.zip'][:500000])
+            ServidorArquivosLocal.requisicoes.clear()
+            baixados = downloader.download_all_files()
+            assert sorted(baixados) == sorted(dados), f"Downloads assíncronos: {baixados}"
+            assert all((downloader.download_dir / nome).read_bytes() == conteudo
+                       for nome, conteudo in dados.items()), f"Downloads assíncronos: {baixados}"
+            assert ('GET', '/Socios0.zip', 'bytes=500000-') in ServidorArquivosLocal.requisicoes, (
+                "Arquivo parcial não foi retomado com Range")
+            print("✓ Downloads simultâneos completos, .part retomado com Range")
+            
+            estatisticas = {s['arquivo']: s for s in downloader.estatisticas_download}
+            assert estatisticas['Empresas0.zip']['maior_bloco'] > AsyncCNPJDownloader.CHUNK_MINIMO, (
+                f"Bloco não cresceu na conexão local: {estatisticas['Empresas0.zip']}")
+            print(f"✓ Bloco adaptativo cresceu até {estatisticas['Empresas0.zip']['maior_bloco'] // 1024} KB")
+            
+            # Limite global: 8 MB a 8 MB/s, somando os dois downloads (o último bloco não espera)
+            for nome in dados:
+                (downloader.download_dir / nome).unlink()
+            inicio = time.monotonic()
+            baixados = novo_downloader(limite_banda=8 * 1024 * 1024).download_all_files()
+            duracao = time.monotonic() - inicio
+            assert len(baixados) == 2, f"Limite de 8 MB/s: {len(baixados)} arquivos em {duracao:.2f}s"
+            assert duracao >= 0.5, f"Limite de 8 MB/s: {len(baixados)} arquivos em {duracao:.2f}s"
+            print(f"✓ Limite global de banda: 8 MB em {duracao:.2f}s a 8 MB/s")
+    finally:
+        servidor.shutdown()
+    
+    print("\n=== TESTE DO DOWNLOAD ASSÍNCRONO CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_descoberta_releases():
+    """Testa a descoberta de releases com a listagem salva em fixtures/"""
+    print("\n=== TESTE DE DESCOBERTA DE RELEASES ===\n")
+    
+    fixture = Path(__file__).parent / 'fixtures' / 'indice_dados_abertos.html'
+    html = fixture.read_text(encoding='utf-8')
+    
+    releases = parse_release_index(html)
+    assert len(releases) == 27, f"Parser retornou {releases}"
+    assert releases[0] == '2023-05', f"Parser retornou {releases}"
+    assert releases[-1] == '2025-07', f"Parser retornou {releases}"
+    print(f"✓ Parser: {len(releases)} releases ({releases[0]} a {releases[-1]})")
+    
+    ServidorArquivosLocal.paginas = {'/dados_abertos_cnpj/': html.encode('utf-8')}
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), ServidorArquivosLocal)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    index_url = f"http://127.0.0.1:{servidor.server_address[1]}/dados_abertos_cnpj/"
+    
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            opcoes = dict(
+                download_dir=os.path.join(temp_dir, 'dados'),
+                db_path=os.path.join(temp_dir, 'teste.db'),
+                index_url=index_url,
+                separar_releases=True
+            )
+            
+            downloader = CNPJDownloader(**opcoes)
+            assert downloader.release == '2025-07', (
+                f"Release escolhida: {downloader.release} ({downloader.base_url})")
+            assert downloader.base_url == index_url + '2025-07/', (
+                f"Release escolhida: {downloader.release} ({downloader.base_url})")
+            print("✓ Release mais recente escolhida automaticamente")
+            
+            anterior = CNPJDownloader(release='2025-06', **opcoes)
+            esperado = (Path(temp_dir) / 'dados' / '2025-07',
+                        Path(temp_dir) / 'releases' / '2025-07' / 'teste.db')
+            assert (downloader.download_dir, Path(downloader.db_path)) == esperado, (
+                f"Diretórios da release: {downloader.download_dir}, {downloader.db_path}")
+            assert anterior.download_dir != downloader.download_dir, (
+                "Releases diferentes compartilham diretório ou banco")
+            assert anterior.db_path != downloader.db_path, (
+                "Releases diferentes compartilham diretório ou banco")
+            print("✓ Cada release tem seu diretório de download e banco")
+            
+            # Diretório compartilhado: nenhuma consulta até a hora de baixar
+            ServidorArquivosLocal.requisicoes.clear()
+            compartilhado = CNPJDownloader(download_dir=os.path.join(temp_dir, 'compartilhado'),
+                                           db_path=os.path.join(temp_dir, 'compartilhado.db'),
+                                           index_url=index_url)
+            compartilhado.process_all_files()
+            assert not ServidorArquivosLocal.requisicoes, (
+                f"Listagem consultada sem download: {ServidorArquivosLocal.requisicoes}")
+            assert compartilhado.base_url is None, (
+                f"Listagem consultada sem download: {ServidorArquivosLocal.requisicoes}")
+            compartilhado.get_file_list()
+            assert (compartilhado.release, compartilhado.base_url) == ('2025-07', index_url + '2025-07/'), (
+                f"Release descoberta no download: {compartilhado.release} ({compartilhado.base_url})")
+            assert compartilhado.manifesto.release == '2025-07', (
+                "Manifesto não acompanhou a release descoberta")
+            print("✓ Sem --por-release, a release só é consultada ao baixar (importação offline)")
+    finally:
+        servidor.shutdown()
+        ServidorArquivosLocal.paginas = {}
+    
+    print("\n=== TESTE DE DESCOBERTA CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_plano_exportacao():
+    """Testa que a exportação por estado percorre índices sem ordenação temporária"""
+    print("\n=== TESTE DO PLANO DE EXPORTAÇÃO ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'teste.db')
+        CNPJDownloader(base_url='http://127.0.0.1/', download_dir=os.path.join(temp_dir, 'dados'),
+                       db_path=db_path)
+        
+        for ordem in GeradorCSVEstados.ORDENACOES:
+            gerador = GeradorCSVEstados(db_path, os.path.join(temp_dir, 'csv'), ordem=ordem)
+            plano = gerador.verificar_plano_exportacao()
+            print(f"✓ Ordem '{ordem}': {plano[0]}")
+        
+        # Ordem por CNPJ com um único estado: só as linhas da UF, não a tabela inteira
+        gerador = GeradorCSVEstados(db_path, os.path.join(temp_dir, 'csv'), ordem='cnpj')
+        conn = sqlite3.connect(db_path)
+        plano = [linha[3] for linha in conn.execute(f"EXPLAIN QUERY PLAN {gerador.consulta_pagina(1, True)}",
+                                                     ('SP', '', '', '', 1))]
+        conn.close()
+        assert 'idx_ordem_exportacao_cnpj (uf=?' in plano[0], f"Um estado na ordem por CNPJ: {plano[0]}"
+        print(f"✓ Um estado na ordem por CNPJ: {plano[0]}")
+        
+        db_path = criar_banco_exportacao(temp_dir)
+        for grupo in (['SP', 'RJ', 'MG'], ['SP'], ['MG']):
+            gerador = GeradorCSVEstados(db_path, os.path.join(temp_dir, 'csv_cnpj'), ordem='cnpj')
+            for uf, arquivos in gerador.gerar_csv_estados(grupo).items():
+                obtido = [linha['cnpj_completo'] for linha in ler_csvs(arquivos)]
+                assert obtido == estabelecimentos_ativos(db_path, uf, 'cnpj'), (
+                    f"{uf} na ordem por CNPJ (grupo {grupo})")
+        print("✓ Ordem por CNPJ igual com todos os estados em um percurso e com um estado por vez")
+    
+    print("\n=== TESTE DO PLANO CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_exportacao_estados():
+    """Testa a exportação por estado: registros, ordem e divisão dos arquivos"""
+    print("\n=== TESTE DA EXPORTAÇÃO POR ESTADO ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = criar_banco_exportacao(temp_dir)
+        estados = ('SP', 'RJ', 'MG')
+        
+        conn = sqlite3.connect(db_path)
+        conn.executemany("INSERT INTO cnaes (codigo, descricao) VALUES (?, ?)",
+                         [('4711302', 'Supermercados'), ('5611201', 'Restaurantes')])
+        conn.execute("UPDATE estabelecimentos SET cnae_fiscal_secundaria = '5611201,4711302,9999999' "
+                     "WHERE cnpj_basico = '00000001' AND cnpj_ordem = '0001'")
+        conn.execute("UPDATE estabelecimentos SET cnae_fiscal_secundaria = '4711302' "
+                     "WHERE cnpj_basico = '00000009'")
+        conn.commit()
+        conn.close()
+        
+        saida = os.path.join(temp_dir, 'csv')
+        gerador = GeradorCSVEstados(db_path, saida)
+        gerador.max_linhas_arquivo = 3
+        gerador.gerar_todos_estados(incluir_socios=False)
+        
+        nomes = {uf: [Path(arquivo).name for arquivo in arquivos_estado(saida, uf)] for uf in estados}
+        assert nomes == {'SP': ['SP_001.csv', 'SP_002.csv', 'SP_003.csv'], 'RJ': ['RJ_001.csv', 'RJ_002.csv'],
+                         'MG': ['MG.csv']}, f"Arquivos gerados: {nomes}"
+        print("✓ Novo arquivo a cada max_linhas_arquivo registros (UF.csv quando o estado cabe em um)")
+        
+        for uf in estados:
+            obtido = [linha['cnpj_completo'] for linha in ler_csvs(arquivos_estado(saida, uf))]
+            assert obtido == estabelecimentos_ativos(db_path, uf), f"Registros de {uf}: {obtido}"
+        print("✓ Todos os estabelecimentos ativos de cada estado, em ordem de razão social")
+        
+        atividades = {linha['cnpj_completo']: linha['atividades_secundarias']
+                      for uf in estados for linha in ler_csvs(arquivos_estado(saida, uf))}
+        assert atividades['00000001000100'] == 'Restaurantes, Supermercados, CNAE 9999999', (
+            f"Atividades secundárias: {atividades['00000001000100']}")
+        assert atividades['00000009000100'] == 'Supermercados', (
+            f"Atividades secundárias: {atividades['00000009000100']}")
+        assert atividades['00000002000100'] == '', f"Sem CNAE secundário: {atividades['00000002000100']}"
+        print("✓ Atividades secundárias resolvidas pela tabela estabelecimento_cnae_secundario")
+        
+        query = CNPJQuery(db_path)
+        encontrados = [est['cnpj'] for est in query.buscar_por_cnae_secundario('4711302')]
+        assert encontrados == ['00000001000100', '00000009000100'], f"Busca por CNAE secundário: {encontrados}"
+        encontrados = [est['cnpj'] for est in query.buscar_por_cnae_secundario('4711302', uf='sp')]
+        assert encontrados == ['00000001000100'], f"Busca por CNAE secundário em SP: {encontrados}"
+        query.fechar()
+        print("✓ Busca por CNAE secundário pelo índice da tabela")
+        
+        # Estado por estado: mesmos arquivos, byte a byte
+        por_estado = os.path.join(temp_dir, 'csv_por_estado')
+        gerador = GeradorCSVEstados(db_path, por_estado)
+        gerador.max_linhas_arquivo = 3
+        gerador.gerar_todos_estados(incluir_socios=False, passagem_unica=False)
+        for uf in estados:
+            for arquivo in arquivos_estado(saida, uf):
+                assert Path(arquivo).read_bytes() == (Path(por_estado) / Path(arquivo).name).read_bytes(), (
+                    f"{Path(arquivo).name} difere entre passagem única e estado por estado")
+        print("✓ Passagem única e geração estado por estado produzem os mesmos arquivos")
+    
+    print("\n=== TESTE DA EXPORTAÇÃO POR ESTADO CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_exportacao_paralela():
+    """Testa a exportação em processos paralelos contra a geração em um único processo"""
+    print("\n=== TESTE DA EXPORTAÇÃO PARALELA ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = criar_banco_exportacao(temp_dir)
+        
+        diretorios = {}
+        for jobs in (1, 2):
+            diretorios[jobs] = os.path.join(temp_dir, f'csv_{jobs}')
+            gerador = GeradorCSVEstados(db_path, diretorios[jobs])
+            gerador.max_linhas_arquivo = 3
+            gerador.gerar_todos_estados(jobs=jobs)
+        
+        arquivos = {jobs: sorted(p.name for p in Path(diretorio).glob('*.csv'))
+                    for jobs, diretorio in diretorios.items()}
+        assert arquivos[1] == arquivos[2], f"Arquivos com 1 e 2 processos: {arquivos}"
+        assert 'MG_socios.csv' in arquivos[2], f"Arquivos com 1 e 2 processos: {arquivos}"
+        for nome in arquivos[1]:
+            assert (Path(diretorios[1]) / nome).read_bytes() == (Path(diretorios[2]) / nome).read_bytes(), (
+                f"{nome} difere entre a geração paralela e a sequencial")
+        print(f"✓ Com 2 processos: os mesmos {len(arquivos[2])} arquivos (principais e sócios), byte a byte")
+        
+        with open(Path(diretorios[2]) / GeradorCSVEstados.ARQUIVO_IMPRESSOES, 'r', encoding='utf-8') as f:
+            registros = json.load(f)
+        assert sorted(registros) == ['MG', 'RJ', 'SP'], f"Resumo da geração paralela: {registros}"
+        assert registros['SP']['resumo']['arquivos_principais'] == 3, (
+            f"Resumo da geração paralela: {registros}")
+        print("✓ Resumo de cada estado devolvido pelos processos")
+    
+    print("\n=== TESTE DA EXPORTAÇÃO PARALELA CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_exportacao_comprimida():
+    """Testa a exportação com gzip e zstd: divisão dos arquivos, conteúdo e volume"""
+    print("\n=== TESTE DA EXPORTAÇÃO COMPRIMIDA ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = criar_banco_exportacao(temp_dir)
+        saida = os.path.join(temp_dir, 'csv')
+        
+        gerador = GeradorCSVEstados(db_path, saida)
+        gerador.max_linhas_arquivo = 3
+        gerador.gerar_todos_estados()
+        esperado = {prefixo: ler_csvs(arquivos_estado(saida, prefixo)) for prefixo in ('SP', 'SP_socios')}
+        bytes_sp = sum(Path(arquivo).stat().st_size
+                       for prefixo in esperado for arquivo in arquivos_estado(saida, prefixo))
+        
+        for compressao, extensao in (('gzip', '.csv.gz'), ('zstd', '.csv.zst')):
+            if compressao == 'zstd' and zstandard is None:
+                print("✓ zstandard não instalado: zstd não testado")
+                continue
+            
+            # Mesmo diretório: os arquivos da geração anterior (outra extensão) são substituídos
+            gerador = GeradorCSVEstados(db_path, saida, compressao=compressao)
+            gerador.max_linhas_arquivo = 3
+            gerador.gerar_todos_estados(forcar=True)
+            
+            nomes = [Path(arquivo).name for arquivo in arquivos_estado(saida, 'SP')]
+            assert nomes == [f'SP_{indice:03d}{extensao}' for indice in (1, 2, 3)], (
+                f"Arquivos com {compressao}: {sorted(p.name for p in Path(saida).iterdir())}")
+            assert not list(Path(saida).glob('*.csv')), (
+                f"Arquivos com {compressao}: {sorted(p.name for p in Path(saida).iterdir())}")
+            
+            for prefixo, linhas in esperado.items():
+                assert ler_csvs(arquivos_estado(saida, prefixo)) == linhas, (
+                    f"Conteúdo de {prefixo} com {compressao} difere do CSV sem compressão")
+            
+            bytes_csv, bytes_gravados = gerador.bytes_por_estado['SP']
+            gravados = sum(Path(arquivo).stat().st_size
+                           for prefixo in esperado for arquivo in arquivos_estado(saida, prefixo))
+            assert (bytes_csv, bytes_gravados) == (bytes_sp, gravados), (
+                f"Volume de SP com {compressao}: {bytes_csv}/{bytes_gravados}, esperado {bytes_sp}/{gravados}")
+            print(f"✓ {compressao}: arquivos {extensao} divididos, mesmo conteúdo, volume antes e depois contado")
+    
+    print("\n=== TESTE DA EXPORTAÇÃO COMPRIMIDA CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_exportacao_inalterados():
+    """Testa a impressão digital por estado: só os estados alterados são gerados de novo"""
+    print("\n=== TESTE DA EXPORTAÇÃO SÓ DOS ESTADOS ALTERADOS ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = criar_banco_exportacao(temp_dir)
+        saida = os.path.join(temp_dir, 'csv')
+        
+        def gerar(**opcoes):
+            """Gera todos os estados e devolve os que tiveram arquivos reescritos"""
+            antes = {p.name: p.stat().st_mtime_ns for p in Path(saida).glob('*.csv')}
+            time.sleep(0.01)
+            gerador = GeradorCSVEstados(db_path, saida)
+            gerador.max_linhas_arquivo = 3
+            gerador.gerar_todos_estados(**opcoes)
+            return {p.name[:2] for p in Path(saida).glob('*.csv') if antes.get(p.name) != p.stat().st_mtime_ns}
+        
+        impressoes = GeradorCSVEstados(db_path, saida).calcular_impressoes(['SP', 'RJ'])
+        assert [impressao['geracao'] for impressao in impressoes.values()] == [1, 1], (
+            f"Impressões: {impressoes}")
+        assert impressoes['SP']['banco'] == impressoes['RJ']['banco'], f"Impressões: {impressoes}"
+        print("✓ Impressão com o banco e a geração de cada UF, sem ler os estabelecimentos")
+        
+        assert gerar() == {'SP', 'RJ', 'MG'}, "Segunda geração sem mudanças reescreveu arquivos"
+        assert not gerar(), "Segunda geração sem mudanças reescreveu arquivos"
+        print("✓ Sem mudanças nos dados, nenhum estado é gerado de novo")
+        
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE empresas SET razao_social = 'EMPRESA RENOMEADA' WHERE cnpj_basico = '00000008'")
+        registrar_geracao(conn, "SELECT 'RJ' AS uf")
+        construir_tabelas_derivadas(conn)
+        conn.commit()
+        assert gerar() == {'RJ'}, "Só RJ mudou, mas outros estados foram gerados"
+        razoes = [linha['razao_social'] for linha in ler_csvs(arquivos_estado(saida, 'RJ'))]
+        assert 'EMPRESA RENOMEADA' in razoes, "RJ gerado sem a alteração"
+        print("✓ Nova geração de uma UF: só os arquivos dela são refeitos")
+        
+        (Path(saida) / 'MG.csv').unlink()
+        assert gerar() == {'MG'}, "Estado com arquivo ausente não foi gerado de novo"
+        print("✓ Estado com arquivo ausente é gerado de novo")
+        
+        assert gerar(incluir_socios=False) == {'SP', 'RJ', 'MG'}, (
+            "Mudança de opções ou --force não regerou todos os estados")
+        assert gerar(forcar=True) == {'SP', 'RJ', 'MG'}, (
+            "Mudança de opções ou --force não regerou todos os estados")
+        
+        conn.execute("INSERT INTO cnaes (codigo, descricao) VALUES ('0111301', 'Cultivo de arroz')")
+        conn.commit()
+        assert gerar() == {'SP', 'RJ', 'MG'}, "Mudança em tabela de referência não regerou todos os estados"
+        print("✓ Opções, tabelas de referência e --force fazem todos os estados serem gerados")
+        
+        conn.execute("DELETE FROM metadados WHERE chave = 'banco_id'")
+        conn.commit()
+        conn.close()
+        impressoes = GeradorCSVEstados(db_path, saida).calcular_impressoes(['SP'])
+        assert impressoes == {'SP': None}, "Banco sem controle de gerações deveria gerar todos os estados"
+        assert gerar() == {'SP', 'RJ', 'MG'}, "Banco sem controle de gerações deveria gerar todos os estados"
+        print("✓ Banco sem controle de gerações: todos os estados são gerados")
+    
+    print("\n=== TESTE DA EXPORTAÇÃO SÓ DOS ESTADOS ALTERADOS CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_estatisticas():
+    """Testa a tabela estatisticas contra COUNT(*) e as contagens usadas na exportação"""
+    print("\n=== TESTE DAS ESTATÍSTICAS ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = criar_banco_exportacao(temp_dir)
+        gerador = GeradorCSVEstados(db_path, os.path.join(temp_dir, 'csv'))
+        
+        # Sem a tabela: contagem direta nas tabelas
+        sem_tabela = (gerador.get_estados_disponiveis(), gerador.contar_registros_todos_estados(),
+                      gerador.contar_registros_por_estado('SP'))
+        assert sem_tabela == (['MG', 'RJ', 'SP'], {'SP': 8, 'RJ': 4, 'MG': 2}, 8), (
+            f"Contagens sem a tabela estatisticas: {sem_tabela}")
+        
+        conn = sqlite3.connect(db_path)
+        construir_tabelas_derivadas(conn)
+        divergentes = divergencias_estatisticas(conn)
+        assert not divergentes, f"Estatísticas diferentes de COUNT(*): {divergentes}"
+        print("✓ Totais por tabela, UF, UF ativos, situação e porte iguais a COUNT(*)")
+        
+        com_tabela = (gerador.get_estados_disponiveis(), gerador.contar_registros_todos_estados(),
+                      gerador.contar_registros_por_estado('SP'))
+        assert com_tabela == sem_tabela, f"Contagens pela tabela estatisticas: {com_tabela}"
+        print("✓ Exportação conta pela tabela o mesmo que pelas consultas diretas")
+        
+        # Importação pendente: a tabela ainda descreve a carga anterior e é ignorada
+        conn.execute("UPDATE estabelecimentos SET situacao_cadastral = '08' WHERE cnpj_basico = '00000002'")
+        conn.execute("INSERT INTO metadados (chave, valor) VALUES ('importacao_pendente', 'Estabelecimentos0.zip')")
+        conn.commit()
+        assert ler_estatisticas(conn, 'tabela') is None, "Estatísticas lidas durante uma importação pendente"
+        assert gerador.contar_registros_todos_estados()['SP'] == 7, (
+            "Contagem pela tabela estatisticas durante uma importação pendente")
+        print("✓ Com importação pendente, as contagens vêm direto das tabelas")
+        
+        conn.execute("DELETE FROM metadados WHERE chave = 'importacao_pendente'")
+        construir_tabelas_derivadas(conn)
+        conn.close()
+        assert gerador.contar_registros_todos_estados()['SP'] == 7, (
+            "Estatísticas não acompanharam a reconstrução")
+        print("✓ Reconstruída com os dados, a tabela acompanha as alterações")
+    
+    print("\n=== TESTE DAS ESTATÍSTICAS CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_retomada_exportacao():
+    """Testa ordem_exportacao, a paginação por chave e a retomada de um estado interrompido"""
+    print("\n=== TESTE DA RETOMADA DA EXPORTAÇÃO ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = criar_banco_exportacao(temp_dir)
+        saida = Path(temp_dir) / 'csv'
+        esperado = estabelecimentos_ativos(db_path, 'SP')
+        
+        conn = sqlite3.connect(db_path)
+        construir_tabelas_derivadas(conn)
+        ordem = [cnpj for cnpj, in conn.execute(
+            "SELECT cnpj_basico || cnpj_ordem || cnpj_dv FROM ordem_exportacao WHERE uf = 'SP' "
+            "ORDER BY uf, razao_social, cnpj_ordem, cnpj_basico, cnpj_dv")]
+        assert ordem == esperado, f"ordem_exportacao de SP: {ordem}"
+        print("✓ ordem_exportacao: só os ativos, na ordem de razão social, pela chave primária")
+        
+        def gerar_sp(interromper_em=None):
+            """Gera SP em páginas de 2 registros; devolve (arquivos, registros lidos nesta execução)"""
+            gerador = GeradorCSVEstados(db_path, str(saida))
+            gerador.max_linhas_arquivo = 2
+            gerador.TAMANHO_PAGINA = 2
+            lidos = []
+            escrever = _EscritorRotativo.escrever
+            
+            def contar_linha(escritor, row, chave=None):
+                lidos.append(chave)
+                if len(lidos) == interromper_em:
+                    raise KeyboardInterrupt
+                escrever(escritor, row, chave)
+            
+            _EscritorRotativo.escrever = contar_linha
+            try:
+                return gerador.gerar_csv_estados(['SP'])['SP'], len(lidos)
+            except KeyboardInterrupt:
+                return None, len(lidos)
+            finally:
+                _EscritorRotativo.escrever = escrever
+        
+        progresso_path = saida / '.SP.progresso.json'
+        arquivos, _ = gerar_sp(interromper_em=6)
+        progresso = json.loads(progresso_path.read_text(encoding='utf-8')) if progresso_path.exists() else {}
+        assert arquivos is None, f"Progresso após a interrupção: {progresso}"
+        assert (progresso.get('arquivos_concluidos'), progresso.get('registros')) == (2, 4), (
+            f"Progresso após a interrupção: {progresso}")
+        print("✓ Interrompido no 3º arquivo: progresso com 2 arquivos concluídos e a última chave")
+        
+        concluidos = {nome: (saida / nome).stat().st_mtime_ns for nome in ('SP_001.csv', 'SP_002.csv')}
+        arquivos, lidos = gerar_sp()
+        mantidos = {nome: (saida / nome).stat().st_mtime_ns for nome in concluidos}
+        assert lidos == len(esperado) - 4, (
+            f"Retomada leu {lidos} registros e manteve {mantidos == concluidos} os arquivos concluídos")
+        assert mantidos == concluidos, (
+            f"Retomada leu {lidos} registros e manteve {mantidos == concluidos} os arquivos concluídos")
+        obtido = [linha['cnpj_completo'] for linha in ler_csvs(arquivos)]
+        assert obtido == esperado, f"Após a retomada: {obtido}"
+        assert not progresso_path.exists(), f"Após a retomada: {obtido}"
+        print("✓ Retomada lê só os registros depois da última chave e completa o estado sem repetições")
+        
+        # Dados alterados depois da interrupção: o progresso não vale mais
+        gerar_sp(interromper_em=6)
+        registrar_geracao(conn, "SELECT 'SP' AS uf")
+        conn.commit()
+        conn.close()
+        arquivos, lidos = gerar_sp()
+        assert lidos == len(esperado), f"Progresso de dados antigos reaproveitado ({lidos} registros lidos)"
+        assert [linha['cnpj_completo'] for linha in ler_csvs(arquivos)] == esperado, (
+            f"Progresso de dados antigos reaproveitado ({lidos} registros lidos)")
+        print("✓ Nova geração dos dados descarta o progresso e gera o estado desde o início")
+    
+    print("\n=== TESTE DA RETOMADA CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_exportacao_socios():
+    """Testa o arquivo de sócios por estado: subconsulta não correlacionada e sem linhas repetidas"""
+    print("\n=== TESTE DA EXPORTAÇÃO DE SÓCIOS ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'teste.db')
+        CNPJDownloader(base_url='http://127.0.0.1/', download_dir=os.path.join(temp_dir, 'dados'),
+                       db_path=db_path)
+        
+        conn = sqlite3.connect(db_path)
+        conn.executemany("INSERT INTO empresas (cnpj_basico, razao_social) VALUES (?, ?)",
+                         [('00000001', 'EMPRESA UM'), ('00000002', 'EMPRESA DOIS')])
+        conn.executemany("INSERT INTO estabelecimentos (cnpj_basico, cnpj_ordem, cnpj_dv, uf) VALUES (?, ?, ?, ?)",
+                         [('00000001', '0001', '91', 'SP'), ('00000001', '0002', '72', 'SP'),
+                          ('00000002', '0001', '53', 'RJ')])
+        # Sócio repetido (mesma linha importada duas vezes) e empresa com duas filiais no estado
+        conn.executemany("INSERT INTO socios (cnpj_basico, nome_socio) VALUES (?, ?)",
+                         [('00000001', 'SOCIO A'), ('00000001', 'SOCIO A'), ('00000001', 'SOCIO B'),
+                          ('00000002', 'SOCIO C')])
+        conn.commit()
+        conn.close()
+        
+        gerador = GeradorCSVEstados(db_path, os.path.join(temp_dir, 'csv'))
+        plano = gerador.plano_socios()
+        assert not any('CORRELATED' in linha for linha in plano), f"Plano da consulta de sócios: {plano}"
+        assert any('idx_estabelecimentos_uf' in linha for linha in plano), (
+            f"Plano da consulta de sócios: {plano}")
+        print("✓ Empresas do estado lidas uma vez pelo índice de UF (subconsulta não correlacionada)")
+        
+        arquivos = gerador.gerar_arquivo_socios_separado('SP')
+        with open(arquivos[0], 'r', encoding='utf-8') as f:
+            linhas = [(linha['cnpj_basico'], linha['nome_socio']) for linha in csv.DictReader(f)]
+        assert linhas == [('00000001', 'SOCIO A'), ('00000001', 'SOCIO B')], f"Sócios exportados: {linhas}"
+        print("✓ Cada sócio sai uma vez, mesmo repetido na tabela ou com várias filiais no estado")
+    
+    print("\n=== TESTE DA EXPORTAÇÃO DE SÓCIOS CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_busca_textual():
+    """Testa a busca por relevância (FTS5) e o LIKE quando o índice não existe"""
+    print("\n=== TESTE DE BUSCA TEXTUAL ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'teste.db')
+        CNPJDownloader(base_url='http://127.0.0.1/', download_dir=os.path.join(temp_dir, 'dados'),
+                       db_path=db_path)
+        
+        conn = sqlite3.connect(db_path)
+        conn.executemany("INSERT INTO empresas (cnpj_basico, razao_social) VALUES (?, ?)", [
+            ('00000001', 'PADARIA SÃO JOÃO LTDA'),
+            ('00000002', 'COMERCIO DE PAES E DOCES LTDA'),
+            ('00000003', 'PETROLEO BRASILEIRO S.A.'),
+        ])
+        conn.execute("INSERT INTO estabelecimentos (cnpj_basico, cnpj_ordem, cnpj_dv, nome_fantasia) "
+                     "VALUES ('00000002', '0001', '00', 'PADARIA CENTRAL')")
+        conn.commit()
+        
+        query = CNPJQuery(db_path)
+        assert [e['cnpj_basico'] for e in query.buscar_por_razao_social('PADARIA')] == ['00000001'], (
+            "Busca por LIKE sem o índice")
+        print("✓ Sem índice: busca por LIKE")
+        
+        if not fts5_disponivel(conn):
+            conn.close()
+            print("✓ SQLite sem FTS5: busca textual não testada")
+            return
+        
+        construir_tabelas_derivadas(conn)
+        conn.close()
+        
+        encontrados = [e['cnpj_basico'] for e in query.buscar_texto('sao joa')]
+        assert encontrados == ['00000001'], f"Busca sem acentos por prefixo retornou {encontrados}"
+        print("✓ Busca por prefixo ignora acentos e maiúsculas")
+        
+        encontrados = [e['cnpj_basico'] for e in query.buscar_texto('padaria')]
+        assert encontrados == ['00000001', '00000002'], f"Busca por relevância retornou {encontrados}"
+        print("✓ Razão social e nome fantasia, razão social primeiro")
+        
+        encontrados = [e['cnpj_basico'] for e in query.buscar_por_razao_social('petro bras')]
+        assert encontrados == ['00000003'], f"Busca por razão social retornou {encontrados}"
+        print("✓ Busca por razão social usa o índice")
+    
+    print("\n=== TESTE DE BUSCA TEXTUAL CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_consulta_lote():
+    """Testa a consulta de CNPJs em lote (8 e 14 dígitos, inválidos, ordem da entrada)"""
+    print("\n=== TESTE DE CONSULTA EM LOTE ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'teste.db')
+        CNPJDownloader(base_url='http://127.0.0.1/', download_dir=os.path.join(temp_dir, 'dados'),
+                       db_path=db_path)
+        
+        conn = sqlite3.connect(db_path)
+        conn.executemany("INSERT INTO empresas (cnpj_basico, razao_social) VALUES (?, ?)",
+                         [('00000001', 'EMPRESA UM'), ('00000002', 'EMPRESA DOIS')])
+        conn.executemany("INSERT INTO estabelecimentos (cnpj_basico, cnpj_ordem, cnpj_dv) VALUES (?, ?, ?)",
+                         [('00000001', '0001', '91'), ('00000001', '0002', '72'), ('00000002', '0001', '53')])
+        conn.execute("INSERT INTO socios (cnpj_basico, nome_socio) VALUES ('00000001', 'SOCIO UM')")
+        conn.commit()
+        conn.close()
+        
+        entradas = ['00.000.002/0001-53', 'xyz', '1', '99999999', '00000001000272']
+        with CNPJQuery(db_path) as query:
+            resultados = list(query.buscar_lote(entradas))
+            
+            esperado = [
+                ('00000002', True, ['00000002000153'], 0),
+                (None, False, [], 0),
+                ('00000001', True, ['00000001000191', '00000001000272'], 1),
+                ('99999999', False, [], 0),
+                ('00000001', True, ['00000001000272'], 1),
+            ]
+            obtido = [(r['cnpj_basico'], r['encontrado'], [e['cnpj_completo'] for e in r['estabelecimentos']],
+                       len(r['socios'])) for r in resultados]
+            assert obtido == esperado, f"Lote retornou {obtido}"
+            assert [r['entrada'] for r in resultados] == entradas, f"Lote retornou {obtido}"
+            print("✓ CNPJs com 8 e 14 dígitos, inválidos e inexistentes, na ordem da entrada")
+            
+            assert resultados[1].get('erro') == 'CNPJ inválido', "Entrada inválida sem indicação de erro"
+            
+            saida = io.StringIO()
+            total, encontrados = escrever_lote(query.buscar_lote(entradas), saida, 'jsonl')
+            linhas = [json.loads(linha) for linha in saida.getvalue().splitlines()]
+            assert (total, encontrados, len(linhas)) == (5, 3, 5), (
+                f"Saída JSONL: {total} lidos, {encontrados} encontrados, {len(linhas)} linhas")
+            assert linhas[0]['empresa']['razao_social'] == 'EMPRESA DOIS', (
+                f"Saída JSONL: {total} lidos, {encontrados} encontrados, {len(linhas)} linhas")
+            print("✓ Saída JSONL com um objeto por CNPJ")
+    
+    print("\n=== TESTE DE CONSULTA EM LOTE CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_servidor_consulta():
+    """Testa o servidor HTTP de consultas (rotas, cache e métricas) em uma porta local"""
+    print("\n=== TESTE DO SERVIDOR DE CONSULTAS ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'teste.db')
+        CNPJDownloader(base_url='http://127.0.0.1/', download_dir=os.path.join(temp_dir, 'dados'),
+                       db_path=db_path)
+        
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO empresas (cnpj_basico, razao_social) VALUES ('00000001', 'EMPRESA UM')")
+        conn.execute("INSERT INTO estabelecimentos (cnpj_basico, cnpj_ordem, cnpj_dv, uf) "
+                     "VALUES ('00000001', '0001', '91', 'SP')")
+        conn.commit()
+        conn.close()
+        
+        servidor = ServidorConsulta(db_path, porta=0, workers=2)
+        servidor.query.verificar_geracao_a_cada = 0  # geração relida a cada consulta
+        loop = asyncio.new_event_loop()
+        loop.run_until_complete(servidor.iniciar())
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        
+        try:
+            cliente = http.client.HTTPConnection('127.0.0.1', servidor.porta, timeout=10)
+            
+            def consultar(caminho):
+                cliente.request('GET', caminho)
+                resposta = cliente.getresponse()
+                return resposta.status, json.loads(resposta.read())
+            
+            respostas = [consultar(caminho) for caminho in
+                         ('/cnpj/00.000.001/0001-91', '/cnpj/00.000.001/0001-91', '/cnpj/99999999',
+                          '/uf/sp', '/busca?q=empresa')]
+            status = [s for s, _ in respostas]
+            assert status == [200, 200, 404, 200, 200], f"Respostas do servidor: {status}"
+            assert respostas[0][1]['empresa']['razao_social'] == 'EMPRESA UM', (
+                f"Respostas do servidor: {status}")
+            print("✓ Rotas /cnpj, /uf e /busca respondem em JSON (mesma conexão)")
+            
+            _, metricas = consultar('/metricas')
+            assert metricas['cache']['acertos'] == 1, f"Métricas: {metricas}"
+            assert metricas['latencia']['/cnpj']['requisicoes'] == 3, f"Métricas: {metricas}"
+            print("✓ Cache de respostas e histograma de latência")
+            
+            # Nova geração dos dados (reimportação): a resposta em cache não vale mais
+            conn = sqlite3.connect(db_path)
+            conn.execute("UPDATE empresas SET razao_social = 'EMPRESA REIMPORTADA'")
+            registrar_geracao(conn)
+            conn.commit()
+            conn.close()
+            _, resposta = consultar('/cnpj/00.000.001/0001-91')
+            assert resposta['empresa']['razao_social'] == 'EMPRESA REIMPORTADA', (
+                f"Resposta em cache servida após nova geração: {resposta['empresa']['razao_social']}")
+            print("✓ Nova geração dos dados invalida as respostas em cache antes do TTL")
+            cliente.close()
+        finally:
+            asyncio.run_coroutine_threadsafe(servidor.parar(), loop).result(10)
+            loop.call_soon_threadsafe(loop.stop)
+    
+    print("\n=== TESTE DO SERVIDOR CONCLUÍDO COM SUCESSO! ===")
+
+
+def teste_cache_consultas():
+    """Testa o cache LRU das consultas por CNPJ e a invalidação por geração dos dados"""
+    print("\n=== TESTE DO CACHE DE CONSULTAS ===\n")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'teste.db')
+        CNPJDownloader(base_url='http://127.0.0.1/', download_dir=os.path.join(temp_dir, 'dados'),
+                       db_path=db_path)
+        
+        conn = sqlite3.connect(db_path)
+        conn.execute("INSERT INTO empresas (cnpj_basico, razao_social) VALUES ('00000001', 'NOME ANTIGO')")
+        registrar_geracao(conn)
+        conn.commit()
+        
+        with CNPJQuery(db_path, cache_tamanho=2, verificar_geracao_a_cada=0) as query:
+            query.buscar_empresa_por_cnpj('00000001')['razao_social'] = 'ALTERADO PELO CHAMADOR'
+            query.buscar_empresa_por_cnpj('00000001')
+            assert query.buscar_empresa_por_cnpj('00000001')['razao_social'] == 'NOME ANTIGO', (
+                "Resultado em cache alterado pelo chamador")
+            
+            # Sem nova geração o cache continua valendo
+            conn.execute("UPDATE empresas SET razao_social = 'NOME NOVO'")
+            conn.commit()
+            cache = query.estatisticas_cache()
+            assert query.buscar_empresa_por_cnpj('00000001')['razao_social'] == 'NOME ANTIGO', (
+                f"Cache: {cache}")
+            assert (cache['acertos'], cache['faltas']) == (2, 1), f"Cache: {cache}"
+            print("✓ Acertos e faltas contados, resultados protegidos contra alteração")
+            
+            registrar_geracao(conn)
+            conn.commit()
+            assert query.buscar_empresa_por_cnpj('00000001')['razao_social'] == 'NOME NOVO', (
+                "Cache não foi invalidado pela nova geração")
+            print("✓ Nova geração dos dados invalida o cache")
+            
+            for cnpj in ('00000002', '00000003', '00000004'):
+                query.buscar_empresa_por_cnpj(cnpj)
+            assert query.estatisticas_cache()['itens'] == 2, (
+                f"Cache acima da capacidade: {query.estatisticas_cache()}")
+            print("✓ Capacidade respeitada (inclusive CNPJs inexistentes)")
+            
+            # Sem banco_id (geração sendo refeita ou banco sem controle): nada entra no cache
+            conn.execute("DELETE FROM metadados WHERE chave = 'banco_id'")
+            conn.commit()
+            query.buscar_empresa_por_cnpj('00000001')
+            conn.execute("UPDATE empresas SET razao_social = 'NOME SEM GERACAO'")
+            conn.commit()
+            assert query.buscar_empresa_por_cnpj('00000001')['razao_social'] == 'NOME SEM GERACAO', (
+                f"Consulta guardada sem banco_id: {query.estatisticas_cache()}")
+            assert query.estatisticas_cache()['itens'] == 0, (
+                f"Consulta guardada sem banco_id: {query.estatisticas_cache()}")
+            print("✓ Sem banco_id as consultas vão sempre ao banco")
+        
+        conn.close()
+    
+    print("\n=== TESTE DO CACHE CONCLUÍDO COM SUCESSO! ===")
+
 
 def teste_basico():
     """Teste básico do sistema"""
@@ -33,7 +1342,7 @@ def teste_basico():
         print("\nPrimeiros 5 arquivos encontrados:")
         for file_info in files[:5]:
             print(f"  - {file_info['filename']} ({file_info['size']})")
-        
+    
     except Exception as e:
         print(f"✗ Erro na conexão: {e}")
         return False
@@ -44,7 +1353,7 @@ def teste_basico():
         stats = downloader.get_database_stats()
         print("✓ Banco de dados criado com sucesso")
         print(f"  Tabelas criadas: {len(stats)}")
-        
+    
     except Exception as e:
         print(f"✗ Erro no banco: {e}")
         return False
@@ -57,5 +1366,34 @@ def teste_basico():
     
     return True
 
+def executar_testes(*testes):
+    """
+    Executa os testes em sequência, parando na primeira falha
+    
+    Args:
+        testes: Funções de teste, que falham levantando AssertionError
+    
+    Returns:
+        True se todos os testes passaram
+    """
+    for teste in testes:
+        try:
+            teste()
+        except AssertionError as e:
+            print(f"✗ {e}")
+            return False
+    return True
+
 if __name__ == "__main__":
-    teste_basico()
+    if '--local' in sys.argv:
+        # Testes que não dependem do site da Receita Federal
+        sucesso = executar_testes(
+            teste_download_local, teste_importacao_pipeline, teste_atualizacao_incremental,
+            teste_download_async, teste_descoberta_releases, teste_plano_exportacao,
+            teste_exportacao_estados, teste_exportacao_paralela, teste_exportacao_comprimida,
+            teste_exportacao_inalterados, teste_estatisticas, teste_retomada_exportacao,
+            teste_exportacao_socios, teste_busca_textual, teste_consulta_lote,
+            teste_servidor_consulta, teste_cache_consultas)
+    else:
+        sucesso = teste_basico()
+    sys.exit(0 if sucesso else 1)